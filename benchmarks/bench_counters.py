@@ -0,0 +1,70 @@
+'''
+Contention benchmark for the counters in :py:mod:`boots.common.utils`.
+
+Runs 1 to 64 threads that increment a shared counter and reports the throughput of the lock based counter that
+new_counter used to be (reproduced below as legacy_counter), new_counter and :py:class:`ShardedCounter`. If gevent
+is installed, the same is run with greenlets (in a separate process, since gevent has to monkey patch first).
+Run it as::
+
+    python -m benchmarks.bench_counters [increments_per_thread]
+'''
+import subprocess
+import sys
+import threading
+import time
+
+def legacy_counter(seed=0):
+    ''' new_counter as it used to be - a generator behind an RLock. Kept here only for comparison '''
+    lock = threading.RLock()
+    def _internal_counter(seed):
+        while 1:
+            retval = seed
+            seed += 1
+            yield retval
+    nexter = _internal_counter(seed).next
+    def _generator_wrapper():
+        with lock:
+            return nexter()
+    return _generator_wrapper
+
+def run(spawn, join, workers, increments, make_incrementer):
+    incrementer = make_incrementer()
+    def work():
+        for _ in xrange(increments): incrementer()
+    start = time.time()
+    join([ spawn(work) for _ in range(workers) ])
+    return workers * increments / (time.time() - start)
+
+def start_thread(fn):
+    t = threading.Thread(target=fn)
+    t.start()
+    return t
+
+def join_threads(threads):
+    [ t.join() for t in threads ]
+
+def main(increments, spawn=start_thread, join=join_threads):
+    from boots.common.utils import new_counter, ShardedCounter
+    variants = [ ('legacy', legacy_counter), ('new_counter', new_counter), ('sharded', lambda: ShardedCounter().increment) ]
+    print '%8s' % 'workers' + ''.join('%20s' % ('%s (M/s)' % name) for name, _ in variants)
+    for workers in [1, 2, 4, 8, 16, 32, 64]:
+        rates = [ run(spawn, join, workers, increments, make) for _, make in variants ]
+        print '%8d' % workers + ''.join('%20.2f' % (rate / 1e6) for rate in rates)
+
+if __name__ == '__main__':
+    increments = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if len(sys.argv) > 2 and sys.argv[2] == 'gevent':
+        import boots.use_gevent #@UnusedImport - monkey patches and sets the concurrency to gevent
+        import gevent
+        main(increments, spawn=gevent.spawn, join=gevent.joinall)
+    else:
+        print 'threads'
+        main(increments)
+        try:
+            import gevent #@UnusedImport
+        except ImportError:
+            print 'gevent is not installed. Skipping greenlets'
+        else:
+            print 'greenlets'
+            sys.stdout.flush()
+            subprocess.call([ sys.executable, '-m', 'benchmarks.bench_counters', str(increments), 'gevent' ])
@@ -0,0 +1,44 @@
+'''
+Micro-benchmark for the WSGI middleware pipeline of :py:class:`boots.servers.httpserver.HTTPBaseServer`.
+
+Measures the per-request cost of a server with a session middleware after repeated updates of the session configuration
+(as by /admin/updateconfig). Updates used to wrap the app in another layer each time; the pipeline is now rebuilt from scratch
+so the cost should stay constant. The legacy column wraps the app on every update for comparison.
+Run it as::
+
+    python -m benchmarks.bench_middleware [iterations]
+'''
+from boots.servers.httpserver import HTTPBaseServer
+import beaker.middleware as bkmw
+import sys
+import timeit
+
+session_config = { 'session.type': 'memory', 'session.key': 'bench' }
+
+def app(environ, start_response):
+    start_response('200 OK', [ ('Content-Type', 'text/plain') ])
+    return [ 'ok' ]
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+def environ():
+    return { 'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'QUERY_STRING': '', 'SERVER_NAME': 'bench', 'SERVER_PORT': '80',
+             'wsgi.url_scheme': 'http' }
+
+def bench(updates, iterations, legacy=False):
+    server = HTTPBaseServer(name='bench')
+    server.base_app = app
+    server.rebuild_app()
+    for _ in range(updates): # as by session_config_update
+        if legacy:
+            server.app = bkmw.SessionMiddleware(server.app, session_config, environ_key='bench')
+        else:
+            server.set_middleware('Session', lambda app: bkmw.SessionMiddleware(app, session_config, environ_key='bench'))
+    return min(timeit.repeat(lambda: server(environ(), start_response), number=iterations, repeat=3)) / iterations
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print '%8s %14s %14s' % ('updates', 'legacy (us)', 'rebuilt (us)')
+    for updates in [1, 5, 20, 50]:
+        print '%8d %14.2f %14.2f' % (updates, bench(updates, iterations, legacy=True) * 1e6, bench(updates, iterations) * 1e6)
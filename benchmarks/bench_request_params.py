@@ -0,0 +1,97 @@
+'''
+Micro-benchmark for :py:class:`boots.endpoints.http_ep.RequestParams`.
+
+Compares the compiled binding plan used by RequestParams with the per-request resolution that
+RequestParams used to do (reproduced below as LegacyRequestParams) on routes with 1, 10 and 50 parameters.
+Run it as::
+
+    python -m benchmarks.bench_request_params [iterations]
+'''
+from boots.endpoints.http_ep import RequestParams
+from functools import wraps
+import bottle
+import inspect
+import logging
+import sys
+import timeit
+import types
+
+class LegacyRequestParams(RequestParams):
+    ''' RequestParams as it resolved converters on every request. Kept here only for comparison '''
+    
+    def apply(self, callback, context):
+        params = context['config'].get('params', {})
+        f_args, _, _, f_defaults = inspect.getargspec(callback) if not hasattr(callback, '_signature') else callback._signature
+        if f_defaults is None: f_defaults = []
+        f_args = f_args[1:]
+        mandatory_args, _ = (f_args[:-len(f_defaults)], f_args[-len(f_defaults):]) if len(f_defaults) is not 0 else (f_args, [])
+        method = context['method']
+
+        @wraps(callback)
+        def wrapper(*args, **kargs):
+            req_params = bottle.request.POST if method == 'POST' or method =='ANY' and len(bottle.request.POST.keys()) else bottle.request.GET
+            for arg in f_args:
+                converter = params.get(arg, lambda x: x)
+                if converter == bool: converter = self.boolean
+                multivalue = type(converter) in [list, tuple]
+                if multivalue:
+                    converter = converter[0] if len(converter) > 0 else lambda x: x
+                    if converter == bool: converter = self.boolean
+                    try:
+                        values = [ converter(val) for val in filter(lambda x: x != '', req_params.getall(arg)) ]
+                    except (ValueError, Exception) as e: 
+                        logging.getLogger().error('Wrong parameter format for: %s. %s', arg, e)
+                        bottle.abort(400, 'Wrong parameter format for: {}'.format(arg))
+                    if len(values) != 0:
+                        kargs[arg] = values
+                else:
+                    value = req_params.get(arg) or kargs.get(arg)
+                    try:
+                        if value is not None:
+                            value = converter(value)
+                    except (ValueError, Exception) as e: 
+                        logging.getLogger().error('Wrong parameter format for: %s. %s', arg, e)
+                        bottle.abort(400, 'Wrong parameter format for: {}'.format(arg))
+                    if value is not None:
+                        kargs[arg] = value
+            missing_params = []
+            for m in mandatory_args:
+                if m not in kargs:
+                    missing_params += [m]
+            if len(missing_params) != 0:
+                bottle.abort(400, 'Missing parameters: {}'.format(", ".join(missing_params)))
+            return callback(*args, **kargs)
+        
+        self.plugin_post_apply(callback, wrapper)
+        return wrapper
+
+class Handlers(object):
+    ''' route handlers with 1, 10 and 50 parameters. A third of them are int, a third bool and a third lists of str '''
+    
+    def make(self, count):
+        names = [ 'p%d' % i for i in range(count) ]
+        converters = [ int, bool, [str] ]
+        params = dict((name, converters[i % 3]) for i, name in enumerate(names))
+        # the 1st half are mandatory, the rest are optional
+        mandatory, optional = names[:(count + 1) // 2], names[(count + 1) // 2:]
+        arglist = ', '.join(['self'] + mandatory + [ '%s=None' % n for n in optional ])
+        namespace = {}
+        exec 'def handler(%s): return None' % arglist in namespace
+        query = '&'.join('%s=%s' % (name, ('1', 'true', 'abc')[i % 3]) for i, name in enumerate(names))
+        return types.MethodType(namespace['handler'], self), params, query
+    
+def bench(plugin_class, count, iterations):
+    callback, params, query = Handlers().make(count)
+    context = dict(config=dict(params=params), method='GET')
+    wrapper = plugin_class().apply(callback, context)
+    bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'QUERY_STRING': query, 'PATH_INFO': '/' })
+    wrapper() # parse the query string once so that both variants start with a warm request
+    return min(timeit.repeat(lambda: wrapper(), number=iterations, repeat=3)) / iterations
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print '%8s %14s %14s %8s' % ('params', 'legacy (us)', 'compiled (us)', 'speedup')
+    for count in [1, 10, 50]:
+        legacy = bench(LegacyRequestParams, count, iterations)
+        compiled = bench(RequestParams, count, iterations)
+        print '%8d %14.2f %14.2f %7.2fx' % (count, legacy * 1e6, compiled * 1e6, legacy / compiled)
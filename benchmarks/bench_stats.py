@@ -0,0 +1,66 @@
+'''
+Contention benchmark for :py:class:`boots.servers.managedserver.StatsCollection`.
+
+Runs 1 to 64 threads that record request latencies (as the Stats plugin does for every request) and reports the throughput of
+the lock based collection that StatsCollection used to be (reproduced below as LegacyStatsCollection) and of the sharded 
+StatsCollection, along with the time to read (merge) the statistics afterwards. With CPython's GIL, threads do not run in parallel,
+so throughput cannot grow with threads - the point is that the sharded collection does not lose throughput to lock contention.
+Run it as::
+
+    python -m benchmarks.bench_stats [adds_per_thread]
+'''
+import random
+import sys
+import threading
+import time
+from boots.servers.managedserver import StatsCollection, StatsEntry
+
+class LegacyStatsCollection(object):
+    ''' StatsCollection as it used to be - a shared dict behind a class level RLock. Kept here only for comparison '''
+    lock = threading.RLock()
+    statstable = {}
+    
+    @classmethod
+    def get(cls):
+        with cls.lock:
+            for entry in cls.statstable.itervalues():
+                entry.update_percentiles()
+            return cls.statstable
+        
+    @classmethod
+    def add(cls, __name, __delta, __url, **kargs):
+        with cls.lock:
+            cls.statstable.setdefault(__name, StatsEntry()).add(__delta, __url, **kargs)
+
+def reset():
+    LegacyStatsCollection.statstable = {}
+    StatsCollection.shards[:] = []
+    StatsCollection.retired = {}
+    StatsCollection._local = threading.local()
+
+def run(collection, workers, adds):
+    names = [ 'route%d' % i for i in range(20) ]
+    latencies = [ random.expovariate(50) for _ in range(1000) ]
+    def work():
+        for i in xrange(adds):
+            collection.add(names[i % 20], latencies[i % 1000], '/')
+    threads = [ threading.Thread(target=work) for _ in range(workers) ]
+    start = time.time()
+    [ t.start() for t in threads ]
+    [ t.join() for t in threads ]
+    rate = workers * adds / (time.time() - start)
+    start = time.time()
+    stats = collection.get()
+    assert sum(entry['total_count'] for entry in stats.itervalues()) == workers * adds
+    return rate, time.time() - start
+
+def main(adds):
+    print '%8s %16s %16s %16s %16s' % ('threads', 'legacy (K/s)', 'sharded (K/s)', 'legacy get (ms)', 'sharded get (ms)')
+    for workers in [1, 2, 4, 8, 16, 32, 64]:
+        reset()
+        legacy, legacy_get = run(LegacyStatsCollection, workers, adds)
+        sharded, sharded_get = run(StatsCollection, workers, adds)
+        print '%8d %16.1f %16.1f %16.2f %16.2f' % (workers, legacy / 1e3, sharded / 1e3, legacy_get * 1e3, sharded_get * 1e3)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
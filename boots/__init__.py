@@ -33,3 +33,31 @@ class concurrency(object):
 class use_logging(object):
     __metaclass__ = state_meta
     state = 'logging'
+
+class mode(object):
+    '''
+    The runtime mode - development (the default) or production. Set it through :py:meth:`set` (servers set it from the
+    mode in the [Boots] section of the configuration or --mode on the command line). In production mode
+    
+    * bottle's debug mode is off (unless explicitly enabled through [Serving] debug) so templates are cached
+    * :py:class:`WrapException` responds with the error message alone - tracebacks are not formatted into responses
+    * :py:class:`Tracer` writes traces from a background thread (unless configured otherwise)
+    * logging does not collect multiprocessing information and does not print errors raised while emitting records
+    
+    Code should compare with the mode (e.g. boots.mode == boots.mode.PRODUCTION) each time rather than caching it
+    '''
+    __metaclass__ = state_meta
+    PRODUCTION, DEVELOPMENT = 'production', 'development'
+    MODES = [ PRODUCTION, DEVELOPMENT ]
+    state = DEVELOPMENT
+    
+    @classmethod
+    def set(cls, new_mode):
+        if new_mode not in cls.MODES:
+            raise ValueError('Unknown mode %s. Should be one of %s' % (new_mode, cls.MODES))
+        cls.state = new_mode
+        import logging
+        production = new_mode == cls.PRODUCTION
+        logging.raiseExceptions = not production
+        logging.logMultiprocessing = not production
+
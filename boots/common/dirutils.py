@@ -6,7 +6,7 @@ Created on 08-Feb-2013
 A set of methods to assist with folders and validation of folders
 '''
 import logging
-from os.path import abspath, getmtime, splitext, dirname, exists, join, isdir
+from os.path import abspath, getmtime, splitext, dirname, exists, join, isdir, realpath
 from fnmatch import fnmatch
 import os
 import zipfile
@@ -123,9 +123,21 @@ class DirUtils(object):
         '''
         absprefix = abspath(join(base_dir, sub_dir)) if sub_dir is not None else abspath(base_dir)
         newpath = abspath(join(absprefix, path))
-        if not newpath.startswith(absprefix):
+        if not self.is_within(absprefix, newpath):
             raise ValueError('path parameter '+path+' invalid.' + ' base = ' + absprefix + ' newpath = ' + newpath)
         return newpath
+    
+    @staticmethod
+    def is_within(base_dir, path):
+        '''
+        Checks if path is base_dir or resides within it. Symbolic links are resolved, so a link that points outside base_dir is
+        not within it, and a sibling that shares a prefix (e.g. /data2 for /data) is not within it either
+        :param str base_dir: The base directory
+        :param str path: The path to check
+        :returns: bool
+        '''
+        base_dir, path = realpath(base_dir), realpath(path)
+        return path == base_dir or path.startswith(base_dir.rstrip(os.sep) + os.sep)
                     
     def get_files(self, path, glob='*', regexp=None, recursive=False):
         '''
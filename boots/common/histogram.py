@@ -0,0 +1,139 @@
+'''
+A fixed memory, log-linear histogram (in the style of HDR histograms) for latencies.
+
+Values are counted in buckets whose width grows with the value - each power of 2 is split into a fixed number of linear
+sub-buckets. The relative error of a reported value is bounded (about 3% with the default 5 significant bits) and the memory
+is fixed (a few hundred counters) however many values are recorded. Histograms with the same settings merge by adding their
+counters, so histograms of threads, processes or time windows can be combined cheaply.
+
+Values may also be counted exactly against a few fixed bounds (e.g. the buckets of an exported Prometheus histogram), which
+do not in general coincide with the edges of the log-linear buckets (see :py:meth:`LatencyHistogram.cumulative`).
+
+**Example**::
+
+    h = LatencyHistogram()
+    for latency in latencies: h.record(latency)
+    print h.percentiles() # { 'p50': ..., 'p90': ..., 'p99': ..., 'p999': ... }
+'''
+from __future__ import division
+from array import array
+from bisect import bisect_left
+import math
+
+class LatencyHistogram(object):
+    '''
+    a histogram of latencies (in seconds) recorded with a resolution of unit seconds (microseconds by default) upto
+    2 ** max_bits units (about 12 days with the defaults). Larger values are counted in the last bucket
+    '''
+
+    #: the percentiles reported by :py:meth:`percentiles` - key to fraction
+    reported = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+    def __init__(self, sub_bucket_bits=5, max_bits=40, unit=1e-6, bounds=None):
+        '''
+        :param sub_bucket_bits: the number of significant bits of a bucket (i.e. 2 ** sub_bucket_bits / 2 sub-buckets per power of 2)
+        :param max_bits: the number of bits of the largest value (in units) that is counted accurately
+        :param unit: the resolution (in seconds) of the histogram
+        :param bounds: optional (sorted) bounds (in seconds) that values are also counted against exactly - the number of values
+            at or below each of them is then reported exactly by :py:meth:`cumulative`
+        '''
+        self.sub_bucket_bits, self.max_bits, self.unit = sub_bucket_bits, max_bits, unit
+        self.sub_buckets = 1 << sub_bucket_bits
+        self.half = self.sub_buckets >> 1
+        self.counts = array('l', [0]) * (self.sub_buckets + (max_bits - sub_bucket_bits) * self.half)
+        self.total = 0
+        self.exact_bounds = tuple(bounds) if bounds else None
+        # the values above the previous bound and at or below each bound (the last counter is of the values above all of them)
+        self.exact_counts = array('l', [0]) * (len(self.exact_bounds) + 1) if self.exact_bounds else None
+
+    def index(self, units):
+        ''' the bucket of a value (in units) '''
+        if units < self.sub_buckets:
+            return max(units, 0)
+        shift = units.bit_length() - self.sub_bucket_bits
+        index = self.sub_buckets + (shift - 1) * self.half + (units >> shift) - self.half
+        return min(index, len(self.counts) - 1)
+
+    def bounds(self, index):
+        ''' the lowest and highest values (in units) of a bucket '''
+        if index < self.sub_buckets:
+            return index, index
+        shift, sub = divmod(index - self.sub_buckets, self.half)
+        low = (sub + self.half) << (shift + 1)
+        return low, low + (1 << (shift + 1)) - 1
+
+    def record(self, value, count=1):
+        ''' records a value (in seconds) '''
+        self.counts[self.index(int(value / self.unit))] += count
+        self.total += count
+        if self.exact_bounds is not None:
+            self.exact_counts[bisect_left(self.exact_bounds, value)] += count
+
+    def merge(self, other):
+        ''' adds the counts of another histogram (with the same settings) to this one '''
+        if len(other.counts) != len(self.counts) or other.unit != self.unit or other.exact_bounds != self.exact_bounds:
+            raise ValueError('Histograms with different settings cannot be merged')
+        counts = self.counts
+        for i, count in enumerate(other.counts):
+            if count: counts[i] += count
+        self.total += other.total
+        if self.exact_bounds is not None:
+            for i, count in enumerate(other.exact_counts):
+                self.exact_counts[i] += count
+        return self
+
+    def percentile(self, fraction):
+        ''' returns the value (in seconds) at this fraction (e.g. 0.99) of the recorded values or None if none are recorded '''
+        if not self.total:
+            return None
+        return self._at([ ('value', fraction) ])['value']
+
+    def percentiles(self):
+        ''' returns a dict of the :py:attr:`reported` percentiles (in seconds) '''
+        if not self.total:
+            return dict((key, None) for key, _ in self.reported)
+        return self._at(self.reported)
+
+    def _at(self, fractions):
+        ''' returns the values at the (sorted) fractions - a dict of key to value (in seconds, the middle of its bucket) - in one pass '''
+        pending = [ (key, max(1, int(math.ceil(fraction * self.total - 1e-9)))) for key, fraction in fractions ] # 1-based ranks
+        result, seen = {}, 0
+        for index, count in enumerate(self.counts):
+            if not count: continue
+            seen += count
+            while pending and seen >= pending[0][1]:
+                low, high = self.bounds(index)
+                result[pending.pop(0)[0]] = (low + high) / 2 * self.unit
+            if not pending: break
+        return result
+
+    def cumulative(self, bounds):
+        '''
+        returns the number of values at or below each of the (sorted) bounds (in seconds) - e.g. the buckets of a Prometheus 
+        histogram. The counts are exact if the bounds are those the histogram was created with. Otherwise they are estimated 
+        from the log-linear buckets - a bucket is counted at or below a bound only if all its values are, so a count never 
+        includes values above its bound (but may miss values of the bucket that spans the bound)
+        '''
+        if self.exact_bounds is not None and tuple(bounds) == self.exact_bounds:
+            result, seen = [], 0
+            for count in self.exact_counts[:-1]:
+                seen += count
+                result.append(seen)
+            return result
+        result, seen, i = [], 0, 0
+        for index, count in enumerate(self.counts):
+            if not count: continue
+            above = (self.bounds(index)[1] + 1) * self.unit # the values of the bucket are below this
+            while i < len(bounds) and bounds[i] < above:
+                result.append(seen)
+                i += 1
+            seen += count
+        return result + [ seen ] * (len(bounds) - i)
+
+    def clear(self):
+        for i in xrange(len(self.counts)):
+            self.counts[i] = 0
+        self.total = 0
+        if self.exact_bounds is not None:
+            for i in xrange(len(self.exact_counts)):
+                self.exact_counts[i] = 0
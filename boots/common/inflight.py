@@ -0,0 +1,129 @@
+'''
+InFlight is a registry of the work in flight (requests being served, messages being processed) in this process.
+Endpoints register work as it starts and completes. On stop, a server drains - it stops accepting new work, waits for
+the work in flight to complete (up to a timeout) and then closes its endpoints.
+
+Work is counted by kind (e.g. 'http' or 'zmq'). Typical use::
+
+    if not InFlight.enter('zmq'): # draining - do not start new work
+        return
+    try:
+        process(msg)
+    finally:
+        InFlight.exit('zmq')
+
+'''
+from boots import concurrency
+from boots.common.utils import ShardedCounter, Gauge
+import time
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+elif concurrency == 'threading':
+    from threading import RLock
+
+class InFlight(object):
+    '''
+    the (process wide) registry of work in flight. All methods are classmethods. 
+    
+    Work is counted in a :py:class:`boots.common.utils.Gauge` per kind - :py:meth:`enter` and :py:meth:`exit` (i.e. every
+    request) do not take the lock, which is only taken to add a kind and by :py:meth:`drain` and :py:meth:`stats`
+    '''
+
+    lock = RLock()
+    #: False once a drain has started. New work is refused
+    accepting = True
+    #: work in flight, by kind (a Gauge each)
+    counts = {}
+    #: work refused (since draining), by kind (a ShardedCounter each)
+    refused = {}
+    #: the report of the last drain (see :py:meth:`drain`)
+    last_drain = None
+
+    @classmethod
+    def _counter(cls, counters, kind, counter_class=Gauge):
+        ''' returns the counter of this kind, adding it on first use '''
+        counter = counters.get(kind)
+        if counter is None:
+            with cls.lock:
+                counter = counters.get(kind)
+                if counter is None:
+                    counter = counters[kind] = counter_class()
+        return counter
+
+    @classmethod
+    def enter(cls, kind):
+        '''
+        registers the start of work of this kind. returns False (and registers nothing) if draining - the work should be refused
+        '''
+        if cls.accepting:
+            gauge = cls._counter(cls.counts, kind)
+            gauge.increment()
+            if cls.accepting: # checked again after the increment, so a drain that has started sees this work
+                return True
+            gauge.decrement()
+        cls._counter(cls.refused, kind, ShardedCounter).increment()
+        return False
+
+    @classmethod
+    def admit(cls, kind):
+        '''
+        registers the start of work of this kind even if draining - for work that has already been accepted (e.g. a message that
+        has been read off a socket) and would otherwise be lost
+        '''
+        cls._counter(cls.counts, kind).increment()
+
+    @classmethod
+    def exit(cls, kind):
+        ''' registers the completion of work of this kind that was started with :py:meth:`enter` '''
+        cls._counter(cls.counts, kind).decrement()
+
+    @classmethod
+    def _values(cls, counters):
+        with cls.lock:
+            counters = dict(counters)
+        return dict((kind, counter.value()) for kind, counter in counters.iteritems())
+
+    @classmethod
+    def in_flight(cls, kind=None):
+        ''' returns the number of work items in flight of this kind (or all kinds) '''
+        if kind is not None:
+            gauge = cls.counts.get(kind)
+            return gauge.value() if gauge is not None else 0
+        return sum(cls._values(cls.counts).itervalues())
+
+    @classmethod
+    def drain(cls, timeout=10, poll=0.05):
+        '''
+        stops accepting work and waits (up to timeout seconds) for the work in flight to complete. Returns (and records in
+        :py:attr:`last_drain`) a dict with the duration of the drain (seconds), the work in flight when the drain started,
+        the work completed and the work dropped (still in flight at the timeout) - the latter by kind
+        '''
+        start = time.time()
+        with cls.lock:
+            cls.accepting = False
+            pending = cls._values(cls.counts)
+        deadline = start + (timeout or 0)
+        while cls.in_flight() > 0 and time.time() < deadline:
+            time.sleep(poll)
+        with cls.lock:
+            dropped = dict((kind, count) for kind, count in cls._values(cls.counts).iteritems() if count > 0)
+            report = dict(duration=time.time() - start, pending=sum(pending.itervalues()),
+                          completed=sum(pending.itervalues()) - sum(dropped.itervalues()), dropped=dropped, timeout=timeout)
+            # drains of sub servers (or repeated stops) should not overwrite a drain that had work to wait for
+            if cls.last_drain is None or report['pending'] or not cls.last_drain['pending']:
+                cls.last_drain = report
+        return report
+
+    @classmethod
+    def resume(cls):
+        ''' accepts work again (after a drain) '''
+        with cls.lock:
+            cls.accepting = True
+            cls.refused.clear()
+
+    @classmethod
+    def stats(cls):
+        ''' returns a dict with the work in flight and refused (by kind), whether draining and the report of the last drain '''
+        with cls.lock:
+            return dict(draining=not cls.accepting, in_flight=cls._values(cls.counts), refused=cls._values(cls.refused), 
+                        last_drain=cls.last_drain)
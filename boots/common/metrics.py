@@ -0,0 +1,88 @@
+'''
+Rendering of metrics in the Prometheus text exposition format (version 0.0.4), as served by the /admin/metrics route of a
+:py:class:`boots.servers.managedserver.ManagedServer`.
+
+A :py:class:`MetricFamily` is a named metric (a counter, gauge or histogram) with its samples. Each sample has a set of labels.
+:py:func:`render` renders a list of families.
+
+**Example**::
+
+    requests = MetricFamily('boots_requests_total', 'counter', 'requests handled')
+    requests.add(10, route='get_user', status='2xx')
+    print render([ requests ]) # boots_requests_total{route="get_user",status="2xx"} 10
+'''
+
+#: the Content-Type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: the default buckets (upper bounds in seconds) of latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricFamily(object):
+    ''' a metric and its samples. Samples with a value of None are not rendered '''
+
+    def __init__(self, name, metric_type, doc, **labels):
+        '''
+        :param name: the name of the metric (e.g. boots_requests_total)
+        :param metric_type: counter, gauge, histogram or untyped
+        :param doc: the help text of the metric
+        :param labels: labels that are common to all the samples (e.g. server)
+        '''
+        self.name, self.type, self.doc = name, metric_type, doc
+        self.labels = labels
+        self.samples = []
+
+    def add(self, value, _suffix='', **labels):
+        '''
+        adds a sample
+
+        :param value: the value of the sample
+        :param _suffix: appended to the name of the metric (e.g. _bucket, _sum or _count of a histogram)
+        :param labels: the labels of the sample
+        '''
+        self.samples.append((self.name + _suffix, dict(self.labels, **labels), value))
+        return self
+
+    def add_histogram(self, cumulative, bounds, count, total, **labels):
+        '''
+        adds the samples of a histogram
+
+        :param cumulative: the number of values at or below each of the bounds
+        :param bounds: the upper bounds of the buckets
+        :param count: the number of values
+        :param total: the sum of the values
+        '''
+        for bound, below in zip(bounds, cumulative):
+            self.add(below, '_bucket', le=format_value(bound), **labels)
+        self.add(count, '_bucket', le='+Inf', **labels)
+        self.add(total, '_sum', **labels)
+        self.add(count, '_count', **labels)
+        return self
+
+def escape(value):
+    ''' escapes a label value '''
+    value = value.decode('utf-8', 'replace') if isinstance(value, str) else unicode(value)
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        if value != value: return 'NaN'
+        if value in (float('inf'), float('-inf')): return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+def render(families):
+    ''' returns the text exposition (utf-8) of a list of :py:class:`MetricFamily`. Families without samples are skipped '''
+    lines = []
+    for family in families:
+        samples = [ sample for sample in family.samples if sample[2] is not None ]
+        if not samples: continue
+        lines.append('# HELP %s %s' % (family.name, family.doc.replace('\\', '\\\\').replace('\n', '\\n')))
+        lines.append('# TYPE %s %s' % (family.name, family.type))
+        for name, labels, value in samples:
+            if labels:
+                name = '%s{%s}' % (name, ','.join('%s="%s"' % (key, escape(val)) for key, val in sorted(labels.iteritems())))
+            lines.append('%s %s' % (name, format_value(value)))
+    return (u'\n'.join(lines) + u'\n').encode('utf-8')
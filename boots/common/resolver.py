@@ -0,0 +1,172 @@
+'''
+Resolver is a process wide cache of host name resolutions (DNS) used by the HTTP client endpoints and the ZMQ endpoints.
+
+Resolutions are cached for :py:attr:`Resolver.ttl` seconds. Hosts that do not exist are cached too (negative caching) for
+:py:attr:`Resolver.negative_ttl` seconds, so that an unresolvable host fails fast rather than hitting the resolver on every
+request. Transient failures (e.g. a resolver that is not reachable) are not cached. The cache holds the most recently used
+:py:attr:`Resolver.max_entries` hosts. Hosts may be resolved ahead of use (e.g. at startup) in the background with :py:meth:`Resolver.prefetch`.
+The hit rate and the latency of resolutions are available through :py:meth:`Resolver.stats`.
+
+Typical use::
+
+    address = Resolver.gethostbyname('backend.local')
+    sock = Resolver.create_connection(('backend.local', 80), timeout=5)
+'''
+from boots import concurrency
+from boots.common.utils import ShardedCounter, LRUCache
+from boots.common.threadpool import InstancedThreadPool
+import socket
+import time
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+elif concurrency == 'threading':
+    from threading import RLock
+
+class Resolver(object):
+    '''
+    the (process wide) cache of resolutions. All methods are classmethods
+    '''
+
+    lock = RLock()
+    #: the time (in seconds) for which a resolution is cached
+    ttl = 300.0
+    #: the time (in seconds) for which a host that does not exist is cached
+    negative_ttl = 30.0
+    #: the errors (of socket.gaierror) that imply the host does not exist (rather than a transient failure) - and are cached
+    negative_errors = frozenset(getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA') if hasattr(socket, name))
+    #: the maximum number of resolutions cached
+    max_entries = 1024
+    #: (host, family, socktype) to (expires at, result of getaddrinfo (without a port) or the args of the socket.gaierror)
+    cache = LRUCache(max_entries)
+    hits = ShardedCounter()
+    misses = ShardedCounter()
+    failures = ShardedCounter()
+    #: the number, total and maximum latency (in seconds) of resolutions
+    latency = dict(count=0, total=0.0, max=0.0)
+
+    @classmethod
+    def configure(cls, ttl=None, negative_ttl=None, max_entries=None, **kargs):
+        ''' updates the settings of the cache (e.g. from the configuration) '''
+        if ttl is not None: cls.ttl = float(ttl)
+        if negative_ttl is not None: cls.negative_ttl = float(negative_ttl)
+        if max_entries is not None: cls.max_entries = cls.cache.maxsize = int(max_entries)
+
+    @staticmethod
+    def is_address(host):
+        ''' whether host is an IP address (rather than a name) '''
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                socket.inet_pton(family, host)
+                return True
+            except (socket.error, ValueError, TypeError):
+                pass
+        return False
+
+    @classmethod
+    def getaddrinfo(cls, host, port, family=0, socktype=0):
+        ''' as socket.getaddrinfo - from the cache if resolved (or found not to exist) recently. port is a number (or None) '''
+        if not host or cls.is_address(host) or (port is not None and not str(port).isdigit()):
+            return socket.getaddrinfo(host, port, family, socktype)
+        key = (host, family, socktype)
+        entry = cls.cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            cls.hits.increment()
+            if isinstance(entry[1], tuple): # a new error each time - a raised exception carries its traceback
+                raise socket.gaierror(*entry[1])
+            return cls._with_port(entry[1], port)
+
+        cls.misses.increment()
+        start = time.time()
+        try:
+            result = socket.getaddrinfo(host, None, family, socktype)
+        except socket.gaierror as err:
+            cls.failures.increment()
+            cls._resolved(start)
+            if err.args and err.args[0] in cls.negative_errors:
+                cls.cache.put(key, (time.time() + cls.negative_ttl, err.args))
+            raise
+        cls._resolved(start)
+        cls.cache.put(key, (time.time() + cls.ttl, result))
+        return cls._with_port(result, port)
+
+    @classmethod
+    def _resolved(cls, start):
+        ''' records the latency of a resolution that started at start '''
+        latency = time.time() - start
+        with cls.lock:
+            cls.latency['count'] += 1
+            cls.latency['total'] += latency
+            cls.latency['max'] = max(cls.latency['max'], latency)
+
+    @staticmethod
+    def _with_port(infos, port):
+        ''' returns the results of getaddrinfo with the port in their socket addresses '''
+        if port is None:
+            return infos
+        port = int(port)
+        return [ (family, socktype, proto, canonname, (sockaddr[0], port) + tuple(sockaddr[2:]))
+                 for family, socktype, proto, canonname, sockaddr in infos ]
+
+    @classmethod
+    def gethostbyname(cls, host):
+        ''' as socket.gethostbyname - returns the (first) IPv4 address of host '''
+        for family, _, _, _, sockaddr in cls.getaddrinfo(host, None, 0, socket.SOCK_STREAM):
+            if family == socket.AF_INET:
+                return sockaddr[0]
+        return cls.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+
+    @classmethod
+    def create_connection(cls, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        ''' as socket.create_connection - connects to (host, port) trying each of the addresses of host in turn '''
+        host, port = address
+        err = None
+        for family, socktype, proto, _, sockaddr in cls.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except socket.error as e:
+                err = e
+                if sock is not None:
+                    sock.close()
+        raise err if err is not None else socket.error('getaddrinfo returns an empty list')
+
+    @classmethod
+    def prefetch(cls, hosts):
+        '''
+        resolves hosts (a list of host names) in the background (on the :py:class:`InstancedThreadPool`) so that later resolutions
+        are cached. Failures are cached (and logged by the caller when the host is used)
+        '''
+        def resolve(host):
+            try:
+                cls.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+            except socket.error:
+                pass
+        pool = InstancedThreadPool()
+        for host in hosts:
+            pool.apply_async(resolve, (host,))
+
+    @classmethod
+    def invalidate(cls, host=None):
+        ''' removes the resolutions of host (or all hosts) from the cache '''
+        if host is None:
+            cls.cache.clear()
+        else:
+            for key in [ k for k in cls.cache.keys() if k[0] == host ]:
+                cls.cache.pop(key)
+
+    @classmethod
+    def stats(cls):
+        ''' returns the hits, misses, failures, hit rate and latency (mean and max in milliseconds) of resolutions '''
+        hits, misses = cls.hits.value(), cls.misses.value()
+        with cls.lock:
+            count, total, slowest = cls.latency['count'], cls.latency['total'], cls.latency['max']
+        entries = len(cls.cache)
+        return dict(hits=hits, misses=misses, failures=cls.failures.value(), entries=entries,
+                    hit_rate=float(hits) / (hits + misses) if hits + misses else None,
+                    latency_ms=dict(mean=total * 1000 / count if count else None, max=slowest * 1000))
@@ -1,6 +1,134 @@
 '''
 A simple template engine - currently just uses bottle's template
+
+:py:class:`TemplateRegistry` compiles templates once and caches them. A cached template is recompiled only when its
+file is modified.
 '''
 from bottle import SimpleTemplate
+import bottle
+import os
+import time
+from boots import concurrency
+from boots.common.dirutils import DirUtils
+from boots.common.utils import ShardedCounter
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+elif concurrency == 'threading':
+    from threading import RLock
 
 class BootsTemplate(SimpleTemplate): pass
+
+class TemplateEntry(object):
+    ''' a compiled template and the modification time of its file when it was compiled '''
+    __slots__ = ('template', 'filename', 'mtime', 'checked')
+
+    def __init__(self, template, filename, mtime):
+        self.template, self.filename, self.mtime = template, filename, mtime
+        self.checked = time.time()
+
+class TemplateRegistry(object):
+    '''
+    A (process wide) registry of compiled templates. Templates are looked up by name (as with bottle, with or without the
+    extension) in the registered template paths and bottle's TEMPLATE_PATH, or by filename. Templates are compiled once and
+    recompiled only when their file's modification time changes (checked at most once every :py:attr:`check_interval` seconds).
+
+    All methods are classmethods. :py:meth:`add_path` precompiles the templates in a path (typically at startup, from the
+    template_paths of the [Template] section). The cache hits and misses (compilations) are available through :py:meth:`stats`
+    '''
+
+    lock = RLock()
+    #: the template directories, in lookup order
+    paths = []
+    #: cached templates - name or filename to :py:class:`TemplateEntry`
+    templates = {}
+    #: the minimum time (in seconds) between checks of a template file's modification time
+    check_interval = 1.0
+    hits = ShardedCounter()
+    misses = ShardedCounter()
+
+    @classmethod
+    def lookup(cls):
+        return cls.paths + [ p for p in bottle.TEMPLATE_PATH if p not in cls.paths ]
+
+    @classmethod
+    def add_path(cls, path, precompile=True):
+        '''
+        adds a template directory and (optionally) compiles all the templates (files with bottle's template extensions) within it
+        '''
+        path = os.path.abspath(path)
+        with cls.lock:
+            if path not in cls.paths:
+                cls.paths.append(path)
+        if precompile and os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                name, ext = os.path.splitext(filename)
+                if ext[1:] in BootsTemplate.extensions and os.path.isfile(os.path.join(path, filename)):
+                    cls.get(name)
+
+    @classmethod
+    def compile(cls, filename):
+        mtime = os.path.getmtime(filename)
+        template = BootsTemplate(source=DirUtils().read_file(filename, None), lookup=cls.lookup())
+        template.filename = filename
+        cls.misses.increment()
+        return TemplateEntry(template, filename, mtime)
+
+    @classmethod
+    def _cached(cls, key, find):
+        entry = cls.templates.get(key)
+        if entry is not None:
+            now = time.time()
+            if now - entry.checked < cls.check_interval:
+                cls.hits.increment()
+                return entry.template
+            entry.checked = now
+            try:
+                updated = DirUtils().is_updated(entry.filename, entry.mtime)
+            except OSError: # deleted. look it up again
+                updated = True
+            if not updated:
+                cls.hits.increment()
+                return entry.template
+        filename = find()
+        if filename is None:
+            with cls.lock: cls.templates.pop(key, None)
+            return None
+        entry = cls.compile(filename)
+        with cls.lock:
+            cls.templates[key] = entry
+        return entry.template
+
+    @classmethod
+    def get(cls, name):
+        ''' returns the compiled template (a :py:class:`BootsTemplate`) with this name or None if not found '''
+        return cls._cached(name, lambda: BootsTemplate.search(name, cls.lookup()))
+
+    @classmethod
+    def get_file(cls, filename):
+        ''' returns the compiled template (a :py:class:`BootsTemplate`) from this file (e.g. login templates) '''
+        filename = os.path.abspath(filename)
+        return cls._cached(filename, lambda: filename if os.path.isfile(filename) else None)
+
+    @classmethod
+    def render(cls, *args, **kargs):
+        '''
+        renders the template whose name is the 1st argument with the remaining arguments (dicts) and kargs as the template variables
+        (as with bottle.template). Template sources (rather than names) are passed on to bottle
+        '''
+        name, args = args[0], args[1:]
+        if isinstance(name, SimpleTemplate) or "\n" in name or "{" in name or "%" in name or '$' in name:
+            return bottle.template(name, *args, **kargs)
+        template = cls.get(name)
+        if template is None:
+            bottle.abort(500, 'Template (%s) not found' % name)
+        for dictarg in args: kargs.update(dictarg)
+        return template.render(kargs)
+
+    @classmethod
+    def stats(cls):
+        return dict(hits=cls.hits.value(), misses=cls.misses.value(), templates=len(cls.templates))
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.templates.clear()
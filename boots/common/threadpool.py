@@ -12,6 +12,7 @@ from boots.common.utils import new_counter
 import functools
 from heapq import heappop, heappush
 import logging
+import weakref
 
 # incredibly heroic patch attempt
 from multiprocessing.dummy import DummyProcess
@@ -30,11 +31,29 @@ except NameError:
 
 class ThreadPool(t):
     
-    def __init__(self, processes=5):
+    #: the pools that have been created (and not yet garbage collected). See :py:meth:`stats`
+    pools = weakref.WeakSet()
+    
+    def __init__(self, processes=5, name=None):
+        '''
+        :param processes: the number of worker threads
+        :param name: the name of the pool in statistics. Defaults to the name of the class
+        '''
         if concurrency == concurrency.GEVENT and False:
             super(ThreadPool, self).__init__(maxsize=processes)
         else:
             super(ThreadPool, self).__init__(processes=processes)
+        self.name = name or self.__class__.__name__
+        self.pools.add(self)
+    
+    def queued(self):
+        ''' the number of tasks waiting for a worker '''
+        return self._taskqueue.qsize() + self._inqueue.qsize()
+    
+    @classmethod
+    def stats(cls):
+        ''' returns the name, number of workers and number of queued tasks of each pool '''
+        return [ dict(name=pool.name, workers=pool._processes, queued=pool.queued()) for pool in list(cls.pools) ]
 
 class InstancedThreadPool(Singleton, ThreadPool):
     
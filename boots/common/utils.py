@@ -2,7 +2,11 @@
 '''
 
 from boots import concurrency
+from collections import OrderedDict
+import itertools
 import random
+import threading
+import weakref
 if concurrency == 'gevent':
     from gevent.coros import RLock
 elif concurrency == 'threading':
@@ -20,7 +24,8 @@ def new_counter(seed=0):
     '''
     creates a new counter and returns a function that, on every call, obtains the next counter value
     Takes an optional seed to seed the counter with (starts from that number). Defaults to zero
-    Ensures thread safety
+    Ensures thread safety (without a lock - the next value is obtained in a single C call which is atomic 
+    with threads as well as greenlets)
     example:
         countkeeper = new_counter(10)
         print countkeeper() # prints 10
@@ -28,28 +33,209 @@ def new_counter(seed=0):
     @param seed:
     @type seed:
     '''
+    counter = itertools.count(seed)
+    return counter.__next__ if major >= 3 else counter.next
+
+##########################################################
+## Sharded Counters ######################################
+##########################################################
+class _Owner(object):
+    ''' held (only) by a thread's local storage - it is collected when the thread exits. See :py:class:`ShardedCounter` '''
+    __slots__ = ('cell', '__weakref__')
+
+class ShardedCounter(object):
+    '''
+    A counter that is incremented without a lock. Each thread increments its own shard (cell) and the shards are 
+    summed when the counter is read. Use this for counters that are incremented often (e.g. per request) and read 
+    rarely (e.g. statistics). With gevent, greenlets are not preempted between the read and the write of an 
+    increment, so a single shard is used. When a thread exits, its shard is folded into a retired shard (so its counts 
+    remain part of the value) and dropped - the number of shards does not grow as threads come and go.
+    example:
+        hits = ShardedCounter()
+        hits.increment()
+        hits.increment(5)
+        print hits.value() # prints 6
+    '''
+    
+    def __init__(self, initial=0):
+        self._lock = RLock() # only to register, retire and reset shards
+        self._retired = self._new_cell()
+        self._cells = [ self._retired ]
+        self._owners = {} # weak reference to the owner of a shard to the shard
+        self._local = threading.local() if concurrency == 'threading' else None
+        self._base = initial
+    
+    def _new_cell(self):
+        return [0]
+    
+    def _merge_cell(self, into, cell):
+        into[0] += cell[0]
+    
+    def _cell(self):
+        ''' returns this thread's shard, creating and registering it on first use '''
+        if self._local is None:
+            return self._retired
+        try:
+            return self._local.owner.cell
+        except AttributeError:
+            owner = _Owner()
+            owner.cell = cell = self._new_cell()
+            with self._lock:
+                self._owners[weakref.ref(owner, self._retire)] = cell
+                self._cells.append(cell)
+            self._local.owner = owner
+            return cell
+    
+    def _retire(self, ref):
+        ''' folds the shard of a thread that has exited into the retired shard (called when its owner is collected) '''
+        with self._lock:
+            cell = self._owners.pop(ref, None)
+            if cell is None: return
+            self._merge_cell(self._retired, cell)
+            self._cells[:] = [ c for c in self._cells if c is not cell ] # shards are compared by identity (not value)
     
-    lock = RLock()
+    def increment(self, n=1):
+        self._cell()[0] += n
         
-    def _internal_counter(seed):
-        while 1:
-            retval = seed
-            seed += 1
-            yield retval
-            
-    if major >= 3:
-        nexter = _internal_counter(seed).__next__
-    else:
-        # python 2
-        nexter = _internal_counter(seed).next
-    
-    class __dummy:
-        @classmethod
-        def _generator_wrapper(cls):
-            with lock:  # guarantee atomicity
-                return nexter()
+    def decrement(self, n=1):
+        self._cell()[0] -= n
+    
+    def value(self):
+        with self._lock: # a shard being retired is not counted twice
+            cells = list(self._cells)
+        return self._base + sum(cell[0] for cell in cells)
+    
+    def reset(self, value=0):
+        '''
+        resets the counter to value. Increments that race with the reset may or may not be included
+        '''
+        with self._lock:
+            self._base = value - sum(cell[0] for cell in self._cells)
         
-    return __dummy._generator_wrapper
+    __call__ = value
+
+class Gauge(ShardedCounter):
+    '''
+    A gauge is a value that goes up and down (e.g. the number of requests in progress). It may be incremented and 
+    decremented like a :py:class:`ShardedCounter` or set to a specific value
+    '''
+    
+    def set(self, value):
+        self.reset(value)
+
+class Accumulator(ShardedCounter):
+    '''
+    An accumulator records observations (e.g. time taken by each request) and provides their count, total, min and max.
+    Like :py:class:`ShardedCounter`, each thread records into its own shard and the shards are merged on read.
+    example:
+        timings = Accumulator()
+        timings.add(0.5)
+        timings.add(1.5)
+        print timings.value() # prints { 'count': 2, 'total': 2.0, 'min': 0.5, 'max': 1.5 }
+    '''
+    
+    def __init__(self):
+        super(Accumulator, self).__init__()
+    
+    def _new_cell(self):
+        return [0, 0, None, None] # count, total, min, max
+    
+    def _merge_cell(self, into, cell):
+        c_count, c_total, c_low, c_high = cell
+        into[0] += c_count
+        into[1] += c_total
+        if c_low is not None and (into[2] is None or c_low < into[2]): into[2] = c_low
+        if c_high is not None and (into[3] is None or c_high > into[3]): into[3] = c_high
+    
+    def add(self, observation):
+        cell = self._cell()
+        cell[0] += 1
+        cell[1] += observation
+        if cell[2] is None or observation < cell[2]: cell[2] = observation
+        if cell[3] is None or observation > cell[3]: cell[3] = observation
+    
+    def increment(self, n=1):
+        self.add(n)
+    
+    def decrement(self, n=1):
+        raise TypeError('%s cannot be decremented' % (self.__class__.__name__, ))
+    
+    def value(self):
+        with self._lock:
+            cells = list(self._cells)
+        merged = self._new_cell()
+        for cell in cells:
+            self._merge_cell(merged, cell)
+        count, total, low, high = merged
+        return { 'count': count, 'total': total, 'min': low, 'max': high }
+    
+    def reset(self, value=None):
+        '''
+        discards all observations. Observations that race with the reset may or may not be discarded
+        '''
+        with self._lock:
+            for cell in self._cells:
+                cell[:] = self._new_cell()
+    
+    __call__ = value
+    
+##########################################################
+## LRU Cache #############################################
+##########################################################
+class LRUCache(object):
+    '''
+    A bounded, thread safe mapping that discards the least recently used entries when it grows beyond maxsize.
+    example:
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')      # 'a' is now the most recently used
+        cache.put('c', 3)   # discards 'b'
+        print cache.get('b') # prints None
+    '''
+    
+    def __init__(self, maxsize=128):
+        '''
+        :param int maxsize: the maximum number of entries
+        '''
+        self.maxsize = maxsize
+        self._lock = RLock()
+        self._data = OrderedDict()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value # now the most recently used
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def keys(self):
+        ''' returns the keys (the least recently used first) '''
+        with self._lock:
+            return self._data.keys()
+    
+    def __contains__(self, key):
+        return key in self._data
+    
+    def __len__(self):
+        return len(self._data)
     
 def generate_uuid(frames=3):
     return '-'.join(['%X'%random.Random().randint(0, pow(10,16)) for _ in range(0, frames)])
\ No newline at end of file
@@ -0,0 +1,192 @@
+'''
+Sliding window statistics - the throughput, error rate and latency percentiles of routes over the last few minutes (rather than
+since the process started).
+
+Each route has a ring of time slots of :py:attr:`WindowedStats.resolution` seconds. A slot counts the requests, the errors and
+the latencies (in a :py:class:`LatencyHistogram`) of its period - recorded without a lock, in cells of each thread that are 
+merged into the slot (see :py:class:`SlidingWindow`). The rings are rotated (the oldest slot is cleared and becomes
+the current slot) from an :py:class:`InstancedScheduler`, so the memory of a route is fixed. A window (e.g. 5 minutes) is
+reported by merging the slots it covers.
+
+**Example**::
+
+    windows = WindowedStats()
+    windows.add('get_user', 0.012, error=False)
+    print windows.stats() # { 'get_user': { '1m': { 'rps': ..., 'error_rate': ..., 'p99': ... }, '5m': ..., '15m': ... } }
+'''
+from __future__ import division
+from boots import concurrency
+from boots.common.histogram import LatencyHistogram
+from boots.common.threadpool import InstancedScheduler
+import os
+import threading
+import time
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+elif concurrency == 'threading':
+    from threading import RLock
+
+class SlidingWindow(object):
+    '''
+    the ring of slots of a route. Each slot is a list of [start time, requests, errors, histogram].
+    
+    Requests are recorded without a lock - each thread records into a cell of its own ([requests, errors, histogram]) for the
+    current slot. A thread registers a new cell (under the lock) when it first records in a slot. Cells are merged into their
+    slot a rotation after the slot ends (when no thread records into them any more) and until then are added in when the 
+    window is read. With gevent (greenlets are not preempted during an update) requests are recorded into the slot itself
+    '''
+
+    def __init__(self, slots, now=None):
+        self.lock = RLock() # only to register cells, rotate and read
+        now = time.time() if now is None else now
+        # slots that have not started yet have no start time
+        self.slots = [ [ None, 0, 0, LatencyHistogram(sub_bucket_bits=4) ] for _ in xrange(slots) ]
+        self.cells = [ [] for _ in xrange(slots) ] # the cells (of threads) of each slot that are not merged yet
+        self.current = 0
+        self.rotations = 0 # identifies the current slot (a cell is for the slot of the rotation it was registered in)
+        self.slots[0][0] = now
+        self._local = threading.local() if concurrency == 'threading' else None
+
+    def add(self, latency, error=False):
+        if self._local is None:
+            slot = self.slots[self.current]
+            slot[1] += 1
+            if error: slot[2] += 1
+            slot[3].record(latency)
+            return
+        local = self._local
+        cell = getattr(local, 'cell', None)
+        if cell is None or local.rotation != self.rotations: # the first request of this thread in this slot
+            cell = [ 0, 0, LatencyHistogram(sub_bucket_bits=4) ]
+            with self.lock:
+                self.cells[self.current].append(cell)
+                local.cell, local.rotation = cell, self.rotations
+        cell[0] += 1
+        if error: cell[1] += 1
+        cell[2].record(latency)
+
+    def rotate(self, now):
+        ''' starts a new slot (discarding the oldest). The cells of the slot before the one that ends are merged into it '''
+        with self.lock:
+            self._merge((self.current - 1) % len(self.slots))
+            self.current = (self.current + 1) % len(self.slots)
+            self.rotations += 1
+            slot = self.slots[self.current]
+            slot[0], slot[1], slot[2] = now, 0, 0
+            slot[3].clear()
+            self.cells[self.current] = []
+
+    def _merge(self, index):
+        slot = self.slots[index]
+        for requests, errors, histogram in self.cells[index]:
+            slot[1] += requests
+            slot[2] += errors
+            slot[3].merge(histogram)
+        self.cells[index] = []
+
+    def window(self, slots, now):
+        ''' returns the requests, errors, duration (in seconds) and histogram of the latest slots (including the current slot) '''
+        histogram = LatencyHistogram(sub_bucket_bits=4)
+        requests = errors = 0
+        start = now
+        with self.lock:
+            for i in xrange(min(slots, len(self.slots))):
+                index = (self.current - i) % len(self.slots)
+                slot = self.slots[index]
+                if slot[0] is None: break
+                start = slot[0]
+                for cell in [ slot[1:] ] + self.cells[index]:
+                    if not cell[0]: continue
+                    requests += cell[0]
+                    errors += cell[1]
+                    histogram.merge(cell[2])
+        return requests, errors, now - start, histogram
+
+class WindowedStats(object):
+    '''
+    the sliding window statistics of a server's routes. A route's ring is created when its first request is added
+    '''
+
+    #: the length (in seconds) of a slot - the granularity with which windows slide
+    resolution = 15
+    #: the reported windows - name to length (in seconds). The longest window sets the number of slots of a route
+    windows = (('1m', 60), ('5m', 300), ('15m', 900))
+
+    _scheduler = None
+    _lock = RLock()
+
+    def __init__(self, resolution=None, windows=None):
+        '''
+        :param resolution: overrides :py:attr:`resolution`
+        :param windows: overrides :py:attr:`windows`
+        '''
+        if resolution is not None: self.resolution = resolution
+        if windows is not None: self.windows = tuple(windows)
+        self.slots = int(-(-max(length for _, length in self.windows) // self.resolution))
+        self.routes = {}
+        self.lock = RLock()
+        self._pid = None
+
+    def add(self, route, latency, error=False):
+        '''
+        records a request
+
+        :param route: the name of the route
+        :param latency: the time (in seconds) taken by the request
+        :param error: whether the request failed
+        '''
+        window = self.routes.get(route)
+        if window is None:
+            with self.lock:
+                window = self.routes.get(route)
+                if window is None:
+                    window = self.routes[route] = SlidingWindow(self.slots)
+            if self._pid != os.getpid(): # not yet rotating (or forked)
+                self.start()
+        window.add(latency, error)
+
+    def start(self):
+        ''' starts rotating the rings every :py:attr:`resolution` seconds (from the :py:class:`InstancedScheduler`) '''
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        self._schedule(self._pid)
+
+    def _schedule(self, pid):
+        cls = self.__class__
+        if cls._scheduler is None or cls._scheduler[0] != os.getpid():
+            with cls._lock:
+                if cls._scheduler is None or cls._scheduler[0] != os.getpid():
+                    cls._scheduler = (os.getpid(), InstancedScheduler(_ns='stats_windows'))
+        delay = self.resolution - time.time() % self.resolution # at slot boundaries, so rotations do not drift
+        cls._scheduler[1].timer(delay * 1000, self._rotate, pid, _threadpool=False)
+
+    def _rotate(self, pid):
+        if pid != os.getpid(): # a timer inherited across a fork
+            return
+        now = time.time()
+        with self.lock:
+            windows = self.routes.values()
+        for window in windows:
+            window.rotate(now)
+        self._schedule(pid)
+
+    def stats(self):
+        '''
+        returns, by route and by window, the requests, requests per second (rps), errors, error rate and latency percentiles
+        (p50, p90, p99 and p999 in seconds)
+        '''
+        now = time.time()
+        with self.lock:
+            routes = self.routes.items()
+        result = {}
+        for route, window in routes:
+            result[route] = stats = {}
+            for name, length in self.windows:
+                requests, errors, duration, histogram = window.window(int(-(-length // self.resolution)), now)
+                stats[name] = entry = dict(requests=requests, errors=errors,
+                                           rps=requests / duration if duration > 0 else None,
+                                           error_rate=errors / requests if requests else None)
+                entry.update(histogram.percentiles())
+        return result
@@ -109,4 +109,19 @@ class DatabaseEngineFactory(object):
             DatabaseEngineFactory.dbengine_dict[dbconfig.db_url] = database_engine
         return database_engine
     
+    @classmethod
+    def pool_stats(cls):
+        '''
+        returns the usage of the connection pool of each database - its size, the connections checked out (in use), checked in (idle)
+        and the overflow. Databases are identified by their url without the user and password
+        '''
+        stats = {}
+        for database_engine in cls.dbengine_dict.values():
+            engine = database_engine.engine
+            if engine is None: continue
+            url, pool = engine.url, engine.pool
+            name = '%s://%s/%s' % (url.drivername, url.host or '', url.database or '')
+            stats[name] = dict(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(), overflow=pool.overflow())
+        return stats
+    
     
\ No newline at end of file
@@ -0,0 +1,700 @@
+'''
+An event driven engine for asynchronous HTTP requests, used by :py:class:`boots.endpoints.httpclient_ep.HTTPAsyncClient`.
+
+Rather than blocking a thread per outstanding request, :py:class:`AsyncHTTPEngine` runs all requests from a single thread that
+multiplexes non-blocking sockets (epoll where available, else select). Thousands of requests may be in flight at once. With
+:py:data:`boots.concurrency` set to gevent, :py:class:`GeventHTTPEngine` runs each request in a greenlet instead.
+
+Requests are urllib2.Request objects and are answered with a :py:class:`Future`. The result of the future is a urllib2 style
+response (with read, info, geturl and code). Like urllib2, responses with a status other than 2xx are errors (urllib2.HTTPError),
+redirects are followed and connection failures and timeouts are urllib2.URLError. Cookies are added from (and saved to) an optional
+cookielib.CookieJar.
+
+**Example**::
+
+    future = AsyncHTTPEngine.shared().submit(urllib2.Request('http://localhost:9000/'), timeout=10)
+    print future.result().read()
+'''
+from boots import concurrency
+from StringIO import StringIO
+import collections
+import errno
+import fcntl
+import httplib
+import logging
+import os
+import re
+import select
+import socket
+import ssl
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from boots.endpoints.http_pool import ConnectionPool, split_timeout
+from boots.common.resolver import Resolver
+from boots.common.threadpool import InstancedThreadPool
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+    from gevent.event import Event
+elif concurrency == 'threading':
+    from threading import RLock, Event
+
+class FutureTimeout(Exception):
+    ''' raised by :py:meth:`Future.result` when the result is not available in time '''
+    pass
+
+class FutureCancelled(Exception):
+    ''' the exception of a :py:class:`Future` that was cancelled '''
+    pass
+
+class Future(object):
+    '''
+    the eventual result of an asynchronous operation. Callbacks added with :py:meth:`add_done_callback` are called (in the order
+    they were added) with the future once it is done - from the thread that completed it, or immediately if it is already done
+    '''
+
+    def __init__(self):
+        self._event = Event()
+        self._lock = RLock()
+        self._result = self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        '''
+        cancels the operation (if it is not done) - the future fails with :py:class:`FutureCancelled` and the operation is abandoned
+        (e.g. the engine closes the connection of the request). returns whether the future was cancelled
+        '''
+        if not self.done():
+            self.set_exception(FutureCancelled('Cancelled'))
+        return self.cancelled()
+
+    def cancelled(self):
+        return self.done() and self._exc_info is not None and isinstance(self._exc_info[1], FutureCancelled)
+
+    def on_cancel(self, fn):
+        ''' calls fn (without arguments) if (and when) this future is cancelled '''
+        self.add_done_callback(lambda future: fn() if future.cancelled() else None)
+
+    def result(self, timeout=None):
+        ''' waits (up to timeout seconds) and returns the result or raises the exception of the operation '''
+        if not self._event.wait(timeout) and not self._event.is_set():
+            raise FutureTimeout('Result not available in %s seconds' % (timeout,))
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        ''' waits (up to timeout seconds) and returns the exception of the operation (None if it succeeded) '''
+        if not self._event.wait(timeout) and not self._event.is_set():
+            raise FutureTimeout('Result not available in %s seconds' % (timeout,))
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            logging.getLogger().exception('Exception in future callback %s', fn)
+
+    def _complete(self, result, exc_info):
+        with self._lock:
+            if self.done(): return
+            self._result, self._exc_info = result, exc_info
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._call(fn)
+
+    def set_result(self, result):
+        self._complete(result, None)
+
+    def set_exception(self, exc_info):
+        ''' :param exc_info: an exception or the tuple returned by sys.exc_info() '''
+        if isinstance(exc_info, BaseException): exc_info = (exc_info.__class__, exc_info, None)
+        self._complete(None, exc_info)
+
+    def transform(self, fn):
+        '''
+        returns a new future whose result is fn(result of this future). Exceptions (of this future or fn) are passed on. Cancelling
+        the new future cancels this future
+        '''
+        future = Future()
+        future.on_cancel(self.cancel)
+        def done(this):
+            if this._exc_info is not None:
+                return future.set_exception(this._exc_info)
+            try:
+                future.set_result(fn(this._result))
+            except Exception:
+                future.set_exception(sys.exc_info())
+        self.add_done_callback(done)
+        return future
+
+class _Replay(object):
+    ''' a stand in for a socket that replays a received response to httplib.HTTPResponse '''
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, *args, **kargs):
+        return StringIO(self.data)
+
+def _response(req, raw):
+    ''' parses the raw bytes of a response (as received) into a urllib2 style response '''
+    response = httplib.HTTPResponse(_Replay(raw), method=req.get_method(), buffering=True)
+    response.begin()
+    body = response.read()
+    resp = urllib2.addinfourl(StringIO(body), response.msg, req.get_full_url())
+    resp.code, resp.msg = response.status, response.reason
+    return resp
+
+def _finish(engine, req, future, raw, cookiejar, redirects):
+    ''' completes an exchange - following redirects, raising HTTPErrors and saving cookies as urllib2 would '''
+    try:
+        resp = raw if hasattr(raw, 'info') else _response(req, raw)
+        if cookiejar is not None:
+            cookiejar.extract_cookies(resp, req)
+        code = resp.code
+        if code in (301, 302, 303, 307) and redirects < urllib2.HTTPRedirectHandler.max_redirections:
+            headers = resp.info()
+            location = headers.getheader('location') or headers.getheader('uri')
+            if location:
+                location = urlparse.urljoin(req.get_full_url(), location)
+                new_req = urllib2.HTTPRedirectHandler().redirect_request(req, resp, code, resp.msg, headers, location)
+                if new_req is not None:
+                    return engine.resubmit(new_req, timeout=req.timeout, cookiejar=cookiejar, _future=future, _redirects=redirects + 1)
+        if not 200 <= code < 300:
+            raise urllib2.HTTPError(req.get_full_url(), code, resp.msg, resp.info(), resp)
+        future.set_result(resp)
+    except Exception:
+        future.set_exception(sys.exc_info())
+
+class _Exchange(object):
+    '''
+    a request/response exchange on a non-blocking socket. A small state machine driven by :py:class:`AsyncHTTPEngine`
+    '''
+    CONNECTING, HANDSHAKE, SENDING, RECEIVING = range(4)
+    content_length = re.compile(r'^content-length:\s*(\d+)\s*$', re.I | re.M)
+    chunked = re.compile(r'^transfer-encoding:\s*chunked\s*$', re.I | re.M)
+    connection_close = re.compile(r'^connection:\s*close\s*$', re.I | re.M)
+
+    def __init__(self, engine, req, future, timeout, cookiejar, redirects):
+        self.engine, self.req, self.future, self.cookiejar, self.redirects = engine, req, future, cookiejar, redirects
+        if cookiejar is not None:
+            cookiejar.add_cookie_header(req)
+        self.scheme, host = req.get_type(), req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        if self.scheme not in ('http', 'https'):
+            raise urllib2.URLError('unknown url type: %s' % (self.scheme,))
+        self.hostname, port = urllib.splitport(host)
+        self.port = int(port or (443 if self.scheme == 'https' else 80))
+        self.key = (self.scheme, host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items() if k not in headers)
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers['Host'] = host
+        if not engine.max_per_host: headers['Connection'] = 'close' # keep-alive is the default with HTTP/1.1
+        headers.setdefault('Accept-Encoding', 'identity')
+        data = req.get_data()
+        if data is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+            headers['Content-Length'] = str(len(data))
+        self.out = '%s %s HTTP/1.1\r\n%s\r\n%s' % (req.get_method(), req.get_selector(),
+                                                 ''.join('%s: %s\r\n' % item for item in headers.iteritems()), data or '')
+        self.received = []
+        self.size = 0
+        self.expected = None # the size of the complete response (when known)
+        self.chunk_skip, self.chunk_line, self.trailers = 0, '', False # the state of parsing a chunked body
+        self.addresses = [] # the addresses of the host that are yet to be tried
+        self.timeout = timeout
+        self.connect_timeout, self.read_timeout = split_timeout(timeout)
+        self.deadline = None
+        self.sock = None
+        self.want_write = True
+        self.reused = self.keep_alive = False
+
+    def connect(self):
+        '''
+        uses an idle connection to the host or resolves the host (through the :py:class:`Resolver` cache) and starts a non-blocking connect. 
+        Called from the submitting thread
+        '''
+        sock = self.engine.acquire(self.key)
+        if sock is not None:
+            self.sock, self.reused, self.state = sock, True, self.SENDING
+            self.extend(self.read_timeout)
+            return sock.fileno()
+        self.addresses = list(Resolver.getaddrinfo(self.hostname, self.port, 0, socket.SOCK_STREAM))
+        return self.connect_next()
+
+    def connect_next(self):
+        '''
+        starts a non-blocking connect to the next address of the host, skipping addresses that fail at once. returns the fileno of 
+        the new socket. Raises the error of the last address if none are left
+        '''
+        while True:
+            if self.sock is not None: self.close()
+            family, socktype, proto, _, address = self.addresses.pop(0)
+            self.sock = socket.socket(family, socktype, proto)
+            self.sock.setblocking(0)
+            self.state, self.want_write = self.CONNECTING, True
+            self.extend(self.connect_timeout)
+            err = self.sock.connect_ex(address)
+            if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                return self.sock.fileno()
+            if not self.addresses:
+                raise socket.error(err, os.strerror(err))
+
+    def can_connect_next(self):
+        ''' whether the exchange is connecting and has other addresses to try '''
+        return self.state == self.CONNECTING and bool(self.addresses)
+
+    def extend(self, timeout):
+        ''' the exchange times out if it does not progress within timeout seconds (from now) '''
+        self.deadline = time.time() + timeout if timeout is not None else None
+
+    def on_writable(self):
+        if self.state == self.CONNECTING:
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, os.strerror(err))
+            if self.scheme == 'https':
+                context = ssl.create_default_context() if hasattr(ssl, 'create_default_context') else None
+                self.sock = context.wrap_socket(self.sock, server_hostname=self.hostname, do_handshake_on_connect=False) if context \
+                    else ssl.wrap_socket(self.sock, do_handshake_on_connect=False)
+                self.state = self.HANDSHAKE
+                return self.handshake()
+            self.state = self.SENDING
+            self.extend(self.read_timeout)
+        if self.state == self.HANDSHAKE:
+            return self.handshake()
+        if self.state == self.SENDING:
+            try:
+                sent = self.sock.send(self.out)
+            except ssl.SSLError as e:
+                if e.args[0] in (ssl.SSL_ERROR_WANT_WRITE, ssl.SSL_ERROR_WANT_READ): return
+                raise
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return
+                raise
+            self.out = self.out[sent:]
+            if not self.out:
+                self.state, self.want_write = self.RECEIVING, False
+
+    def handshake(self):
+        try:
+            self.sock.do_handshake()
+        except ssl.SSLError as e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ: self.want_write = False; return
+            if e.args[0] == ssl.SSL_ERROR_WANT_WRITE: self.want_write = True; return
+            raise
+        self.state, self.want_write = self.SENDING, True
+        self.extend(self.read_timeout)
+
+    def on_readable(self):
+        ''' reads what is available. returns True once the response is complete '''
+        if self.state == self.HANDSHAKE:
+            return self.handshake()
+        if self.state != self.RECEIVING:
+            return False
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except ssl.SSLError as e:
+                if e.args[0] == ssl.SSL_ERROR_WANT_READ: return False
+                raise
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return False
+                raise
+            if not data: # closed by the server
+                return True
+            self.received.append(data)
+            self.size += len(data)
+            self.extend(self.read_timeout)
+            if self.complete(data):
+                return True
+
+    def complete(self, data):
+        '''
+        whether the response is complete (with data, the latest received) without waiting for the server to close the connection
+        '''
+        if self.expected is None:
+            raw = ''.join(self.received)
+            self.received = [ raw ]
+            end = raw.find('\r\n\r\n')
+            if end < 0: return False
+            head = raw[:end]
+            length = self.content_length.search(head)
+            status = head[9:12]
+            self.keep_alive = head.startswith('HTTP/1.1') and not self.connection_close.search(head)
+            if self.req.get_method() == 'HEAD' or status in ('204', '304') or status.startswith('1'):
+                self.expected = end + 4
+            elif length is not None:
+                self.expected = end + 4 + int(length.group(1))
+            elif self.chunked.search(head):
+                self.expected = -1 # complete after the last chunk and the trailers
+                return self.parse_chunks(raw[end + 4:])
+            else:
+                self.expected = -2 # complete when the server closes the connection
+                self.keep_alive = False
+        if self.expected >= 0:
+            return self.size >= self.expected
+        if self.expected == -1:
+            return self.parse_chunks(data)
+        return False
+
+    def parse_chunks(self, data):
+        '''
+        parses (the next part of) a chunked body - skipping the chunks by their sizes. returns True once the last (0 sized) chunk 
+        and the trailers that follow it have been received. Raises ValueError on an invalid chunk size
+        '''
+        pos = 0
+        while pos < len(data):
+            if self.chunk_skip: # the data of a chunk and its CRLF
+                skipped = min(self.chunk_skip, len(data) - pos)
+                self.chunk_skip -= skipped
+                pos += skipped
+                continue
+            end = data.find('\n', pos)
+            if end < 0: # a partial line
+                self.chunk_line += data[pos:]
+                return False
+            line, self.chunk_line = (self.chunk_line + data[pos:end]).rstrip('\r'), ''
+            pos = end + 1
+            if self.trailers:
+                if not line: return True # the empty line that ends the trailers
+                continue
+            size = int(line.split(';', 1)[0].strip(), 16)
+            if size: self.chunk_skip = size + 2
+            else: self.trailers = True
+        return False
+
+    def raw(self):
+        return ''.join(self.received)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+#: errors of a reused connection (closed by the server while idle) after which an idempotent request is retried
+RETRIED_ERRORS = (errno.ECONNRESET, errno.EPIPE)
+
+class AsyncHTTPEngine(threading.Thread):
+    '''
+    A single thread that multiplexes many HTTP requests over non-blocking sockets. Typically the engine shared by the process
+    is used (see :py:meth:`shared`). The host is resolved and the connection started in the thread that submits the request (redirects
+    and retries are submitted from the :py:class:`InstancedThreadPool`), so the engine's thread does not block. If connecting to an 
+    address of the host fails, the next address is tried.
+
+    Connections are kept alive and reused by later requests to the same host (as with :py:class:`boots.endpoints.http_pool.ConnectionPool`).
+    An idempotent request whose reused connection is closed (or reset) by the server before anything is received is retried on a 
+    new connection
+    '''
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_per_host=10, idle_timeout=30):
+        '''
+        :param max_per_host: the maximum number of idle connections kept per host (0 for a new connection per request)
+        :param idle_timeout: connections idle for longer than these many seconds are not reused
+        '''
+        super(AsyncHTTPEngine, self).__init__(name='AsyncHTTPEngine')
+        self.daemon = True
+        self.max_per_host = int(max_per_host)
+        self.idle_timeout = float(idle_timeout)
+        self.lock = threading.Lock()
+        self.idle = {} # (scheme, host) to a list of (socket, released at). the most recently released last
+        self.counters = dict(created=0, reused=0, retried=0)
+        self._incoming = collections.deque()
+        self._exchanges = {} # fd to _Exchange
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self._registered = {} # fd to whether registered for writing
+        self._register(self._wake_r, False)
+        self.start()
+
+    @classmethod
+    def shared(cls):
+        ''' returns the engine shared by the process - a :py:class:`GeventHTTPEngine` with gevent '''
+        if cls._shared is None or (concurrency != 'gevent' and cls._shared.pid != os.getpid()):
+            with cls._shared_lock:
+                if cls._shared is None or (concurrency != 'gevent' and cls._shared.pid != os.getpid()): # forked
+                    cls._shared = GeventHTTPEngine() if concurrency == 'gevent' else cls()
+                    cls._shared.pid = os.getpid()
+        return cls._shared
+
+    @property
+    def in_flight(self):
+        return len(self._exchanges) + len(self._incoming)
+
+    def acquire(self, key):
+        ''' returns an idle, healthy connection (socket) to the host or None '''
+        now = time.time()
+        while True:
+            with self.lock:
+                idle = self.idle.get(key)
+                sock, released_at = idle.pop() if idle else (None, None)
+                self.counters['created' if sock is None else 'reused'] += 1
+            if sock is None:
+                return None
+            try:
+                if now - released_at <= self.idle_timeout and not select.select([ sock ], [], [], 0)[0]:
+                    return sock
+            except (select.error, socket.error, ValueError):
+                pass
+            with self.lock:
+                self.counters['reused'] -= 1
+            sock.close()
+
+    def release(self, key, sock):
+        ''' keeps the connection (whose response has been read completely) for reuse '''
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append((sock, time.time()))
+                return
+        sock.close()
+
+    def close(self, key=None):
+        ''' closes all the idle connections (to the host identified by key if specified) '''
+        with self.lock:
+            if key is None:
+                idle, self.idle = self.idle, {}
+            else:
+                idle = { key: self.idle.pop(key, []) }
+        for socks in idle.itervalues():
+            for sock, _ in socks:
+                sock.close()
+
+    def stats(self):
+        ''' returns the requests in flight, the connections created, reused and retried and the idle connections by host '''
+        with self.lock:
+            stats = dict(self.counters, in_flight=self.in_flight)
+            stats['idle'] = dict(('%s://%s' % key, len(socks)) for key, socks in self.idle.iteritems() if socks)
+        return stats
+
+    def submit(self, req, timeout=None, cookiejar=None, _future=None, _redirects=0):
+        '''
+        submits a request. returns a :py:class:`Future` for the response
+
+        :param req: a urllib2.Request
+        :param timeout: the connect and read timeouts (in seconds) - a number (for both) or a tuple (connect timeout, read timeout).
+            The request fails if it does not connect within the connect timeout or then does not progress (i.e. receive data)
+            for the read timeout. None implies no timeout
+        :param cookiejar: an optional cookielib.CookieJar from (and to) which cookies are added (and saved)
+        
+        Cancelling the future (see :py:meth:`Future.cancel`) abandons the request and closes its connection
+        '''
+        future = _future or Future()
+        if _future is None:
+            future.on_cancel(self._wake) # to abandon the exchange
+        elif future.done(): # a redirect or retry of a request that was cancelled
+            return future
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT: timeout = None
+        req.timeout = timeout
+        try:
+            exchange = _Exchange(self, req, future, timeout, cookiejar, _redirects)
+            exchange.connect()
+        except urllib2.URLError:
+            future.set_exception(sys.exc_info())
+            return future
+        except (socket.error, socket.gaierror) as err:
+            future.set_exception(urllib2.URLError(err))
+            return future
+        self._incoming.append(exchange)
+        self._wake()
+        return future
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK): raise
+
+    def _register(self, fd, write):
+        if self._epoll is not None:
+            mask = select.EPOLLIN | (select.EPOLLOUT if write else 0)
+            if fd in self._registered: self._epoll.modify(fd, mask)
+            else: self._epoll.register(fd, mask)
+        self._registered[fd] = write
+
+    def _unregister(self, fd):
+        if self._registered.pop(fd, None) is not None and self._epoll is not None:
+            try: self._epoll.unregister(fd)
+            except (IOError, OSError, ValueError): pass
+
+    def _poll(self, timeout):
+        ''' returns a list of (fd, readable, writable) '''
+        if self._epoll is not None:
+            try:
+                events = self._epoll.poll(timeout if timeout is not None else -1)
+            except IOError as e:
+                if e.errno == errno.EINTR: return []
+                raise
+            return [ (fd, bool(ev & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR)), bool(ev & (select.EPOLLOUT | select.EPOLLERR)))
+                     for fd, ev in events ]
+        rlist = list(self._registered)
+        wlist = [ fd for fd, write in self._registered.iteritems() if write ]
+        try:
+            readable, writable, _ = select.select(rlist, wlist, [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR: return []
+            raise
+        readable, writable = set(readable), set(writable)
+        return [ (fd, fd in readable, fd in writable) for fd in readable | writable ]
+
+    def resubmit(self, req, **kargs):
+        '''
+        submits a request (a redirect or a retry) from a thread of the :py:class:`InstancedThreadPool` - so that the engine's thread 
+        does not block while the host is resolved
+        '''
+        InstancedThreadPool().apply_async(self.submit, args=(req, ), kwds=kargs)
+
+    def _add(self, exchange):
+        fd = exchange.sock.fileno()
+        self._exchanges[fd] = exchange
+        self._register(fd, exchange.want_write)
+
+    def _failed(self, fd, exchange, error):
+        ''' handles an error of an exchange. A connection that fails is tried with the next address of the host (if any) '''
+        if exchange.can_connect_next():
+            logging.getLogger().debug('Connecting to %s failed (%s). Trying the next address', exchange.hostname, error)
+            self._unregister(fd)
+            self._exchanges.pop(fd, None)
+            try:
+                exchange.connect_next()
+            except Exception as e:
+                return self._end(fd, exchange, e)
+            return self._add(exchange)
+        self._end(fd, exchange, error)
+
+    def _end(self, fd, exchange, error=None):
+        ''' completes an exchange (see :py:meth:`_done`). An unexpected failure to do so fails the exchange '''
+        try:
+            self._done(fd, exchange, error)
+        except Exception:
+            logging.getLogger().exception('Exception completing the request to %s', exchange.req.get_full_url())
+            self._unregister(fd)
+            self._exchanges.pop(fd, None)
+            exchange.close()
+            exchange.future.set_exception(sys.exc_info())
+
+    def _done(self, fd, exchange, error=None):
+        self._unregister(fd)
+        self._exchanges.pop(fd, None)
+        closed = error is None or (isinstance(error, socket.error) and error.args and error.args[0] in RETRIED_ERRORS)
+        if exchange.reused and not exchange.size and closed and exchange.req.get_method() in ConnectionPool.idempotent_methods:
+            # the server closed the reused connection (probably while it was idle). retry on a new connection
+            exchange.close()
+            self.close(exchange.key)
+            with self.lock:
+                self.counters['retried'] += 1
+            return self.resubmit(exchange.req, timeout=exchange.timeout, cookiejar=exchange.cookiejar, _future=exchange.future, 
+                                 _redirects=exchange.redirects)
+        if error is None and exchange.keep_alive and self.max_per_host:
+            self.release(exchange.key, exchange.sock)
+        else:
+            exchange.close()
+        if error is not None:
+            if not isinstance(error, urllib2.URLError):
+                error = urllib2.URLError(error)
+            exchange.future.set_exception(error)
+        else:
+            _finish(self, exchange.req, exchange.future, exchange.raw(), exchange.cookiejar, exchange.redirects)
+
+    def run(self):
+        while True:
+            try:
+                self._run_once()
+            except Exception: # e.g. a failure to poll. the exchanges that failed are completed by _run_once
+                logging.getLogger().exception('Exception in AsyncHTTPEngine')
+                time.sleep(0.01)
+
+    def _run_once(self):
+        while self._incoming:
+            exchange = self._incoming.popleft()
+            try:
+                self._add(exchange)
+            except Exception as e:
+                self._end(None, exchange, e)
+        now = time.time()
+        deadlines = [ e.deadline for e in self._exchanges.itervalues() if e.deadline is not None ]
+        timeout = max(0, min(deadlines) - now) if deadlines else None
+        for fd, readable, writable in self._poll(timeout):
+            if fd == self._wake_r:
+                try: os.read(self._wake_r, 4096)
+                except OSError: pass
+                continue
+            exchange = self._exchanges.get(fd)
+            if exchange is None:
+                continue
+            try:
+                if writable and exchange.want_write:
+                    exchange.on_writable()
+                complete = readable and exchange.on_readable()
+                if not complete and self._registered.get(fd) != exchange.want_write:
+                    self._register(fd, exchange.want_write)
+            except Exception as e:
+                self._failed(fd, exchange, e)
+                continue
+            if complete:
+                self._end(fd, exchange)
+        now = time.time()
+        for fd, exchange in self._exchanges.items():
+            if exchange.future.done(): # cancelled
+                self._unregister(fd)
+                self._exchanges.pop(fd, None)
+                exchange.close()
+            elif exchange.deadline is not None and now >= exchange.deadline:
+                self._failed(fd, exchange, socket.timeout('timed out'))
+
+class GeventHTTPEngine(object):
+    '''
+    runs each request in a greenlet (with the connections of the shared :py:class:`boots.endpoints.http_pool.ConnectionPool`).
+    Used (by :py:meth:`AsyncHTTPEngine.shared`) when :py:data:`boots.concurrency` is gevent
+    '''
+
+    def __init__(self):
+        self.in_flight = 0
+
+    def stats(self):
+        return dict(in_flight=self.in_flight)
+
+    def submit(self, req, timeout=None, cookiejar=None, **kargs):
+        import gevent
+        future = Future()
+        handlers = ([ urllib2.HTTPCookieProcessor(cookiejar) ] if cookiejar is not None else []) + ConnectionPool.shared().handlers()
+        opener = urllib2.build_opener(*handlers)
+        connect_timeout, req.read_timeout = split_timeout(timeout)
+        def run():
+            self.in_flight += 1
+            try:
+                resp = opener.open(req, timeout=connect_timeout if connect_timeout is not None else socket._GLOBAL_DEFAULT_TIMEOUT)
+                body = resp.read() # releases the connection to the pool
+                response = urllib2.addinfourl(StringIO(body), resp.info(), resp.geturl())
+                response.code, response.msg = resp.code, resp.msg
+                future.set_result(response)
+            except Exception:
+                future.set_exception(sys.exc_info())
+            finally:
+                self.in_flight -= 1
+        greenlet = gevent.spawn(run)
+        future.on_cancel(lambda: greenlet.kill(block=False))
+        return future
@@ -19,33 +19,60 @@ A typical scenario to create an HTTP Server is to define a subclass of the HTTPS
             
 Refer to :doc:`tutorial` for further examples.
 '''
+import boots
 from boots import concurrency
-from boots.common.utils import new_counter
+from boots.common.dirutils import DirUtils
+from boots.common.inflight import InFlight
+from boots.common.template import TemplateRegistry
+from boots.common.threadpool import InstancedScheduler
+from boots.common.utils import new_counter, LRUCache, ShardedCounter
 from boots.endpoints.endpoint import EndPoint
 from boots.endpoints.httpclient_ep import Header
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import wraps, partial
 import ast
 import bottle
+import hashlib
 import inspect
 import logging
 import os
+import Queue
+import random
 import re
 import sys
+import threading
+import time
 import traceback
 import mimetypes
+import zlib
 
 if concurrency == 'gevent':
     from gevent.coros import RLock
+    from gevent.event import Event
 elif concurrency == 'threading':
-    from threading import RLock
+    from threading import RLock, Event
 
 
 try: from collections import MutableMapping as DictMixin
 except ImportError: # pragma: no cover
     from UserDict import DictMixin
 
-template = bottle.view
+def template(tpl_name, **defaults):
+    '''
+    a decorator (like bottle.view) that renders the result of the route (if a dict) with the template tpl_name. Templates are 
+    compiled once and cached by :py:class:`boots.common.template.TemplateRegistry`
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kargs):
+            result = func(*args, **kargs)
+            if isinstance(result, (dict, DictMixin)):
+                tplvars = defaults.copy()
+                tplvars.update(result)
+                return TemplateRegistry.render(tpl_name, **tplvars)
+            return result
+        return wrapper
+    return decorator
 
 # leverages bottle.
 
@@ -90,7 +117,153 @@ class BasePlugin(object):
         except Exception as e:
             logging.getLogger().exception("Callback object : %s", callback)
             raise
-        
+
+    #: fusable plugins implement :py:meth:`phases` and can be fused into a single dispatcher by :py:class:`FusedPlugins`
+    fusable = False
+
+    def phases(self, callback, context):
+        '''
+        Plugins that can be fused (see :py:class:`FusedPlugins`) override this to return the :py:class:`PluginPhases`
+        they contribute to the route. The phases must behave the same as the wrapper returned by apply. Returning None
+        implies that the plugin has nothing to do for this route.
+
+        A plugin is fusable only if it declares its phases and sets the class attribute *fusable* to True. The default
+        declares no phases (None) - a plugin that is not fusable is applied as a nested wrapper.
+
+        :param callback: the callback passed to apply
+        :param context: the route context passed to apply
+        '''
+        return None
+
+class PluginPhases(object):
+    '''
+    PluginPhases are the before, after and on_error phases of a plugin for a specific route. These allow
+    :py:class:`FusedPlugins` to run many plugins from one dispatcher instead of nesting a wrapper per plugin.
+
+    :param before: called as before(kargs) before the callback. It returns a state (any object) that is passed back to 
+        after or on_error
+    :param after: called as after(state, result, kargs) once the callback (and the phases of inner plugins) returned
+        the result. It returns the result to be passed on.
+    :param on_error: called as on_error(state, exc_info, args, kargs) when the callback (or the phases of inner plugins) raised.
+        It returns a result to swallow the exception or :py:attr:`PROPAGATE` to pass the exception on.
+    :param updates_kargs: whether before updates kargs (the keyword arguments passed to the callback). As with nested wrappers, 
+        such a plugin is given its own copy of kargs so that the updates are seen by the inner plugins (and the callback) but not 
+        by the outer ones. Each phase is passed the kargs of its plugin's level
+    '''
+    __slots__ = ('before', 'after', 'on_error', 'updates_kargs')
+
+    #: returned by on_error to pass the exception on to the outer plugins
+    PROPAGATE = object()
+
+    def __init__(self, before=None, after=None, on_error=None, updates_kargs=False):
+        self.before = before
+        self.after = after
+        self.on_error = on_error
+        self.updates_kargs = updates_kargs
+
+class FusedPlugins(BasePlugin):
+    '''
+    FusedPlugins runs a list of fusable plugins (see :py:meth:`BasePlugin.phases`) from one dispatcher per route. Each plugin
+    would otherwise nest another wrapper around the callback which makes each request go a frame deeper (and repack kargs) per plugin.
+
+    The plugins are given outermost first (the same order in which they would have been installed). The dispatcher of a route
+    is generated (once, when the route is applied) as a single function in which the phases are nested as the wrappers would have
+    been - the before phases run outermost first, the after and on_error phases innermost first and only for plugins whose before 
+    phase has run. Exceptions raised by a phase are seen by the on_error phases of the outer plugins. Plugins in the route's 
+    skip list are skipped.
+
+    Typically, FusedPlugins are not instantiated directly. An :py:class:`HTTPServerEndPoint` with fuse_plugins set, fuses consecutive
+    fusable plugins through :py:meth:`fuse`.
+    '''
+
+    def __init__(self, plugins):
+        self.plugins = list(plugins)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(p.__class__.__name__ for p in self.plugins))
+
+    @classmethod
+    def fuse(cls, plugins):
+        '''
+        returns a new list of plugins where each run of consecutive fusable plugins is replaced by a FusedPlugins.
+        Plugins that are not fusable are retained (and are applied as nested wrappers)
+
+        :param plugins: list of plugins, outermost first
+        '''
+        fused, run = [], []
+        for plugin in list(plugins) + [ None ]:
+            if plugin is not None and getattr(plugin, 'fusable', False):
+                run.append(plugin)
+                continue
+            if len(run) > 1: fused.append(cls(run))
+            else: fused.extend(run)
+            run = []
+            if plugin is not None: fused.append(plugin)
+        return fused
+
+    def setup(self, app):
+        for plugin in self.plugins:
+            if hasattr(plugin, 'setup'): plugin.setup(app)
+
+    @staticmethod
+    def source(phases):
+        '''
+        returns the source of the dispatcher of a list of :py:class:`PluginPhases` (outermost first). The phases of the ith plugin
+        are referred to as before_i, after_i and on_error_i, its state as state_i and the kargs of its level as kargs_i
+        '''
+        lines = [ 'def dispatcher(*args, **kargs_0):' ]
+        def nest(i, indent, level):
+            pad = '    ' * indent
+            if i == len(phases):
+                lines.append('%sresult = callback(*args, **kargs_%d)' % (pad, level))
+                return
+            phase = phases[i]
+            if phase.updates_kargs:
+                lines.append('%skargs_%d = dict(kargs_%d)' % (pad, i + 1, level))
+                level = i + 1
+            unwinds = phase.after is not None or phase.on_error is not None
+            if phase.before is not None:
+                lines.append('%s%sbefore_%d(kargs_%d)' % (pad, 'state_%d = ' % i if unwinds else '', i, level))
+            elif unwinds:
+                lines.append('%sstate_%d = None' % (pad, i))
+            if phase.on_error is None:
+                nest(i + 1, indent, level)
+                if phase.after is not None:
+                    lines.append('%sresult = after_%d(state_%d, result, kargs_%d)' % (pad, i, i, level))
+                return
+            lines.append('%stry:' % pad)
+            nest(i + 1, indent + 1, level)
+            lines.extend([ '%sexcept Exception:' % pad,
+                           '%s    exc_info = sys.exc_info()' % pad,
+                           '%s    result = on_error_%d(state_%d, exc_info, args, kargs_%d)' % (pad, i, i, level),
+                           '%s    if result is PROPAGATE: raise exc_info[0], exc_info[1], exc_info[2]' % pad ])
+            if phase.after is not None:
+                lines.extend([ '%selse:' % pad, '%s    result = after_%d(state_%d, result, kargs_%d)' % (pad, i, i, level) ])
+        nest(0, 1, 0)
+        lines.append('    return result')
+        return '\n'.join(lines) + '\n'
+
+    def apply(self, callback, context):
+        skip = context.get('skip') or []
+        phases = []
+        for plugin in self.plugins:
+            if plugin in skip or type(plugin) in skip:
+                continue
+            phase = plugin.phases(callback, context)
+            if phase is not None:
+                phases.append(phase)
+        if not phases:
+            return callback
+
+        namespace = dict(callback=callback, sys=sys, PROPAGATE=PluginPhases.PROPAGATE)
+        for i, phase in enumerate(phases):
+            namespace.update({ 'before_%d' % i: phase.before, 'after_%d' % i: phase.after, 'on_error_%d' % i: phase.on_error })
+        exec compile(self.source(phases), '<fused %s>' % (context.get('rule'), ), 'exec') in namespace
+        dispatcher = wraps(callback)(namespace['dispatcher'])
+
+        self.plugin_post_apply(callback, dispatcher)
+        return dispatcher
+
 
 class RequestParams(BasePlugin):
     '''
@@ -115,6 +288,9 @@ class RequestParams(BasePlugin):
         
         Multi-valued parameters are represented as a list. 
         
+        The conversion functions and mandatory parameters are resolved once when the route is applied (see :py:meth:`compile`).
+        All parameter errors of a request (wrong format and missing parameters) are reported together with a single 400 response.
+        
         
     **Example of RequestParams to obtain parameters**::
     
@@ -142,11 +318,19 @@ class RequestParams(BasePlugin):
             if isinstance(other, RequestParams):
                 raise bottle.PluginError("Found another RequestParams plugin")
             
+    #: literal values understood by :py:meth:`boolean` without having to evaluate them
+    _boolean_literals = { 'true': True, 'false': False, '1': True, '0': False, 'none': False }
+    
     @staticmethod
     def boolean(val):
         '''
         Helper Function for params() for converting str to bool. For example, params=dict(force=boolean)
         '''
+        if type(val) is str:
+            try:
+                return RequestParams._boolean_literals[val.lower()]
+            except KeyError:
+                pass
         try:
             value = bool(ast.literal_eval(val.capitalize() if type(val) is str else val))
         except ValueError:
@@ -164,55 +348,118 @@ class RequestParams(BasePlugin):
                 return x
             raise ValueError('Parameter "%s" fails validation' % x)
         return lambda x: inner(convert(x))
-
-    def apply(self, callback, context):
+    
+    @staticmethod
+    def _identity(x):
+        return x
+    
+    def compile(self, callback, context):
+        '''
+        compiles the binding plan for a route. This is done once (when the route is applied) so that each request
+        only has to walk a flat tuple of slots. Each slot is a tuple of (name, converter, multivalue, mandatory) where
+        converter is the final conversion function (bool is replaced by :py:meth:`boolean`, unspecified parameters
+        use the identity), multivalue indicates that all values of the parameter are collected as a list and mandatory
+        indicates that the parameter is a non-keyword argument of the callback.
+        
+        :param callback: the callback (or wrapper) that handles the route
+        :param context: the route context passed to apply
+        :returns: a tuple of slots
+        '''
         params = context['config'].get('params', {})
         f_args, _, _, f_defaults = inspect.getargspec(callback) if not hasattr(callback, '_signature') else callback._signature
-        if f_defaults is None: f_defaults = []
-#        f_args = list(filter(lambda x: x != 'self', f_args))
         f_args = f_args[1:] # drop the self from the f_args list since that does not represent a parameter to be passed
-        mandatory_args, _ = (f_args[:-len(f_defaults)], f_args[-len(f_defaults):]) if len(f_defaults) is not 0 else (f_args, [])
-        method = context['method']
-
-        @wraps(callback)
-        def wrapper(*args, **kargs): # assuming bottle always calls with keyword args (even if no default)
-            seek_args = f_args
-            req_params = bottle.request.POST if method == 'POST' or method =='ANY' and len(bottle.request.POST.keys()) else bottle.request.GET
-            for arg in seek_args:
-                converter = params.get(arg, lambda x: x) # see if the parameter is specified, else conversion function is identity
-                if converter == bool: converter = self.boolean
-                multivalue = type(converter) in [list, tuple] # see if we need single or multiple values
-                if multivalue:
-                    converter = converter[0] if len(converter) > 0 else lambda x: x # obtain the conversion function if any from the 1st ele
-                    if converter == bool: converter = self.boolean
+        mandatory_args = f_args[:-len(f_defaults)] if f_defaults else f_args
+        
+        slots = []
+        for arg in f_args:
+            converter = params.get(arg, self._identity) # see if the parameter is specified, else conversion function is identity
+            multivalue = type(converter) in [list, tuple] # see if we need single or multiple values
+            if multivalue:
+                converter = converter[0] if len(converter) > 0 else self._identity # obtain the conversion function if any from the 1st ele
+            if converter == bool: converter = self.boolean
+            slots.append((arg, converter, multivalue, arg in mandatory_args))
+        return tuple(slots)
+    
+    @staticmethod
+    def bind(slots, req_params, kargs):
+        '''
+        binds the request parameters to kargs as per the compiled slots (see :py:meth:`compile`). This is a single pass over
+        the slots that collects all errors rather than stopping at the first one.
+        
+        :param slots: the slots returned by :py:meth:`compile`
+        :param req_params: the MultiDict of GET or POST parameters
+        :param kargs: the keyword arguments for the callback. This is updated in place
+        :returns: a tuple (wrong_format, missing) of lists of parameter names
+        '''
+        wrong_format, missing = [], []
+        # bottle's MultiDict keeps all values of a key as a list in .dict. Use that directly to avoid the per-key method calls 
+        store = getattr(req_params, 'dict', None)
+        if store is None:
+            store = dict((k, req_params.getall(k)) for k in req_params.keys())
+        for arg, converter, multivalue, mandatory in slots:
+            values = store.get(arg)
+            if multivalue:
+                if values:
                     try:
-                        values = [ converter(val) for val in filter(lambda x: x != '', req_params.getall(arg)) ]
-                    except (ValueError, Exception) as e: 
+                        values = [ converter(val) for val in values if val != '' ]
+                    except Exception as e: 
                         logging.getLogger().error('Wrong parameter format for: %s. %s', arg, e)
-                        bottle.abort(400, 'Wrong parameter format for: {}'.format(arg))
-                    if len(values) != 0:  # not adding empty lists since either the default gets it or it should be flagged as error for mandatory
+                        wrong_format.append(arg)
+                        continue
+                    if values:  # not adding empty lists since either the default gets it or it should be flagged as error for mandatory
                         kargs[arg] = values
-                else:
-                    value = req_params.get(arg) or kargs.get(arg)
+            else:
+                value = values and values[-1] or kargs.get(arg)
+                if value is not None:
                     try:
-                        if value is not None:
-                            value = converter(value)
-                    except (ValueError, Exception) as e: 
+                        value = converter(value)
+                    except Exception as e: 
                         logging.getLogger().error('Wrong parameter format for: %s. %s', arg, e)
-                        bottle.abort(400, 'Wrong parameter format for: {}'.format(arg))
+                        wrong_format.append(arg)
+                        continue
                     if value is not None: # checking again after converter is applied
                         kargs[arg] = value
-            missing_params = []
-            for m in mandatory_args:
-                if m not in kargs:
-                    missing_params += [m]
-            if len(missing_params) != 0:
-                bottle.abort(400, 'Missing parameters: {}'.format(", ".join(missing_params)))
+            if mandatory and arg not in kargs:
+                missing.append(arg)
+        return wrong_format, missing
+
+    def binder(self, callback, context):
+        '''
+        returns a function that binds the request parameters of the route to kargs (updating kargs in place) and aborts
+        with a 400 if any are of the wrong format or missing.
+        '''
+        slots = self.compile(callback, context)
+        method = context['method']
+        post_only, any_method = method == 'POST', method == 'ANY'
+        bind = self.bind
+
+        def binder(kargs):
+            request = bottle.request
+            req_params = request.POST if post_only or any_method and len(request.POST) else request.GET
+            wrong_format, missing = bind(slots, req_params, kargs)
+            if wrong_format or missing:
+                errors = []
+                if wrong_format: errors.append('Wrong parameter format for: {}'.format(", ".join(wrong_format)))
+                if missing: errors.append('Missing parameters: {}'.format(", ".join(missing)))
+                bottle.abort(400, '. '.join(errors))
+        return binder
+
+    def apply(self, callback, context):
+        binder = self.binder(callback, context)
+
+        @wraps(callback)
+        def wrapper(*args, **kargs): # assuming bottle always calls with keyword args (even if no default)
+            binder(kargs)
             return callback(*args, **kargs)
-        
+
         self.plugin_post_apply(callback, wrapper)
         return wrapper
 
+    fusable = True
+
+    def phases(self, callback, context):
+        return PluginPhases(before=self.binder(callback, context), updates_kargs=True)
+
     @staticmethod
     def compose(f, g):
         '''
@@ -288,10 +535,70 @@ class Hook(BasePlugin):
                 if exception:
                     raise
             return result
-        
+
         self.plugin_post_apply(callback, wrapper)
         return wrapper
+
+    fusable = True
+
+    def phases(self, callback, context):
+        def before(kargs):
+            url = bottle.request.url
+            request_context = self.create_request_context(callback=callback, url=url, **kargs)
+            self.handler(before_or_after='before', request_context=request_context, callback=callback, url=url, **kargs)
+            return request_context, url
+
+        def after(state, result, kargs):
+            request_context, url = state
+            return self.handler(before_or_after='after', request_context=request_context, callback=callback, url=url,
+                                result=result, exception=None, **kargs)
+
+        def on_error(state, exc_info, args, kargs):
+            request_context, url = state
+            self.handler(before_or_after='after', request_context=request_context, callback=callback, url=url,
+                         result=None, exception=exc_info[1], **kargs)
+            return PluginPhases.PROPAGATE
+
+        return PluginPhases(before=before, after=after, on_error=on_error)
+
+    
+class TraceWriter(threading.Thread):
+    '''
+    TraceWriter logs trace records from a background (daemon) thread so that formatting and writing logs does not add
+    latency to the request. Records are queued on a bounded queue and are dropped (and counted in *dropped*) if the 
+    queue is full - tracing never blocks a request.
+    '''
+    
+    def __init__(self, maxsize=10000, logger=None):
+        '''
+        :param int maxsize: the maximum number of records that may be pending. 
+        :param logger: the logger to write records to. Defaults to the root logger
+        '''
+        super(TraceWriter, self).__init__(name='TraceWriter')
+        self.daemon = True
+        self.logger = logger or logging.getLogger()
+        self.dropped = 0
+        self._q = Queue.Queue(maxsize)
+        self.start()
+        
+    def write(self, msg, *args):
+        '''
+        queues a record to be logged (at debug level) as self.logger.debug(msg, \*args). The args should not be modified after this call
+        '''
+        try:
+            self._q.put_nowait((msg, args))
+        except Queue.Full:
+            self.dropped += 1
     
+    def run(self):
+        while True:
+            msg, args = self._q.get()
+            try:
+                self.logger.debug(msg, *args)
+            except Exception:
+                pass # a bad record should not stop the writer
+            
+
 class Tracer(Hook):
     '''
     A special hook that traces (i.e. logs) requests and responses. The tracer traces the 
@@ -302,32 +609,97 @@ class Tracer(Hook):
 
     With HTTPServers, Tracer is automatically instantiated if enabled in configuration files and can directly be used. 
     It is governed by specific configuration settings (see :py:class:`HTTPServer`)
+    
+    The tracer can be set up for use in production:
+    
+    * match_on='route' matches tracer_paths against the route's rule once (when the route is set up) instead of matching
+        the url of every request. Routes that do not match are not wrapped at all
+    * sample traces only a sample of the requests 
+    * background=True hands the records to a :py:class:`TraceWriter` so that logs are formatted and written off the request path
+    
+    The request context of a tracer is (request count, callback object, start time). The start time is None if the request 
+    is not being traced.
     '''
     
     def handler(self, before_or_after, request_context, callback, url, result=None, exception=None, **kargs):
-        req_count, _ = request_context
-        if filter(None, [ regex.match(url) for regex in self.tracer_paths ]) != []:
-            if before_or_after == 'before':
-                self.local_context[req_count] = datetime.now()
-                logging.getLogger().debug('Request: %s. url = %s, %s', req_count, url, kargs)
-            elif exception:
-                delta = datetime.now() - self.local_context.pop(req_count)
-                logging.getLogger().debug('Response: %s. Time Taken: %s sec, %s millisec. Exception = %s. [ url = %s, %s ]', 
-                                          req_count, delta.seconds, delta.microseconds * 1.0/1000, exception, url, kargs)
+        req_count, _, start = request_context
+        if start is None: # not traced
+            return result
+        log = self.writer.write if self.writer else logging.getLogger().debug
+        if before_or_after == 'before':
+            log('Request: %s. url = %s, %s', req_count, url, kargs)
+        else:
+            delta = time.time() - start
+            if exception:
+                log('Response: %s. Time Taken: %s sec, %s millisec. Exception = %s. [ url = %s, %s ]', 
+                    req_count, int(delta), (delta % 1) * 1000, exception, url, kargs)
             else:
-                delta = datetime.now() - self.local_context.pop(req_count)
-                logging.getLogger().debug('Response: %s. Time Taken: %s sec, %s millisec. [ url = %s, %s ]', req_count, delta.seconds, delta.microseconds*1.0/1000, url, kargs)
+                log('Response: %s. Time Taken: %s sec, %s millisec. [ url = %s, %s ]', req_count, int(delta), (delta % 1) * 1000, url, kargs)
         return result # just return what we got as result so it can be passed on
+    
+    def create_request_context(self, callback, url, **kargs):
+        req_count = self.request_counter()
+        traced = self.sampled(req_count) and (self.match_on == 'route' or self.url_matches(url)) \
+            and (self.writer is not None or logging.getLogger().isEnabledFor(logging.DEBUG))
+        return (req_count, getattr(callback, '_callback_obj', None) or getattr(callback, 'im_self', None), time.time() if traced else None)
+    
+    def url_matches(self, url):
+        for regex in self.tracer_paths:
+            if regex.match(url): return True
+        return False
+    
+    def sampled(self, req_count):
+        '''
+        returns whether the request with the count req_count is in the sample to be traced
+        '''
+        if self.sample is None: return True
+        if type(self.sample) is float: return random.random() < self.sample
+        return req_count % self.sample == 0
+    
+    def route_matches(self, context):
+        '''
+        with match_on='route', returns whether the route's rule matches tracer_paths. Always True when matching urls (since
+        that can only be decided per request)
+        '''
+        return self.match_on != 'route' or self.url_matches(context.get('rule', ''))
+    
+    def apply(self, callback, context):
+        return super(Tracer, self).apply(callback, context) if self.route_matches(context) else callback
+
+    def phases(self, callback, context):
+        return super(Tracer, self).phases(callback, context) if self.route_matches(context) else None
         
-    def __init__(self, tracer_paths=['.*'], handler=None):
+    def __init__(self, tracer_paths=['.*'], handler=None, match_on='url', sample=None, background=False):
         '''
         :param tracer_paths: a list of regular expressions that will be matched with the url. None or empty list indicates match nothing. defaults to match everything. 
         :param handler: if required, a handler that will be invoked to trace the requests/responses
+        :param str match_on: 'url' (default) matches tracer_paths with the full url of each request. 'route' matches them with 
+            the route's rule (e.g. /hello/<name>) once, when the route is set up.
+        :param sample: None (default) traces every request. An integer N traces 1 in N requests. A float (between 0 and 1) traces
+            that fraction of the requests (e.g. 0.05 traces 5% of the requests, chosen at random)
+        :param background: if True, records are written by a :py:class:`TraceWriter` thread. An integer is taken as the size of 
+            the TraceWriter's queue
         '''
         if tracer_paths and type(tracer_paths) not in [ list, tuple ]:
             tracer_paths =  [ tracer_paths ]
+        if match_on not in [ 'url', 'route' ]:
+            raise ValueError('match_on should be url or route. Got %s' % (match_on, ))
+        if sample is not None:
+            value = float(sample) # may be a string from configuration
+            if value <= 0:
+                raise ValueError('sample should be positive. Got %s' % (sample, ))
+            if value <= 1: # a fraction of the requests
+                sample = value if value < 1 else None
+            else: # 1 in N requests
+                if value != int(value):
+                    raise ValueError('sample should be a fraction (up to 1) or an integer. Got %s' % (sample, ))
+                sample = int(value)
+        if isinstance(background, basestring): # from configuration
+            background = int(background) if background.isdigit() else background.lower() in [ 'true', 'yes', 'on' ]
         self.tracer_paths = map(re.compile, tracer_paths or [])
-        self.local_context = {}
+        self.match_on = match_on
+        self.sample = sample
+        self.writer = None if not background else TraceWriter() if background is True else TraceWriter(maxsize=int(background))
         super(Tracer, self).__init__(handler=handler)
         
 class Template(Hook):
@@ -335,8 +707,7 @@ class Template(Hook):
         if before_or_after == 'after' and isinstance(result, (dict, DictMixin)):
             tplvars = self.defaults.copy()
             tplvars.update(result)
-            tpl = self.tpl_name
-            result = bottle.template(tpl, result)
+            result = TemplateRegistry.render(self.tpl_name, tplvars)
         return result
         
     def __init__(self, tpl_name, **defaults):
@@ -348,13 +719,58 @@ class Template(Hook):
         self.tpl_name = tpl_name
         super(Template, self).__init__(handler=self.handler)
     
+class ExceptionEntry(dict):
+    '''
+    the occurrences of exceptions with the same fingerprint (exception type, route and the frame that raised it). 
+    Used by :py:class:`WrapException`
+    '''
+    
+    def __init__(self, exc_type, route, where):
+        self['type'] = exc_type
+        self['route'] = route
+        self['where'] = where
+        self['count'] = 0
+        self['suppressed'] = 0  # occurrences in the current window that have not been logged
+        self['first_seen'] = None
+        self['last_seen'] = None
+        self['last_message'] = None
+        self.window = None # the storm_window of the WrapException that recorded the occurrences
+        self.window_start = None
+        self.trace = None # the (cached) traceback part of the error string
+    
+    def add(self, err, now, window):
+        '''
+        records an occurrence. returns (log_traceback, suppressed) - whether the traceback should be logged (the 1st occurrence
+        in a window) and the number of occurrences suppressed in the previous window (which should be summarized)
+        '''
+        self['count'] += 1
+        self.window = window
+        self['last_seen'] = now
+        self['last_message'] = str(err)
+        if self['first_seen'] is None: self['first_seen'] = now
+        if self.window_start is None or now - self.window_start >= window:
+            suppressed, self['suppressed'], self.window_start = self['suppressed'], 0, now
+            return True, suppressed
+        self['suppressed'] += 1
+        return False, 0
+    
+    def expire(self, now):
+        '''
+        ends the current window if it has elapsed. returns the number of occurrences suppressed in that window
+        '''
+        if self.window_start is None or now - self.window_start < self.window:
+            return 0
+        suppressed, self['suppressed'], self.window_start = self['suppressed'], 0, None
+        return suppressed
+
 class WrapException(BasePlugin):
     '''
     WrapException is a special purpose plugin to intercept all exceptions on http routes. Beyond basic interception,
     this plugin provides the capabilities to trap and handle the exceptions and also to perform cleanup functions that may have been specified.
     It decorates the request handler, traps any exception thrown by the handler 
     and packages the exception as a message if an exception messager is provided. In the absence of an exception messager,
-    it logs and raises the same exception back to the caller.
+    it logs and raises the same exception back to the caller. The message includes a short traceback unless :py:class:`boots.mode`
+    is production.
     
     This plugin relies on parameters passed to each methodroute. It relies on 2 parameters
     
@@ -362,14 +778,96 @@ class WrapException(BasePlugin):
         arguments passed to the handler and return a iterable that can be passed back to bottle (and hence to the client)  
     :param cleanup_funcs: **to be used with @methodroute** an optional list of functions to be called to process cleanup on failure (e.g. removing the session). Each function is 
         passed the query argument (multidict) dictionary and all the other arguments passed to the handler.
+    
+    To avoid an exception storm (e.g. when a dependency is down and every request fails) from turning into a logging storm, exceptions 
+    are fingerprinted by their type, route and the frame that raised them. The traceback is logged only for the 1st occurrence of a fingerprint
+ in a window of storm_window seconds. The occurrences suppressed in a window are logged as a summary when the window has elapsed 
+    (by a timer on an :py:class:`InstancedScheduler`, so the summary of a storm that stops is logged too). The fingerprints, and the
+    flushing of their summaries, are shared by all the WrapException instances - each fingerprint is summarized on the storm_window of 
+    the instance that recorded it. The counters are available through :py:meth:`exception_stats` (and hence the /admin/stats 
+    route of a :py:class:`ManagedServer`)
     '''
+    
+    lock = RLock()
+    exceptions = {} # class attribute. fingerprint to ExceptionEntry. Accessed in thread safe manner
+    max_fingerprints = 1000 # the least recently seen fingerprints are discarded beyond this
+    _scheduler = None # (pid, InstancedScheduler) that flushes the summaries of storms
+    _flush_at = None # when the pending flush (if any) is due
                
-    def __init__(self, default_handler=None):
+    def __init__(self, default_handler=None, storm_window=60):
         '''
         :param default_handler: **to be used with instantiating WrapException** a endpoint wide handler that will be used when no handler has been specified with the @methodroute.
             if this is None, no handler is invoked on exception
+        :param storm_window: the window (in seconds) within which repeated occurrences of an exception are counted but not logged
         '''
         self.default_handler = default_handler
+        self.storm_window = storm_window
+    
+    @staticmethod
+    def summarize(entry, suppressed, window):
+        logging.getLogger().error('Exception %s on route %s at %s occurred %s more times in %s seconds. Last: %s', 
+                                  entry['type'], entry['route'], entry['where'], suppressed, window, entry['last_message'])
+    
+    def record(self, err, tb, rule):
+        '''
+        records an occurrence of an exception. returns (entry, log_traceback)
+        '''
+        while tb.tb_next is not None: tb = tb.tb_next # the frame that raised the exception
+        where = '%s:%s' % (tb.tb_frame.f_code.co_filename, tb.tb_lineno)
+        exc_type = err.__class__.__module__ + '.' + err.__class__.__name__
+        key = (exc_type, rule, where)
+        now = time.time()
+        with self.lock:
+            entry = self.exceptions.get(key)
+            if entry is None:
+                if len(self.exceptions) >= self.max_fingerprints:
+                    del self.exceptions[min(self.exceptions, key=lambda k: self.exceptions[k]['last_seen'])]
+                entry = self.exceptions[key] = ExceptionEntry(exc_type, rule, where)
+            log_traceback, suppressed = entry.add(err, now, self.storm_window)
+            if not log_traceback: # summarized when the window elapses
+                self.schedule_flush(entry.window_start + self.storm_window)
+        if suppressed:
+            self.summarize(entry, suppressed, self.storm_window)
+        return entry, log_traceback
+    
+    @classmethod
+    def schedule_flush(cls, when):
+        ''' flushes (see :py:meth:`flush`) at the time when (unless a flush is already due by then) '''
+        with cls.lock:
+            if cls._flush_at is not None and cls._flush_at <= when:
+                return
+            cls._flush_at = when
+            if cls._scheduler is None or cls._scheduler[0] != os.getpid(): # not yet started (or forked)
+                cls._scheduler = (os.getpid(), InstancedScheduler(_ns='exception_storms'))
+        cls._scheduler[1].timer(max(when - time.time(), 0) * 1000, cls.flush, when, _threadpool=False)
+    
+    @classmethod
+    def flush(cls, due=None):
+        '''
+        logs the summaries of the windows that have elapsed. Returns the entries (see :py:class:`ExceptionEntry`)
+        
+        :param due: the time the flush was scheduled for (by :py:meth:`schedule_flush`)
+        '''
+        now = time.time()
+        with cls.lock:
+            if due is not None and due == cls._flush_at:
+                cls._flush_at = None
+            entries = cls.exceptions.values()
+            expired = [ (entry, entry.expire(now)) for entry in entries ]
+            pending = [ entry.window_start + entry.window for entry in entries if entry['suppressed'] ]
+        for entry, suppressed in expired:
+            if suppressed: cls.summarize(entry, suppressed, entry.window)
+        if pending:
+            cls.schedule_flush(min(pending))
+        return entries
+    
+    @classmethod
+    def exception_stats(cls):
+        '''
+        returns a list of the exception counters (most frequent first) of all the WrapException instances. Summaries of 
+        windows that have elapsed are logged 
+        '''
+        return sorted([ dict(entry) for entry in cls.flush() ], key=lambda e: -e['count'])
     
     def setup(self, app):
         ''' Make sure that WrapException is not already installed '''
@@ -383,6 +881,7 @@ class WrapException(BasePlugin):
         handler = context['config'].get('handler', self.default_handler)
         cleanup_funcs = context['config'].get('cleanup_funcs', [])
         method = context['method']
+        rule = context.get('rule')
 
         @wraps(callback)
         def wrapper(*args, **kargs):
@@ -394,31 +893,72 @@ class WrapException(BasePlugin):
             except (bottle.HTTPResponse): # let's not handle bottle.HTTPResponse. This usually means redirect was called
                 raise
             except (Exception) as err: 
-                bottle.response.add_header('Cache-Control' ,'no-cache')
-                logging.getLogger().exception('Exception: %s', err)
-                print err, __file__
-                
-                # FOR DEBUG
-                tb = traceback.extract_tb(sys.exc_info()[2], 2)
-                errstr = str(err) + '<br/>'
-                for file, line, f, text in tb[1:]:
-                    file = os.path.basename(os.path.splitext(file)[0])
-                    errstr += "{}:{} in {}: {}<br/>".format(file, line, f, text)
-    
-                if handler:
-                    err_ret = handler(errstr, qstr, exception=err, *args, **kargs)
-                for f in cleanup_funcs:
-                    try:
-                        f(qstr, *args, **kargs)
-                    except:
-                        pass
-                if handler:
-                    return err_ret
-                else:
-                    bottle.abort(code=500, text=errstr)
+                return self.handle_exception(err, sys.exc_info()[2], handler, cleanup_funcs, qstr, args, kargs, rule)
 
         self.plugin_post_apply(callback, wrapper)
         return wrapper
+    
+    def handle_exception(self, err, tb, handler, cleanup_funcs, qstr, args, kargs, rule=None):
+        '''
+        handles an exception raised by a route. Invokes the handler (if any) and the cleanup functions. If there is no handler,
+        aborts the request with a 500
+        
+        :param err: the exception
+        :param tb: the traceback of the exception
+        :param handler: the handler for the route (or None)
+        :param cleanup_funcs: the cleanup functions for the route
+        :param qstr: the request arguments (multidict)
+        :param args: the positional arguments passed to the route
+        :param kargs: the keyword arguments passed to the route
+        :param rule: the route's rule (used to fingerprint the exception)
+        '''
+        bottle.response.add_header('Cache-Control' ,'no-cache')
+        entry, log_traceback = self.record(err, tb, rule)
+        if log_traceback:
+            logging.getLogger().error('Exception: %s', err, exc_info=(err.__class__, err, tb))
+        
+        if boots.mode == boots.mode.PRODUCTION:
+            errstr = str(err)
+        else: # the trace is part of the response in development mode
+            trace = entry.trace
+            if trace is None: # the same for all occurrences of the fingerprint
+                trace = ''
+                for file, line, f, text in traceback.extract_tb(tb, 2)[1:]:
+                    file = os.path.basename(os.path.splitext(file)[0])
+                    trace += "{}:{} in {}: {}<br/>".format(file, line, f, text)
+                with self.lock:
+                    if entry.trace is None: entry.trace = trace
+                    trace = entry.trace
+            errstr = str(err) + '<br/>' + trace
+
+        if handler:
+            err_ret = handler(errstr, qstr, exception=err, *args, **kargs)
+        for f in cleanup_funcs:
+            try:
+                f(qstr, *args, **kargs)
+            except:
+                pass
+        if handler:
+            return err_ret
+        else:
+            bottle.abort(code=500, text=errstr)
+    
+    fusable = True
+    
+    def phases(self, callback, context):
+        handler = context['config'].get('handler', self.default_handler)
+        cleanup_funcs = context['config'].get('cleanup_funcs', [])
+        method = context['method']
+        rule = context.get('rule')
+        
+        def on_error(state, exc_info, args, kargs):
+            err = exc_info[1]
+            if isinstance(err, (bottle.HTTPError, bottle.HTTPResponse)): # aborts and redirects are not handled
+                return PluginPhases.PROPAGATE
+            qstr = bottle.request.POST if method == 'POST' or method == 'ANY' and len(bottle.request.POST.keys()) else bottle.request.GET
+            return self.handle_exception(err, exc_info[2], handler, cleanup_funcs, qstr, args, kargs, rule)
+        
+        return PluginPhases(on_error=on_error)
 
 class CrossOriginPlugin(BasePlugin):
     '''
@@ -448,22 +988,35 @@ class CrossOriginPlugin(BasePlugin):
         self.allow_credentials = allow_credentials
         self.allow_methods = ", ".join(allow_methods)
     
+    def add_headers(self, callback, kargs):
+        '''
+        Adds the cross-origin headers to the response if the condition holds and the request carries an origin
+        :param callback: the route callback (used to locate the endpoint)
+        :param kargs: the keyword arguments the route will be invoked with
+        '''
+        ep = self.get_callback_obj(callback)
+        cond = self.condition(ep, **kargs)
+        host = ep.environ.get("HTTP_ORIGIN", "") or ep.environ.get("HTTP_REFERER", "")
+        ep.logger.verbose('Cross-origin called for %s, condition %s %s', ep.name, cond, host)
+        if cond and host:
+            ep.response.add_header('Access-Control-Allow-Origin', self._lambda_origins(self, host))
+            ep.response.add_header('Access-Control-Allow-Methods', self.allow_methods)
+            ep.response.add_header('Access-Control-Max-Age', self.max_age)
+            ep.response.add_header('Access-Control-Allow-Credentials', "true" if self.allow_credentials else "false")
+    
     def apply(self, callback, context):
         @wraps(callback)
         def wrapper(**kargs): # assuming bottle always calls with keyword args (even if no default)
-            ep = self.get_callback_obj(callback)
-            cond = self.condition(ep, **kargs)
-            host = ep.environ.get("HTTP_ORIGIN", "") or ep.environ.get("HTTP_REFERER", "")
-            ep.logger.verbose('Cross-origin called for %s, condition %s %s', ep.name, cond, host)
-            if cond and host:
-                ep.response.add_header('Access-Control-Allow-Origin', self._lambda_origins(self, host))
-                ep.response.add_header('Access-Control-Allow-Methods', self.allow_methods)
-                ep.response.add_header('Access-Control-Max-Age', self.max_age)
-                ep.response.add_header('Access-Control-Allow-Credentials', "true" if self.allow_credentials else "false")
+            self.add_headers(callback, kargs)
             return callback(**kargs)
         self.plugin_post_apply(callback, wrapper)
         return wrapper
 
+    fusable = True
+    
+    def phases(self, callback, context):
+        return PluginPhases(before=partial(self.add_headers, callback))
+
 class ConditionalAccess(BasePlugin):
     '''
     Conditional Access Plugin
@@ -479,19 +1032,31 @@ class ConditionalAccess(BasePlugin):
         '''
         self.condition = condition if callable(condition) else lambda ep, **kargs: True if condition is True else lambda ep, **kargs: False
     
+    def check(self, callback, kargs):
+        '''
+        Evaluates the condition for the current request and aborts with a 401 if it does not hold
+        :param callback: the route callback (used to locate the endpoint)
+        :param kargs: the keyword arguments the route will be invoked with
+        '''
+        ep = self.get_callback_obj(callback)
+        cond = self.condition(ep, **kargs)
+        ep.logger.verbose('Conditional Access called for %s, condition %s', ep.name, cond)
+        if not cond:
+            ep.abort(401, 'Access denied due to conditional access')
+    
     def apply(self, callback, context):
         @wraps(callback)
         def wrapper(**kargs): # assuming bottle always calls with keyword args (even if no default)
-            ep = self.get_callback_obj(callback)
-            cond = self.condition(ep, **kargs)
-            ep.logger.verbose('Conditional Access called for %s, condition %s', ep.name, cond)
-            if cond:
-                return callback(**kargs)
-            else:
-                ep.abort(401, 'Access denied due to conditional access')
+            self.check(callback, kargs)
+            return callback(**kargs)
         self.plugin_post_apply(callback, wrapper)
         return wrapper
 
+    fusable = True
+    
+    def phases(self, callback, context):
+        return PluginPhases(before=partial(self.check, callback))
+
 # decorators for allowing routes to be setup and handled by instance methods
 # credit to http://stackoverflow.com/users/296069/skirmantas
 def methodroute(path=None, **kargs):
@@ -528,6 +1093,7 @@ def methodroute(path=None, **kargs):
     :param dict params: see description at (:py:class:`RequestParams`)
     :param handler: see description at (:py:class:`WrapException`)
     :param list cleanup_funcs: see description at (:py:class:`WrapException`)
+    :param dict cache: see description at (:py:class:`ResponseCache`)
     
     **A few examples of methodroute**::
     
@@ -587,17 +1153,418 @@ class ResponseHeader(BasePlugin):
         '''
         @wraps(callback)
         def wrapper(*args, **kargs): # assuming bottle always calls with keyword args (even if no default)
-            ep = self.get_callback_obj(callback)
             ret = callback(*args, header_dict=self.header_dict, **kargs)
-            if self.header_dict:
-                for name, value in self.header_dict.items():
-                    if(name == "Expires"):
-                        value = datetime.utcnow() + timedelta(seconds=int(value))
-                        value = value.strftime('%a, %d %b %Y %H:%M:%S GMT') #RFC 1123 Time Format  as per rfc2616
-                    ep.response.add_header(name, value)
+            self.add_headers(callback)
             return ret
         self.plugin_post_apply(callback, wrapper)
         return wrapper
+
+    def add_headers(self, callback):
+        '''
+        Adds the configured headers to the response. Expires is given in seconds from now
+        :param callback: the route callback (used to locate the endpoint)
+        '''
+        if self.header_dict:
+            ep = self.get_callback_obj(callback)
+            for name, value in self.header_dict.items():
+                if(name == "Expires"):
+                    value = datetime.utcnow() + timedelta(seconds=int(value))
+                    value = value.strftime('%a, %d %b %Y %H:%M:%S GMT') #RFC 1123 Time Format  as per rfc2616
+                ep.response.add_header(name, value)
+
+    fusable = True
+
+    def phases(self, callback, context):
+        def before(kargs):
+            kargs['header_dict'] = self.header_dict
+        def after(state, result, kargs):
+            self.add_headers(callback)
+            return result
+        return PluginPhases(before=before, after=after, updates_kargs=True)
+    
+class Drain(BasePlugin):
+    '''
+    Drain registers requests in flight with :py:class:`boots.common.inflight.InFlight` so that a stopping server can wait for them
+    to complete (see :py:meth:`boots.servers.server.Server.stop_server`). Once the server is draining, new requests are refused
+    with a 503 (and a Retry-After header) so that clients and load balancers retry elsewhere.
+    
+    With HTTPServers, Drain is a standard plugin (the outermost but for the Stats of a ManagedServer, which counts the refused
+    requests). Routes that should respond while draining 
+    (e.g. /admin/health) skip it with skip_by_type=[Drain]
+    '''
+    
+    kind = 'http'
+    
+    def __init__(self, retry_after=5):
+        '''
+        :param retry_after: the value (in seconds) of the Retry-After header of refused requests
+        '''
+        self.retry_after = str(retry_after)
+    
+    def enter(self, kargs=None):
+        ''' registers the request. Refuses it with a 503 if draining '''
+        if not InFlight.enter(self.kind):
+            raise bottle.HTTPError(503, 'Server is shutting down', **{ 'Retry-After': self.retry_after, 'Connection': 'close' })
+    
+    def after(self, state, result, kargs):
+        InFlight.exit(self.kind)
+        return result
+    
+    def on_error(self, state, exc_info, args, kargs):
+        InFlight.exit(self.kind)
+        return PluginPhases.PROPAGATE
+    
+    def apply(self, callback, context):
+        @wraps(callback)
+        def wrapper(*args, **kargs):
+            self.enter()
+            try:
+                return callback(*args, **kargs)
+            finally:
+                InFlight.exit(self.kind)
+        self.plugin_post_apply(callback, wrapper)
+        return wrapper
+    
+    fusable = True
+    
+    def phases(self, callback, context):
+        return PluginPhases(before=self.enter, after=self.after, on_error=self.on_error)
+    
+class Flight(object):
+    '''
+    a request in progress (led by one request) that other identical requests wait on. Used by :py:class:`Coalesce`
+    '''
+    __slots__ = ('event', 'result', 'status', 'headers', 'exc_info', 'shared')
+    
+    def __init__(self):
+        self.event = Event()
+        self.result = self.status = self.headers = self.exc_info = None
+        self.shared = False
+
+class Coalesce(BasePlugin):
+    '''
+    Coalesce collapses identical concurrent requests (singleflight). The 1st request for a key (the route, its path and parameters
+    as bound by :py:class:`RequestParams`) is the leader and invokes the route. Identical requests that arrive while the leader is in 
+    progress wait for it and respond with its result, status and representation headers (see shared_headers) or re-raise its exception
+    instead of invoking the route.
+    
+    Only results that can be shared (strings and dicts) are shared. Responses that set cookies are not shared. In these cases,
+    the waiting requests invoke the route themselves.
+    
+    Since the waiting requests get the leader's response, requests that may be answered differently (e.g. for different users) should
+    differ in their key. The environ variables in vary (by default, REMOTE_USER, HTTP_AUTHORIZATION and HTTP_ORIGIN) are part of the
+    key. Routes whose responses depend on the session should add HTTP_COOKIE. Since the origin is part of the key, the CORS headers 
+    (Access-Control-*) of the leader are shared too.
+    
+    With HTTPServers, Coalesce is automatically instantiated if enabled in configuration files (see :py:class:`HTTPServer`). Routes can
+    opt out with skip_by_type=[Coalesce] or by passing coalesce=False with :py:func:`methodroute`. 
+    The number of requests collapsed is available through :py:meth:`coalesce_stats` (and hence the /admin/stats route of a :py:class:`ManagedServer`)
+    '''
+    
+    #: class attributes. the number of requests that led and that were collapsed (waited for a leader)
+    leaders = ShardedCounter()
+    collapsed = ShardedCounter()
+    
+    #: the (representation) headers of the leader's response that are shared with the waiting requests
+    shared_headers = frozenset([ 'content-type', 'content-encoding', 'content-language', 'cache-control', 'vary' ])
+    
+    def __init__(self, methods=('GET', 'HEAD'), vary=('REMOTE_USER', 'HTTP_AUTHORIZATION', 'HTTP_ORIGIN'), timeout=30):
+        '''
+        :param methods: the routes (by method) that are coalesced
+        :param vary: names of the environ variables that are part of the key
+        :param timeout: the maximum time (in seconds) that a request waits for a leader. Thereafter it invokes the route itself
+        '''
+        self.methods = bottle.makelist(methods)
+        self.vary = tuple(bottle.makelist(vary))
+        self.timeout = float(timeout) if timeout is not None else None
+        self.lock = RLock()
+        self.flights = {}
+    
+    @classmethod
+    def coalesce_stats(cls):
+        return dict(leaders=cls.leaders.value(), collapsed=cls.collapsed.value())
+    
+    def lead(self, flight, callback, args, kargs):
+        try:
+            flight.result = result = callback(*args, **kargs)
+        except Exception: # including aborts and redirects (which are shared with the waiting requests)
+            flight.exc_info = sys.exc_info()
+            raise
+        else:
+            response = bottle.response
+            flight.status = response.status
+            headerlist = response.headerlist # includes the cookies
+            flight.headers = [ (name, value) for name, value in headerlist 
+                               if name.lower() in self.shared_headers or name.lower().startswith('access-control-') ]
+            flight.shared = isinstance(result, (basestring, dict, DictMixin)) and not [ name for name, _ in headerlist if name.lower() == 'set-cookie' ]
+            return result
+        finally:
+            flight.event.set()
+    
+    def follow(self, flight):
+        '''
+        responds with the leader's response. returns (True, result) if the response is shared, else (False, None)
+        '''
+        if flight.exc_info is not None:
+            raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+        if not flight.shared:
+            return False, None
+        response = bottle.response
+        response.status = flight.status
+        for name, value in flight.headers:
+            response.set_header(name, value) if name.lower() == 'content-type' else response.add_header(name, value)
+        return True, flight.result
+    
+    def apply(self, callback, context):
+        if context['method'] not in self.methods or context['config'].get('coalesce', True) is False:
+            return callback
+        rule = context['rule']
+        vary = self.vary
+        
+        @wraps(callback)
+        def wrapper(*args, **kargs): # assuming bottle always calls with keyword args (even if no default)
+            environ = bottle.request.environ
+            key = (rule, environ.get('REQUEST_METHOD'), bottle.request.fullpath, repr(sorted(kargs.iteritems())), tuple(environ.get(name) for name in vary))
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Flight()
+            if leader:
+                self.leaders.increment()
+                try:
+                    return self.lead(flight, callback, args, kargs)
+                finally:
+                    with self.lock:
+                        self.flights.pop(key, None)
+            flight.event.wait(self.timeout)
+            if flight.event.is_set():
+                shared, result = self.follow(flight)
+                if shared:
+                    self.collapsed.increment()
+                    return result
+            return callback(*args, **kargs)
+        
+        self.plugin_post_apply(callback, wrapper)
+        return wrapper
+    
+class ResponseCache(BasePlugin):
+    '''
+    ResponseCache caches the responses of GET (and HEAD) routes in a (beaker) cache configured with the server (see the cache 
+    parameter of :py:class:`HTTPServer`). The response body and headers are cached against the path of the request and the 
+    parameters (as bound by :py:class:`RequestParams`) so that subsequent requests are served without invoking the route. 
+    Responses carry an ETag and a Last-Modified header and requests with a matching If-None-Match are answered with a 304.
+    
+    Only successful (200) responses that are strings or dicts (which are converted to json) and that do not set cookies are cached.
+    Only the representation headers (see cached_headers) are cached with a response - the headers that the plugins of the endpoint
+    set for each request (e.g. the CORS headers of :py:class:`CrossOriginPlugin`) are not replayed to other clients.
+    
+    With HTTPServers, ResponseCache is automatically instantiated and acts only on routes that specify the cache parameter 
+    with :py:func:`methodroute`:
+    
+    :param dict cache: **to be used with @methodroute** may contain
+    
+        * expire - the time (in seconds) for which the response is cached (defaults to the cache configuration)
+        * vary - a list of parameter names that the response depends on. Defaults to all the parameters
+        * region - a cache region (as configured with the cache) to use instead of expire
+        * cache_name - the name of the server attribute with the cache (see :py:class:`HTTPServer`). Defaults to cache
+    
+    example::
+    
+        @methodroute(params=dict(lang=str, page=int), cache=dict(expire=300, vary=['lang']))
+        def catalog(self, lang='en', page=1):
+            ...
+    '''
+    
+    #: the (representation) headers that are cached with a response
+    cached_headers = frozenset([ 'content-type', 'content-encoding', 'content-language', 'cache-control', 'vary' ])
+    
+    def setup(self, app):
+        for other in app.plugins:
+            if isinstance(other, ResponseCache):
+                raise bottle.PluginError("Found another ResponseCache plugin")
+    
+    def get_cache(self, ep, rule, config):
+        '''
+        returns the beaker cache (namespace) for the route or None if the server has no cache configured
+        '''
+        manager = getattr(ep.server, config.get('cache_name', 'cache'), None)
+        if manager is None:
+            return None
+        namespace = 'boots.response.%s.%s' % (ep.name, rule)
+        if config.get('region'):
+            return manager.get_cache_region(namespace, config['region'])
+        return manager.get_cache(namespace, **dict(expire=int(config['expire'])) if config.get('expire') else {})
+    
+    def make_key(self, vary, kargs):
+        params = sorted(kargs.iteritems()) if vary is None else [ (name, kargs.get(name)) for name in vary ]
+        return repr((bottle.request.fullpath, params))
+    
+    def respond(self, entry, restore_headers=True):
+        '''
+        applies a cached entry (body, headers, etag, last modified) to the response. returns the body (or '' for a 304 or HEAD)
+        
+        :param entry: the cached entry
+        :param restore_headers: whether the cached headers should be added to the response (i.e. they are not already set)
+        '''
+        body, headers, etag, last_modified = entry
+        response = bottle.response
+        if restore_headers:
+            for name, value in headers:
+                response.add_header(name, value)
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = last_modified
+        if_none_match = bottle.request.environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (if_none_match.strip() == '*' or etag in [ tag.strip() for tag in if_none_match.split(',') ]):
+            response.status = 304
+            for name in [ 'Content-Type', 'Content-Encoding' ]:
+                if name in response.headers: del response.headers[name]
+            return ''
+        return '' if bottle.request.method == 'HEAD' else body
+        
+    def apply(self, callback, context):
+        config = context['config'].get('cache')
+        if not config or context['method'] not in [ 'GET', 'HEAD' ]:
+            return callback
+        config = dict(expire=config) if type(config) in [ int, long ] else dict(config)
+        vary = config.get('vary')
+        rule = context['rule']
+        
+        @wraps(callback)
+        def wrapper(*args, **kargs): # assuming bottle always calls with keyword args (even if no default)
+            ep = self.get_callback_obj(callback)
+            cache = self.get_cache(ep, rule, config)
+            if cache is None:
+                return callback(*args, **kargs)
+            key = self.make_key(vary, kargs)
+            try:
+                entry = cache.get(key)
+            except KeyError:
+                entry = None
+            if entry is not None:
+                ep.response.headers['X-Cache'] = 'HIT'
+                return self.respond(entry)
+            
+            result = callback(*args, **kargs)
+            response = bottle.response
+            if isinstance(result, (dict, DictMixin)):
+                result = bottle.json_dumps(result)
+                response.content_type = 'application/json'
+            if isinstance(result, unicode):
+                result = result.encode(response.charset or 'UTF-8')
+            if response.status_code != 200 or not isinstance(result, str):
+                return result
+            headerlist = response.headerlist # includes the cookies
+            if [ name for name, _ in headerlist if name.lower() == 'set-cookie' ]:
+                return result
+            headers = [ (name, value) for name, value in headerlist if name.lower() in self.cached_headers ]
+            entry = (result, headers, '"%s"' % hashlib.md5(result).hexdigest(), time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime()))
+            cache.put(key, entry)
+            response.headers['X-Cache'] = 'MISS'
+            return self.respond(entry, restore_headers=False)
+        
+        self.plugin_post_apply(callback, wrapper)
+        return wrapper
+    
+class Compress(BasePlugin):
+    '''
+    Compress compresses responses with gzip or deflate as negotiated through the request's Accept-Encoding header. 
+    Only responses (strings or dicts - which are converted to json) of at least min_size bytes, with a compressible 
+    Content-Type are compressed. Routes can opt out with skip_by_type=[Compress].
+    
+    Compressed bodies are kept in a bounded LRU cache keyed by the response's ETag (or a digest of the body if no ETag is set)
+    so that identical responses are not compressed again on every request. 
+    
+    With HTTPServers, Compress is automatically instantiated (as the outermost plugin) if enabled in configuration files
+    (see :py:class:`HTTPServer`)
+    '''
+    
+    #: the Content-Encodings supported in the order of preference
+    encodings = [ 'gzip', 'deflate' ]
+    
+    def __init__(self, min_size=1024, level=6, cache_size=256, 
+                 content_types=('text/', 'application/json', 'application/javascript', 'application/xml')):
+        '''
+        :param int min_size: responses smaller than this (in bytes) are not compressed
+        :param int level: the compression level (1 - fastest to 9 - smallest)
+        :param int cache_size: the maximum number of compressed bodies that are cached. 0 disables the cache
+        :param content_types: the Content-Types (or their prefixes) that are compressed
+        '''
+        self.min_size = int(min_size)
+        self.level = int(level)
+        self.cache = LRUCache(int(cache_size)) if int(cache_size) > 0 else None
+        self.content_types = tuple(bottle.makelist(content_types))
+    
+    def setup(self, app):
+        for other in app.plugins:
+            if isinstance(other, Compress):
+                raise bottle.PluginError("Found another Compress plugin")
+    
+    def accepted_encoding(self):
+        '''
+        returns the encoding (from self.encodings) that the request accepts or None
+        '''
+        accept = bottle.request.environ.get('HTTP_ACCEPT_ENCODING', '')
+        if not accept: return None
+        accepted = {}
+        for part in accept.split(','):
+            token, _, params = part.strip().partition(';')
+            q = params.strip()
+            try:
+                accepted[token.strip().lower()] = float(q[2:]) if q.startswith('q=') else 1.0
+            except ValueError:
+                accepted[token.strip().lower()] = 0.0
+        for encoding in self.encodings:
+            if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+                return encoding
+        return None
+    
+    def _compress(self, body, encoding):
+        if encoding == 'gzip':
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(body) + compressor.flush()
+        return zlib.compress(body, self.level)
+        
+    def compress(self, result):
+        '''
+        returns the result compressed (and sets the Content-Encoding) if the response qualifies for compression
+        '''
+        response = bottle.response
+        if isinstance(result, (dict, DictMixin)):
+            result = bottle.json_dumps(result)
+            response.content_type = 'application/json'
+        if not isinstance(result, basestring) or len(result) < self.min_size or response.status_code != 200 \
+            or 'Content-Encoding' in response.headers or not response.content_type.startswith(self.content_types):
+            return result
+        response.add_header('Vary', 'Accept-Encoding')
+        encoding = self.accepted_encoding()
+        if encoding is None or bottle.request.method == 'HEAD':
+            return result
+        if isinstance(result, unicode):
+            result = result.encode(response.charset or 'UTF-8')
+        if self.cache is None:
+            body = self._compress(result, encoding)
+        else:
+            key = (response.headers.get('ETag') or hashlib.md5(result).digest(), encoding)
+            body = self.cache.get(key)
+            if body is None:
+                body = self._compress(result, encoding)
+                self.cache.put(key, body)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(body))
+        return body
+    
+    def apply(self, callback, context):
+        @wraps(callback)
+        def wrapper(*args, **kargs): # assuming bottle always calls with keyword args (even if no default)
+            return self.compress(callback(*args, **kargs))
+        self.plugin_post_apply(callback, wrapper)
+        return wrapper
+    
+    fusable = True
+    
+    def phases(self, callback, context):
+        return PluginPhases(after=lambda state, result, kargs: self.compress(result))
     
 class HTTPServerEndPoint(EndPoint):
     '''
@@ -648,7 +1615,7 @@ class HTTPServerEndPoint(EndPoint):
                     self._endpoint_app.route(path=path, callback=callback, apply=per_route_plugins, **route_kargs)
                     
                 
-    def __init__(self, name=None, mountpoint='/', plugins=None, server=None, activate=False):
+    def __init__(self, name=None, mountpoint='/', plugins=None, server=None, activate=False, fuse_plugins=None):
         '''
         :param str name: a name for the endpoint
         :param str mountpoint: the prefix for all routes within this endpoint
@@ -660,8 +1627,11 @@ class HTTPServerEndPoint(EndPoint):
             be required here if activate is True
         :param bool activate: whether to activate this endpoint on creation or later through an explicit 
             :py:meth:`activate` call
+        :param bool fuse_plugins: whether consecutive fusable plugins are run from a single dispatcher per route (see :py:class:`FusedPlugins`).
+            None (default) implies that the server's fuse_plugins setting is used
         '''
         super(HTTPServerEndPoint, self).__init__(server=server)
+        self.fuse_plugins = fuse_plugins
         self.name = name = name or self._name_prefix + str(HTTPServerEndPoint._counter())
         self.mountpoint = mountpoint
         self.plugins = getattr(self, 'plugins', []) + (plugins or []) # in case plugins have already been set up
@@ -712,7 +1682,9 @@ class HTTPServerEndPoint(EndPoint):
         # apply all plugins
         self.std_plugins = self.server.get_standard_plugins(self.plugins)
         self.plugins = self.std_plugins + self.plugins
-        [ self._endpoint_app.install(plugin) for plugin in self.plugins ]
+        fuse = self.fuse_plugins if self.fuse_plugins is not None else getattr(self.server, 'fuse_plugins', False)
+        # self.plugins retains the individual plugins (so that skip_by_type finds them) even if they are installed fused
+        [ self._endpoint_app.install(plugin) for plugin in (FusedPlugins.fuse(self.plugins) if fuse else self.plugins) ]
         #logging.getLogger().debug("plugins : %s", self.plugins)
         self.routeapp() # establish any routes that have been setup by the @methodroute decorator
         super(HTTPServerEndPoint, self).activate()
@@ -894,10 +1866,109 @@ class HTTPServerEndPoint(EndPoint):
         '''
         absprefix = os.path.abspath(base_dir)
         newpath = os.path.abspath(os.path.join(absprefix, path))
-        if not newpath.startswith(absprefix):
+        if not DirUtils.is_within(absprefix, newpath):
             raise ValueError('path parameter '+ path +' invalid.' + ' base = ' + absprefix + ' newpath = ' + newpath)
         return newpath
 
+    def send_file(self, root, path, mimetype='auto', download=False, chunk_size=1024*1024):
+        '''
+        sends a file as the response without reading it into memory. The file is resolved through 
+        :py:meth:`boots.common.dirutils.DirUtils.resolve_path` so it must reside within root. Supports HEAD, If-Modified-Since (304) 
+        and a single byte Range (206). The file object is returned for complete responses, which allows the WSGI server to use 
+        wsgi.file_wrapper (i.e. sendfile) when it offers it. Range responses are streamed in chunks.
+        
+        Typical usage is to return the result from a route::
+        
+            @methodroute(path='/export/<name>')
+            def export(self, name):
+                return self.send_file('/var/exports', name, download=True)
+        
+        :param str root: Root Directory within which to resolve path
+        :param str path: The path to the file relative to root
+        :param mimetype: the Content-Type. 'auto' (default) guesses it from the path. None does not set it 
+        :param download: if True, the file is sent as an attachment with its name. A string is taken as the name of the attachment
+        :param int chunk_size: the maximum size of each chunk that is read while streaming a range
+        :returns: the response body
+        '''
+        try:
+            abspath = DirUtils().resolve_path(root, path)
+        except ValueError:
+            self.abort(403, 'Access denied')
+        if not os.path.isfile(abspath):
+            self.abort(404, 'File does not exist')
+        if not os.access(abspath, os.R_OK):
+            self.abort(403, 'You do not have permission to access this file')
+        
+        headers = self.response.headers
+        if mimetype == 'auto':
+            mimetype, encoding = mimetypes.guess_type(abspath)
+            if encoding: headers['Content-Encoding'] = encoding
+        if mimetype: headers['Content-Type'] = mimetype
+        if download:
+            headers['Content-Disposition'] = 'attachment; filename="%s"' % os.path.basename(abspath if download is True else download)
+        
+        stats = os.stat(abspath)
+        size = stats.st_size
+        headers['Last-Modified'] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(stats.st_mtime))
+        headers['Accept-Ranges'] = 'bytes'
+        ims = self.environ.get('HTTP_IF_MODIFIED_SINCE')
+        ims = bottle.parse_date(ims.split(";")[0].strip()) if ims else None
+        if ims is not None and ims >= int(stats.st_mtime):
+            self.response.status = 304
+            return ''
+        
+        offset, length = 0, size
+        if 'HTTP_RANGE' in self.environ:
+            ranges = list(bottle.parse_range_header(self.environ['HTTP_RANGE'], size))
+            if not ranges:
+                raise bottle.HTTPError(416, 'Requested Range Not Satisfiable', **{ 'Content-Range': 'bytes */%d' % size })
+            offset, end = ranges[0] # multiple ranges are not supported. We serve the 1st
+            length = end - offset
+            self.response.status = 206
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (offset, end - 1, size)
+        headers['Content-Length'] = str(length)
+        
+        if self.environ.get('REQUEST_METHOD') == 'HEAD':
+            return ''
+        fp = open(abspath, 'rb')
+        if length == size:
+            return fp # the server sends this with wsgi.file_wrapper if available
+        return self._file_range(fp, offset, length, chunk_size)
+    
+    @staticmethod
+    def _file_range(fp, offset, length, chunk_size):
+        ''' yields chunks of upto chunk_size from a range of the file (and closes the file) '''
+        try:
+            fp.seek(offset)
+            while length > 0:
+                chunk = fp.read(min(length, chunk_size))
+                if not chunk: break
+                length -= len(chunk)
+                yield chunk
+        finally:
+            fp.close()
+    
+    def stream(self, iterable, mimetype=None, charset='UTF-8'):
+        '''
+        streams the chunks from iterable (e.g. a generator) as the response. No Content-Length is sent so servers that
+        support it (e.g. gevent) use chunked transfer encoding. Chunks may be bytes or unicode (which is encoded with charset).
+        Typical usage is to return the result from a route::
+        
+            @methodroute()
+            def export(self):
+                return self.stream(('%s\\n' % row for row in self.rows()), mimetype='text/csv')
+        
+        :param iterable: an iterable of chunks
+        :param str mimetype: the Content-Type of the response
+        :param str charset: the charset to encode unicode chunks with 
+        :returns: the response body
+        '''
+        if mimetype:
+            self.response.headers['Content-Type'] = mimetype + ('; charset=%s' % charset if mimetype.startswith('text/') else '')
+        if 'Content-Length' in self.response.headers:
+            del self.response.headers['Content-Length']
+        return (chunk.encode(charset) if isinstance(chunk, unicode) else chunk for chunk in iterable)
+    
     def process_as_xsendfile(self, root, path):
         '''
         X-Sendfile (Apache mod_xsendfile) (NGinx: X-Accel-Redirect) is a way to dynamically inform web servers to serve
@@ -0,0 +1,274 @@
+'''
+A process wide pool of persistent (keep-alive) HTTP connections for :py:class:`boots.endpoints.httpclient_ep.HTTPClientEndPoint`.
+
+urllib2 opens (and closes) a new connection for every request. With a pool, requests to the same host (scheme, host and port)
+reuse idle connections - avoiding a TCP (and SSL) handshake per request and sockets in TIME_WAIT. This matters most for calls within
+a cluster, which go to the same few hosts. The pool is used through urllib2 handlers (see :py:meth:`ConnectionPool.handlers`)
+
+* At most max_per_host idle connections are kept per host. Connections beyond these are closed when released
+* Connections idle for more than idle_timeout seconds are closed rather than reused
+* Before an idle connection is reused, it is checked to be healthy (i.e. the server has not closed it). A request that fails
+  on a reused connection (e.g. closed by the server just then) is retried once on a new connection if it is safe to retry. 
+  The other idle connections to the host are closed too (they are likely to be stale as well)
+* A connection is released to the pool once its response has been read completely. Responses that are closed before that close
+  their connection
+
+Hosts are resolved through the process wide :py:class:`boots.common.resolver.Resolver` cache.
+
+The pool is thread safe and (with :py:data:`boots.concurrency` set to gevent) gevent safe. Child processes (e.g. prefork workers)
+do not reuse connections opened by their parent.
+'''
+from boots import concurrency
+import httplib
+import logging
+import os
+import select
+import socket
+import time
+import urllib2
+from boots.common.resolver import Resolver
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+elif concurrency == 'threading':
+    from threading import RLock
+
+def split_timeout(timeout):
+    '''
+    returns (connect timeout, read timeout) from a timeout that is a number (for both), a tuple of these or None. 
+    None (or socket's default timeout) implies no timeout
+    '''
+    if timeout is None or timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        return None, None
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return (float(connect) if connect is not None else None), (float(read) if read is not None else None)
+    return float(timeout), float(timeout)
+
+class PooledResponse(object):
+    '''
+    adapts an httplib.HTTPResponse for urllib2 (which reads through recv). Releases the connection to the pool once the response
+    has been read completely
+    '''
+
+    def __init__(self, pool, key, conn, response, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        '''
+        :param timeout: the (connect) timeout of the request. It is restored on the socket (in place of a read timeout) when the 
+            connection is released
+        '''
+        self.pool, self.key, self.conn, self.response, self.timeout = pool, key, conn, response, timeout
+
+    def recv(self, amt=None):
+        data = self.response.read(amt)
+        if self.response.isclosed(): # read completely
+            self.release()
+        return data
+    read = recv
+
+    def release(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            if conn.sock is not None:
+                conn.sock.settimeout(socket.getdefaulttimeout() if self.timeout is socket._GLOBAL_DEFAULT_TIMEOUT else self.timeout)
+            self.pool.release(self.key, conn, reusable=not self.response.will_close)
+
+    def close(self):
+        ''' closes the response. The connection is closed (rather than released) if the response was not read completely '''
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            self.pool.discard(conn)
+        self.response.close()
+
+class PooledHTTPHandler(urllib2.HTTPHandler):
+    ''' a urllib2 handler that makes http requests over connections from a :py:class:`ConnectionPool` '''
+
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        if req._tunnel_host: # via a proxy. not pooled
+            return urllib2.HTTPHandler.http_open(self, req)
+        return self.pool.open(req, 'http')
+
+if hasattr(httplib, 'HTTPS'):
+    class PooledHTTPSHandler(urllib2.HTTPSHandler):
+        ''' a urllib2 handler that makes https requests over connections from a :py:class:`ConnectionPool` '''
+
+        def __init__(self, pool, debuglevel=0, **kargs):
+            urllib2.HTTPSHandler.__init__(self, debuglevel, **kargs)
+            self.pool = pool
+
+        def https_open(self, req):
+            if req._tunnel_host:
+                return urllib2.HTTPSHandler.https_open(self, req)
+            context = getattr(self, '_context', None)
+            return self.pool.open(req, 'https', **(dict(context=context) if context is not None else {}))
+else:
+    PooledHTTPSHandler = None
+
+class ConnectionPool(object):
+    '''
+    A pool of persistent HTTP connections, by host. Typically, the pool shared by the process (see :py:meth:`shared`) is used.
+    Counters of the connections created, reused, released and discarded (closed as stale, expired or not reusable) are available
+    through :py:meth:`stats`
+    '''
+
+    #: methods that are safe to retry on a new connection when a reused connection fails
+    idempotent_methods = frozenset([ 'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE' ])
+    connection_classes = dict(http=httplib.HTTPConnection, https=getattr(httplib, 'HTTPSConnection', None))
+
+    _shared = None
+    _shared_lock = RLock()
+
+    def __init__(self, max_per_host=10, idle_timeout=30):
+        '''
+        :param max_per_host: the maximum number of idle connections kept per host
+        :param idle_timeout: connections idle for longer than these many seconds are not reused
+        '''
+        self.max_per_host = int(max_per_host)
+        self.idle_timeout = float(idle_timeout)
+        self.lock = RLock()
+        self.idle = {} # (scheme, host) to a list of (connection, released at). the most recently released last
+        self.pid = os.getpid()
+        self.counters = dict(created=0, reused=0, released=0, discarded=0, retried=0)
+
+    @classmethod
+    def shared(cls):
+        ''' returns the pool shared by the process '''
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def configure(self, max_per_host=None, idle_timeout=None, **kargs):
+        ''' updates the settings of the pool (e.g. from the configuration) '''
+        if max_per_host is not None: self.max_per_host = int(max_per_host)
+        if idle_timeout is not None: self.idle_timeout = float(idle_timeout)
+
+    def handlers(self):
+        ''' returns the urllib2 handlers that make requests through this pool (to pass to urllib2.build_opener) '''
+        return [ PooledHTTPHandler(self) ] + ([ PooledHTTPSHandler(self) ] if PooledHTTPSHandler is not None else [])
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    @staticmethod
+    def healthy(conn):
+        ''' an idle connection is healthy if it is connected and has nothing to read (i.e. the server has not closed it) '''
+        sock = conn.sock
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([ sock ], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+    def acquire(self, key, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, **conn_args):
+        '''
+        returns (connection, reused) - an idle, healthy connection to the host or a new one
+        '''
+        now = time.time()
+        while True:
+            with self.lock:
+                if self.pid != os.getpid(): # forked. the connections belong to the parent
+                    self.idle, self.pid = {}, os.getpid()
+                idle = self.idle.get(key)
+                conn, released_at = idle.pop() if idle else (None, None)
+            if conn is None:
+                break
+            if now - released_at <= self.idle_timeout and self.healthy(conn):
+                # the socket has the timeout of the request that used it last
+                conn.sock.settimeout(socket.getdefaulttimeout() if timeout is socket._GLOBAL_DEFAULT_TIMEOUT else timeout)
+                self._count('reused')
+                return conn, True
+            self.discard(conn)
+        scheme, host = key
+        conn = self.connection_classes[scheme](host, timeout=timeout, **conn_args)
+        conn._create_connection = Resolver.create_connection # resolve the host through the shared cache
+        self._count('created')
+        return conn, False
+
+    def release(self, key, conn, reusable=True):
+        ''' returns a connection (whose response has been read completely) to the pool '''
+        if not reusable or conn.sock is None:
+            return self.discard(conn)
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_per_host and self.pid == os.getpid():
+                idle.append((conn, time.time()))
+                self.counters['released'] += 1
+                return
+        self.discard(conn)
+
+    def discard(self, conn):
+        self._count('discarded')
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def open(self, req, scheme, **conn_args):
+        '''
+        makes the urllib2 request req over a pooled connection and returns the response (as urllib2's handlers do). The 
+        timeout of req applies to connecting and, unless req has a read_timeout, to reading the response
+        '''
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (scheme, host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items() if k not in headers)
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers.pop('Connection', None) # keep-alive is the default with HTTP/1.1
+        method = req.get_method()
+        read_timeout = getattr(req, 'read_timeout', None)
+
+        while True:
+            conn, reused = self.acquire(key, req.timeout, **conn_args)
+            sent = False
+            try:
+                conn.request(method, req.get_selector(), req.data, headers)
+                sent = True
+                if read_timeout is not None and conn.sock is not None:
+                    conn.sock.settimeout(read_timeout)
+                response = conn.getresponse(buffering=True)
+                break
+            except (httplib.HTTPException, socket.error) as err:
+                self.discard(conn)
+                # a reused connection may have been closed by the server. retry if the request was not sent or can be repeated
+                if reused and (not sent or method in self.idempotent_methods):
+                    logging.getLogger().debug('Retrying %s %s on a new connection: %s', method, req.get_full_url(), err)
+                    self._count('retried')
+                    self.close(key) # the retry gets a new connection
+                    continue
+                raise urllib2.URLError(err)
+
+        pooled = PooledResponse(self, key, conn, response, req.timeout)
+        if response.isclosed(): # no body (e.g. HEAD or 204)
+            pooled.release()
+        fp = socket._fileobject(pooled, close=True)
+        resp = urllib2.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+    def close(self, key=None):
+        ''' closes all the idle connections (to the host identified by key if specified) '''
+        with self.lock:
+            if key is None:
+                idle, self.idle = self.idle, {}
+            else:
+                idle = { key: self.idle.pop(key, []) }
+        for conns in idle.itervalues():
+            for conn, _ in conns:
+                self.discard(conn)
+
+    def stats(self):
+        ''' returns the counters and the number of idle connections by host '''
+        with self.lock:
+            stats = dict(self.counters)
+            stats['idle'] = dict(('%s://%s' % key, len(conns)) for key, conns in self.idle.iteritems() if conns)
+        return stats
@@ -0,0 +1,155 @@
+'''
+Retries and circuit breakers for the HTTP client endpoints (see :py:mod:`boots.endpoints.httpclient_ep`).
+
+* :py:class:`RetryPolicy` retries idempotent requests that fail with a connection error, a timeout or a 502, 503 or 504, after
+  an exponential backoff with (full) jitter - so that clients retrying together do not hit the backend together again
+* :py:class:`CircuitBreaker` fails requests to a host fast (with :py:class:`CircuitOpen`) after repeated failures, rather than
+  tying up threads and connections on a host that is down. After reset_timeout seconds a single trial request is let through.
+  The circuit closes if it succeeds and opens again if it fails
+
+The breakers (by host) are process wide. Their state and trip counts are available through :py:meth:`CircuitBreaker.stats`
+'''
+from boots import concurrency
+from boots.endpoints.http_pool import ConnectionPool
+from boots.common.threadpool import InstancedScheduler
+import os
+import random
+import time
+import urllib2
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+elif concurrency == 'threading':
+    from threading import RLock
+
+class CircuitOpen(urllib2.URLError):
+    ''' the error of a request to a host whose circuit is open (i.e. that is failing) '''
+    pass
+
+class RetryPolicy(object):
+    ''' when (and after how long) to retry a failed request '''
+
+    #: statuses (of HTTPErrors) that imply a transient failure
+    retry_statuses = frozenset([ 502, 503, 504 ])
+
+    _scheduler = None
+    _lock = RLock()
+
+    def __init__(self, retries=0, backoff=0.1, max_backoff=5.0, methods=ConnectionPool.idempotent_methods):
+        '''
+        :param retries: the maximum number of retries of a request (0 implies none)
+        :param backoff: the base delay (in seconds). The delay before the nth retry is random, upto backoff * 2 ** n
+        :param max_backoff: the maximum delay (in seconds) before a retry
+        :param methods: the methods that are safe to retry
+        '''
+        self.retries, self.backoff, self.max_backoff = int(retries), float(backoff), float(max_backoff)
+        self.methods = frozenset(methods)
+
+    def should_retry(self, method, err, attempt):
+        ''' whether to retry a request (of this method) that failed with err on this attempt (0 for the first) '''
+        if attempt >= self.retries or method.upper() not in self.methods or isinstance(err, CircuitOpen):
+            return False
+        if isinstance(err, urllib2.HTTPError):
+            return err.code in self.retry_statuses
+        return isinstance(err, urllib2.URLError)
+
+    def delay(self, attempt):
+        ''' the delay (in seconds) before retrying after this attempt '''
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @classmethod
+    def schedule(cls, delay, fn, *args):
+        ''' calls fn(*args) after delay seconds (from a scheduler thread). Used to retry asynchronous requests '''
+        if cls._scheduler is None or cls._scheduler[0] != os.getpid(): # not yet started (or forked)
+            with cls._lock:
+                if cls._scheduler is None or cls._scheduler[0] != os.getpid():
+                    cls._scheduler = (os.getpid(), InstancedScheduler(_ns='http_retry'))
+        cls._scheduler[1].timer(delay * 1000, fn, *args, _threadpool=False)
+
+class CircuitBreaker(object):
+    '''
+    the circuit breaker of a host. Typically obtained with :py:meth:`for_request`. Failures are connection errors, timeouts and
+    5xx responses (other responses imply the host is up). The circuit opens after failure_threshold consecutive failures
+    '''
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    #: the number of consecutive failures that open the circuit
+    failure_threshold = 5
+    #: the time (in seconds) after which an open circuit lets a trial request through
+    reset_timeout = 30.0
+
+    _breakers = {}
+    _lock = RLock()
+
+    def __init__(self, key):
+        self.key = key
+        self.lock = RLock()
+        self.state = self.CLOSED
+        self.failures = self.trips = self.rejected = 0
+        self.opened_at = self.trial_at = None
+
+    @classmethod
+    def for_host(cls, key):
+        ''' returns the breaker of the host (identified by a key like http://host:port) '''
+        breaker = cls._breakers.get(key)
+        if breaker is None:
+            with cls._lock:
+                breaker = cls._breakers.setdefault(key, cls(key))
+        return breaker
+
+    @classmethod
+    def for_request(cls, req):
+        ''' returns the breaker of the host of a urllib2.Request '''
+        return cls.for_host('%s://%s' % (req.get_type(), req.get_host()))
+
+    @classmethod
+    def configure(cls, failure_threshold=None, reset_timeout=None, **kargs):
+        ''' updates the settings of all the breakers (e.g. from the configuration) '''
+        if failure_threshold is not None: cls.failure_threshold = int(failure_threshold)
+        if reset_timeout is not None: cls.reset_timeout = float(reset_timeout)
+
+    def allow(self):
+        ''' whether a request may be made to the host now '''
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.time()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state, self.trial_at = self.HALF_OPEN, None
+            if self.state == self.HALF_OPEN and (self.trial_at is None or now - self.trial_at >= self.reset_timeout):
+                self.trial_at = now # the trial request (again if the previous trial was never reported)
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        ''' raises :py:class:`CircuitOpen` if a request may not be made to the host now '''
+        if not self.allow():
+            raise CircuitOpen('Circuit open for %s after %s failures' % (self.key, self.failures))
+
+    def success(self):
+        with self.lock:
+            self.state, self.failures, self.trial_at = self.CLOSED, 0, None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state, self.opened_at, self.trial_at = self.OPEN, time.time(), None
+                self.trips += 1
+
+    def record(self, err=None):
+        ''' records the outcome of a request - its error (None for success) '''
+        if isinstance(err, CircuitOpen):
+            return
+        if err is None or (isinstance(err, urllib2.HTTPError) and err.code < 500):
+            self.success()
+        else:
+            self.failure()
+
+    @classmethod
+    def stats(cls):
+        ''' returns the state, consecutive failures, trips and rejected requests of the breakers by host '''
+        with cls._lock:
+            breakers = cls._breakers.values()
+        return dict((b.key, dict(state=b.state, failures=b.failures, trips=b.trips, rejected=b.rejected)) for b in breakers)
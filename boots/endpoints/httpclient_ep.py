@@ -11,15 +11,29 @@ import threading
 import sys
 import urlparse
 import urllib2
+import socket
 from contextlib import closing
 import StringIO
 import re
+import os
+import shutil
 
     
 import logging
+from boots import concurrency
 from boots.endpoints.endpoint import EndPoint
+from boots.common.dirutils import DirUtils
 from boots.common.threadpool import InstancedThreadPool
+from boots.endpoints.http_pool import ConnectionPool, split_timeout
+from boots.endpoints.http_async import AsyncHTTPEngine, Future
+from boots.endpoints.http_resilience import RetryPolicy, CircuitBreaker, CircuitOpen
+import time
 import cookielib
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+    from gevent.event import Event
+elif concurrency == 'threading':
+    from threading import RLock, Event
 
 class Header(dict):
     ''' Header is a helper class to allow easy additions of headers. Primarily, this formats multi-value headers 
@@ -98,7 +112,15 @@ class Response(object):
     HTTP Responses are wrapped and returned using this object. This object provides attributes
     *data* and *headers* (this is a Headers object) and *raw_headers* which provides headers as returned
     by the request
+
+    *data* reads the whole body into memory. Large bodies (of :py:meth:`HTTPClientEndPoint.stream_request`) can be streamed 
+    instead - with :py:meth:`iter_content`, :py:meth:`save_to` (to a file) or :py:meth:`iter_json` (the elements of a JSON array, 
+    one at a time). A streamed body is consumed - *data* is not available after streaming it
     '''
+    
+    #: the default size (in bytes) of the chunks a body is streamed in
+    chunk_size = 64 * 1024
+    
     def __init__(self, response):
         '''
         :param response: The data returned by the request
@@ -111,6 +133,7 @@ class Response(object):
         self._raw_headers = None
         self._headers = None
         self._cookies = None
+        self._consumed = False
         
     def duplicate(self):
         ret = Response(None)
@@ -122,6 +145,8 @@ class Response(object):
     @property
     def data(self):
         if self._data is None:
+            if self._consumed:
+                raise IOError('The response body has been streamed (and is no longer available)')
             self._data = self.response.read()
         return self._data
     
@@ -131,6 +156,47 @@ class Response(object):
         
     def read(self):
         return self.data
+
+    def _body(self):
+        ''' returns a file-like object to stream the body from '''
+        if self._data is not None: # already read
+            return StringIO.StringIO(self._data)
+        if self._consumed:
+            raise IOError('The response body has been streamed (and is no longer available)')
+        self._consumed = True
+        return self.response
+
+    def iter_content(self, chunk_size=None):
+        '''
+        iterates over the body in chunks (of upto chunk_size bytes) rather than reading it into memory
+        '''
+        body, chunk_size = self._body(), chunk_size or self.chunk_size
+        while True:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def save_to(self, path):
+        '''
+        streams the body to the file at path (the directory is created if required). returns path
+        '''
+        DirUtils().make_dir(os.path.dirname(os.path.abspath(path)))
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(self._body(), f, self.chunk_size)
+        return path
+
+    def iter_json(self, chunk_size=None):
+        '''
+        iterates over the elements of a JSON array (the body), decoding them one at a time (see :py:func:`iter_json_array`) 
+        - in memory proportional to the largest element rather than to the body
+
+        **Example**::
+
+            for user in HTTPClientEndPoint().stream_request('http://partner/users/export', method='GET').iter_json():
+                process(user)
+        '''
+        return iter_json_array(self.iter_content(chunk_size))
     
     def info(self):
         if self._raw_headers is None:
@@ -193,23 +259,130 @@ class Response(object):
             
 
             
+#: the characters that may end (or nest) a JSON value and the characters that may end a string
+_JSON_SPECIAL = re.compile(r'[\s"\[\]{},]')
+_JSON_STRING_SPECIAL = re.compile(r'["\\]')
+
+def _json_value_end(text, i, state):
+    '''
+    scans text (from i) for the end of a JSON value. state is the [ depth, in a string, after a backslash ] of the scan so far (of
+    earlier chunks of the value) and is updated, so each character is scanned once. returns the index after the value or None 
+    if the value does not end in text
+    '''
+    depth, in_string, escaped = state
+    if escaped and i < len(text): # the escaped character is the first of this text
+        i, escaped = i + 1, False
+    n = len(text)
+    while i < n:
+        if in_string:
+            match = _JSON_STRING_SPECIAL.search(text, i)
+            if match is None: break
+            i = match.start()
+            if text[i] == '\\':
+                if i + 1 == n:
+                    escaped = True
+                    break
+                i += 2
+                continue
+            in_string, i = False, i + 1
+            if depth == 0: return i
+            continue
+        match = _JSON_SPECIAL.search(text, i)
+        if match is None: break
+        i, c = match.start(), text[match.start()]
+        if c == '"':
+            in_string = True
+        elif c in '[{':
+            depth += 1
+        elif c in ']}':
+            if depth == 0: return i # the end of a number (or literal) that is the last element
+            depth -= 1
+            if depth == 0: return i + 1
+        elif depth == 0: # a , or whitespace after a number (or literal)
+            return i
+        i += 1
+    state[:] = [ depth, in_string, escaped ]
+    return None
+
+def iter_json_array(chunks):
+    '''
+    incrementally decodes a JSON array from an iterable of chunks of its text (e.g. :py:meth:`Response.iter_content`), yielding
+    its elements one at a time. Raises ValueError if the text is not a JSON array. 
+    
+    The text of an element is scanned (for where it ends) once, as its chunks arrive, and decoded once it is complete - so the
+    time taken is linear in the length of the text however the elements are split across chunks
+    '''
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf, pos, eof = '', 0, False
+    started = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('Not a JSON array')
+                started, pos = True, pos + 1
+                continue
+            if buf[pos] == ']':
+                return
+            if buf[pos] == ',':
+                pos += 1
+                continue
+            state = [ 0, False, False ]
+            if _json_value_end(buf, pos, state) is None: # the element continues in the next chunks
+                parts = [ buf[pos:] ]
+                while not eof:
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        eof = True
+                        break
+                    parts.append(chunk)
+                    if _json_value_end(chunk, 0, state) is not None:
+                        break
+                buf, pos = ''.join(parts), 0
+            value, pos = decoder.raw_decode(buf, pos) # ValueError if the element is not valid (or incomplete)
+            yield value
+            continue
+        if eof:
+            raise ValueError('Incomplete JSON array')
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            eof = True
+            continue
+        buf, pos = chunk, 0
+
 def dejsonify_response(func):
     '''
-    a decorator that expects a :py:class:`Response` object from the wrapped function
+    a decorator that expects a :py:class:`Response` object (or a Future for one) from the wrapped function
     and performs a json.loads on the response.data 
     '''
     @wraps(func)
     def wrapper(*args, **kargs):
         response = func(*args, **kargs)
-        try:
-            response.data = json.loads(response.data)
-        except ValueError as e:
-            # Attach reponse data for debugging purposes
-            e.response_data = response.data
-            raise
-        return response
+        if isinstance(response, Future): # from HTTPAsyncClient
+            return response.transform(_dejsonify_copy)
+        return _dejsonify(response)
     return wrapper
 
+def _dejsonify(response):
+    try:
+        response.data = json.loads(response.data)
+    except ValueError as e:
+        # Attach reponse data for debugging purposes
+        e.response_data = response.data
+        raise
+    return response
+
+def _dejsonify_copy(response):
+    ''' dejsonifies a copy of the response - the callbacks of :py:class:`HTTPAsyncClient` get the response as received '''
+    copy = Response(response.response)
+    copy._data, copy._raw_headers = response.data, response.info()
+    return _dejsonify(copy)
+
 def jsonify_request(func):
     '''
     a decorator that takes all the keyword arguments and converts each argument to its JSON representation.
@@ -226,13 +399,48 @@ def jsonify_request(func):
         return func(*args, headers=headers, **dict([ (k, json.dumps(v)) for k,v in kargs.iteritems() ]))
     return wrapper
 
+def _buffered(response):
+    ''' reads the body of a urllib2 response (releasing its connection). returns a response with the body in memory '''
+    try:
+        body = response.read()
+    finally:
+        response.close()
+    buffered = urllib2.addinfourl(StringIO.StringIO(body), response.info(), response.geturl())
+    buffered.code, buffered.msg = response.code, response.msg
+    return buffered
+
+class _GuardedBody(object):
+    ''' a urllib2 response whose read errors (e.g. timeouts) are recorded by the circuit breaker and raised as urllib2.URLError '''
+    
+    def __init__(self, response, breaker):
+        self.response, self.breaker = response, breaker
+    
+    def read(self, *args):
+        try:
+            return self.response.read(*args)
+        except socket.error as err:
+            err = urllib2.URLError(err)
+            if self.breaker is not None: self.breaker.record(err)
+            raise err
+    
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+class BatchIncomplete(urllib2.URLError):
+    ''' the error of a request of :py:meth:`HTTPClientEndPoint.batch` that did not complete within the batch '''
+    pass
+
 class HTTPClientEndPoint(EndPoint):
     '''
     A (currently) unmanaged endpoint that provides simple abstractions to marshall, unmarshall and perform the http
     protocol in making requests.
     '''
     
-    def __init__(self, url=None, data=None, headers=None, origin_req_host=None, method='POST', server=None):
+    #: the deadline (in seconds) of a :py:meth:`batch` that is made without a deadline or a timeout
+    batch_deadline = 60
+    
+    def __init__(self, url=None, data=None, headers=None, origin_req_host=None, method='POST', server=None, pool=None, 
+                 timeout=None, retries=0, backoff=0.1, breaker=True):
         '''
         :param str url: the url that this request object should bind to. This is optional and the url provided with
             :py:meth:`request` supercedes this value. The url will be urlquoted before sending
@@ -241,6 +449,14 @@ class HTTPClientEndPoint(EndPoint):
         :param origin_req_host: refer urllib2.Request
         :param str method: one of 'GET' or 'POST'
         :param Server server: (defaults None). A reference to the server object to which this endpoint belongs to
+        :param pool: the :py:class:`ConnectionPool` of persistent connections to make requests over. None (the default) implies 
+            the pool shared by the process. False implies a new connection per request 
+        :param timeout: the connect and read timeouts (in seconds) of requests - a number (for both) or a tuple (connect timeout, read timeout).
+            None (the default) implies no timeout. Timeouts fail the request with a urllib2.URLError 
+        :param retries: the number of times a failed idempotent request (e.g. GET) is retried (see :py:class:`RetryPolicy`). 0 (the default) implies no retries
+        :param backoff: the base delay (in seconds) before retrying. Delays grow exponentially (with jitter) with each retry
+        :param breaker: whether requests go through the circuit breaker of their host (see :py:class:`CircuitBreaker`) - failing fast 
+            (with :py:class:`CircuitOpen`) while the host is failing. Defaults to True
         
         Cookies obtained as a response to the request are stored for subsequent calls allowing easy stateful calling to servers.
         
@@ -254,7 +470,12 @@ class HTTPClientEndPoint(EndPoint):
         self.origin_req_host = origin_req_host
         self.server = server
         self.cj = cookielib.CookieJar()
-        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cj))
+        self.pool = ConnectionPool.shared() if pool is None else pool
+        handlers = self.pool.handlers() if self.pool else []
+        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cj), *handlers)
+        self.timeout = timeout
+        self.retry = RetryPolicy(retries=retries, backoff=backoff)
+        self.breaker = breaker
 
     def _construct_url(self, url=None, data=None, headers=None, method=None):
         '''
@@ -279,7 +500,7 @@ class HTTPClientEndPoint(EndPoint):
         url = urlparse.urlunparse(parsed[:2]+(urllib2.quote(parsed.path.encode("utf8")),)+parsed[3:])
         return url, data, headers, method
         
-    def _request(self, url=None, data=None, headers=None, method=None):
+    def _request(self, url=None, data=None, headers=None, method=None, stream=False):
         try:
             url, data, headers, method = self._construct_url(url=url, data=data, headers=headers, method=method)
 #            logging.getLogger().debug('url:%s, data:%s, headers:%s, origin_req_host:%s', url, data, headers, self.origin_req_host)
@@ -290,7 +511,7 @@ class HTTPClientEndPoint(EndPoint):
 #            with closing(self.opener.open(request)) as req:
 #                rv = Response(req)
 #                return rv
-            req = self.opener.open(request) # not closing it right away since the response would have got closed
+            req = self._open(request, stream=stream) # not closing it right away since the response would have got closed
             return Response(req)
         except urllib2.HTTPError as err:
             logging.getLogger().exception('HTTPError: %d, url:%s, data:%s, headers:%s, origin_req_host:%s, content: %s',
@@ -302,6 +523,149 @@ class HTTPClientEndPoint(EndPoint):
             # FIXME: change logging to warning.warn
             raise
 
+    def _open(self, request, stream=False):
+        '''
+        opens a urllib2 request - with the timeouts, through the circuit breaker of its host and with retries (as configured). 
+        The body is read as part of the attempt (so a timeout while reading it is retried) unless it is to be streamed - then
+        errors while reading it are raised (as URLErrors) to the reader, after being recorded by the circuit breaker
+        '''
+        connect_timeout, request.read_timeout = split_timeout(self.timeout)
+        breaker = CircuitBreaker.for_request(request) if self.breaker else None
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.check()
+            try:
+                try:
+                    response = self.opener.open(request, timeout=connect_timeout if connect_timeout is not None else socket._GLOBAL_DEFAULT_TIMEOUT)
+                    response = _GuardedBody(response, breaker) if stream else _buffered(response)
+                except socket.error as err: # e.g. a timeout while reading the headers or the body
+                    raise urllib2.URLError(err)
+            except urllib2.URLError as err:
+                if breaker is not None: breaker.record(err)
+                if not self.retry.should_retry(request.get_method(), err, attempt):
+                    raise
+                if isinstance(err, urllib2.HTTPError): err.close() # release its connection
+                logging.getLogger().debug('Retrying %s %s after %s', request.get_method(), request.get_full_url(), err)
+                time.sleep(self.retry.delay(attempt))
+                attempt += 1
+                continue
+            if breaker is not None: breaker.record(None)
+            return response
+
+    def _submit(self, url=None, data=None, headers=None, method=None, timeout=None, engine=None):
+        '''
+        submits a request to an event driven engine (see :py:mod:`boots.endpoints.http_async`) rather than making it - with the 
+        timeouts, through the circuit breaker of its host and with retries (as configured). returns a :py:class:`Future` for the :py:class:`Response`
+        '''
+        try:
+            url, data, headers, method = self._construct_url(url=url, data=data, headers=headers, method=method)
+            request = urllib2.Request(url=url, data=data, headers=headers, origin_req_host=self.origin_req_host)
+            if method.upper() not in ['POST', 'GET']:
+                request.get_method = lambda: method
+        except Exception:
+            future = Future()
+            future.set_exception(sys.exc_info())
+            return future
+        engine = engine or AsyncHTTPEngine.shared()
+        breaker = CircuitBreaker.for_request(request) if self.breaker else None
+        future = Future()
+        current = [ None ] # the future of the current attempt
+        future.on_cancel(lambda: current[0] is not None and current[0].cancel())
+        def attempt(n):
+            if future.done(): # cancelled
+                return
+            try:
+                if breaker is not None: breaker.check()
+            except CircuitOpen:
+                return future.set_exception(sys.exc_info())
+            current[0] = engine.submit(request, timeout=timeout, cookiejar=self.cj)
+            if future.done(): current[0].cancel() # cancelled while submitting
+            current[0].add_done_callback(lambda done: attempted(done, n))
+        def attempted(done, n):
+            if done.cancelled():
+                return
+            err = done.exception()
+            if breaker is not None: breaker.record(err)
+            if err is not None and self.retry.should_retry(request.get_method(), err, n):
+                logging.getLogger().debug('Retrying %s %s after %s', request.get_method(), request.get_full_url(), err)
+                return RetryPolicy.schedule(self.retry.delay(n), attempt, n + 1)
+            if err is None: future.set_result(done.result())
+            else: future.set_exception(done._exc_info)
+        attempt(0)
+        return future.transform(self._response)
+
+    @staticmethod
+    def _response(resp):
+        response = Response(resp)
+        response.data # read here rather than in the callbacks
+        return response
+
+    def batch(self, requests, timeout=None, deadline=None, wait_for=None):
+        '''
+        makes a batch of requests concurrently (scatter-gather) - the batch takes about as long as the slowest request rather than 
+        the sum of them. Requests are made by the event driven engine (see :py:mod:`boots.endpoints.http_async`) over persistent 
+        connections and share this endpoint's cookies. 
+        
+        :param requests: a list of urls or of dicts with the url and (optionally) method, headers, data (a dict of the request parameters),
+            json_in (the parameters are individually JSON encoded as with :py:meth:`json_in_request`), json_out (the response data is 
+            JSON decoded as with :py:meth:`json_out_request`) and timeout (overrides the timeout of the batch for this request) 
+        :param timeout: the time (in seconds) within which each request must complete. None (the default) implies no timeout
+        :param deadline: the time (in seconds) within which the batch must complete. Requests that have not completed by then are 
+            returned as :py:class:`BatchIncomplete` errors and are abandoned (their connections are closed). None (the default) implies 
+            no deadline unless there is no timeout either, in which case :py:attr:`batch_deadline` applies
+        :param wait_for: the number of successful responses to wait for (e.g. the first response or a quorum). The batch returns
+            as soon as these many requests succeed (or too many have failed for that). None (the default) waits for all
+        :returns: a list with, in the order of requests, the :py:class:`Response` or the exception (e.g. urllib2.HTTPError) of each request
+        
+        **Example**::
+        
+            users, orders = HTTPClientEndPoint().batch([ 'http://users/list', 
+                                                         dict(url='http://orders/list', method='GET', data=dict(user=1), json_out=True) ], 
+                                                       timeout=2, deadline=3)
+            if isinstance(orders, Exception): ...
+
+        '''
+        if deadline is None and timeout is None and self.timeout is None:
+            deadline = self.batch_deadline
+        futures = []
+        for spec in requests:
+            spec = dict(url=spec) if isinstance(spec, basestring) else dict(spec)
+            data = spec.get('data') or {}
+            if spec.get('json_in'):
+                data = dict((k, json.dumps(v)) for k, v in data.iteritems())
+            request_timeout = spec.get('timeout', timeout if timeout is not None else self.timeout)
+            if deadline is not None: # the request is not needed after the deadline
+                request_timeout = tuple(min(t, deadline) if t is not None else deadline for t in split_timeout(request_timeout))
+            future = self._submit(url=spec['url'], data=data, headers=Header(spec.get('headers') or {}), method=spec.get('method', 'POST'),
+                                  timeout=request_timeout, engine=getattr(self, 'engine', None))
+            futures.append(future.transform(_dejsonify_copy) if spec.get('json_out') else future)
+
+        needed = len(futures) if wait_for is None else min(int(wait_for), len(futures))
+        counts = dict(succeeded=0, failed=0)
+        lock, completed = RLock(), Event()
+        def done(future):
+            with lock:
+                counts['failed' if future.exception() is not None else 'succeeded'] += 1
+                if counts['succeeded'] >= needed or counts['succeeded'] + counts['failed'] == len(futures) or \
+                        (wait_for is not None and len(futures) - counts['failed'] < needed): # the quorum is not possible
+                    completed.set()
+        for future in futures:
+            future.add_done_callback(done)
+        if needed <= 0:
+            completed.set()
+        completed.wait(deadline)
+
+        results = []
+        for future in futures:
+            if future.done():
+                err = future.exception()
+                results.append(future.result() if err is None else err)
+            else: # not needed any more (the deadline passed or the quorum was reached)
+                future.cancel()
+                results.append(BatchIncomplete('Not completed within the batch'))
+        return results
+
     def request(self, url=None, headers=None, method='POST', **kargs):
         '''
         a method to make a simple get request. all keyword arguments are converted to the data for the request.
@@ -317,6 +681,20 @@ class HTTPClientEndPoint(EndPoint):
         '''
         return self._request(url, data=kargs, headers=headers, method=method)
     
+    def stream_request(self, url=None, headers=None, method='POST', **kargs):
+        '''
+        makes a request (as :py:meth:`request`) whose body is not read until it is streamed (see :py:meth:`Response.iter_content`,
+        :py:meth:`Response.save_to` and :py:meth:`Response.iter_json`) - in memory proportional to a chunk rather than to the body.
+        Errors while streaming the body (e.g. a read timeout) are raised as urllib2.URLError and are not retried
+        
+        **Example**::
+        
+            for user in HTTPClientEndPoint().stream_request('http://partner/users/export', method='GET').iter_json():
+                process(user)
+
+        '''
+        return self._request(url, data=kargs, headers=headers, method=method, stream=True)
+    
     @dejsonify_response
     def json_out_request(self, url, headers=None, method='POST', **kargs):
         '''
@@ -445,7 +823,10 @@ class HTTPAsyncClient(HTTPClientEndPoint):
     async endpoints mimic AJAX. There is a success and an error handler. Moreover, the callback is passed a reference to the object
     that made the call (so that the url, state, etc can be obtained).
 
-    Additionally, a threadpool is used to limit the creation of threads by the async client ep
+    Requests are made by an event driven engine (see :py:mod:`boots.endpoints.http_async`) - a single thread multiplexes all the
+    requests in flight (or, with gevent, a greenlet per request) rather than a thread being blocked per request. Request methods
+    return a :py:class:`boots.endpoints.http_async.Future` for the :py:class:`Response`. The callbacks are invoked on the threadpool
+    so that slow callbacks do not hold up other requests
 
     **Example**::
     
@@ -461,9 +842,14 @@ class HTTPAsyncClient(HTTPClientEndPoint):
             client.i = i # just to keep some context in the example
             client.request('http://echo.jsontest.com/callnumber/%s' % i)
 
+        # or wait for the results
+        futures = [ HTTPAsyncClient(method='GET').request('http://echo.jsontest.com/callnumber/%s' % i) for i in range(50) ]
+        print [ f.result().data for f in futures ]
+
     '''
     
-    def __init__(self, url=None, headers=None, origin_req_host=None, method='POST', onsuccess=None, onerror=None, sync=False, timeout=None, server=None, threadpool=None, **kargs):
+    def __init__(self, url=None, headers=None, origin_req_host=None, method='POST', onsuccess=None, onerror=None, sync=False, timeout=None, server=None, threadpool=None, engine=None, 
+                 retries=0, backoff=0.1, breaker=True, **kargs):
         '''
         
         :param str url: the url that this request object should bind to. This is optional and the url provided with
@@ -473,18 +859,27 @@ class HTTPAsyncClient(HTTPClientEndPoint):
         :param str method: one of 'GET' or 'POST'
         :param onsuccess: a function to be invoked on successful response from the request. This function is invoked with an instance of the :py:class:`Response` object
         :param onerror: a function to be invoked on failure of the request. Invoked with the exception that got raised.
-        :param bool sync: whether this request should be synchronous (True) or async (default) 
-        :param timeout: (currently not implemented). Whether to timeout if no response is received in a specified time.
+        :param bool sync: whether this request should be synchronous (True) or async (default). Synchronous requests wait for the 
+            response and invoke the callbacks before returning
+        :param timeout: the connect and read timeouts (in seconds) - a number (for both) or a tuple (connect timeout, read timeout). The request 
+            fails with a urllib2.URLError if it does not connect or then does not progress in time. None (the default) implies no timeout
         :param Server server: (defaults None). A reference to the server object to which this endpoint belongs to
-        :param threadpool: a reference to a threadpool object. If None, the InstancedThreadPool (with default number of workers) is used
+        :param threadpool: a reference to a threadpool object (on which the callbacks are invoked). If None, the InstancedThreadPool 
+            (with default number of workers) is used
+        :param engine: the engine that makes the requests. None (the default) implies the engine shared by the process
+            (:py:meth:`AsyncHTTPEngine.shared`). False implies a blocking request per threadpool thread (as earlier)
+        :param retries: the number of times a failed idempotent request is retried (see :py:class:`HTTPClientEndPoint`)
+        :param backoff: the base delay (in seconds) before retrying
+        :param breaker: whether requests go through the circuit breaker of their host
         '''
         do_nothing = lambda x, client: None
         self.onsuccess = onsuccess or do_nothing
         self.onerror = onerror or do_nothing
         self.sync = sync
-        self.timeout = timeout
         self.threadpool = threadpool or InstancedThreadPool()
-        super(HTTPAsyncClient, self).__init__(url=None, headers=None, origin_req_host=None, method=method, server=server)
+        self.engine = AsyncHTTPEngine.shared() if engine is None else engine
+        super(HTTPAsyncClient, self).__init__(url=url, headers=headers, origin_req_host=origin_req_host, method=method, server=server,
+                                              timeout=timeout, retries=retries, backoff=backoff, breaker=breaker)
 
     def _request(self, url=None, data=None, headers=None, method=None):
         self.url = url or self.url
@@ -494,18 +889,47 @@ class HTTPAsyncClient(HTTPClientEndPoint):
         if self.method is None: self.method = 'POST'
         if self.method.upper() != 'POST': self.method = 'GET'
 
+        if self.engine:
+            future = self._submit()
+        else:
+            future = Future()
+            if self.sync: self.run(future)
+            else: self.threadpool.apply_async(self.run, (future,))
+
         if self.sync:
-            self.run()
-        
-        self.threadpool.apply_async(self.run)
-    
-    def run(self):
-        
+            future.exception() # wait for it
+            self._callback(future)
+        elif self.engine:
+            future.add_done_callback(lambda future: self.threadpool.apply_async(self._callback, (future,)))
+        return future
+
+    def _submit(self):
+        ''' submits the request to the engine. returns a future for the :py:class:`Response` '''
+        return super(HTTPAsyncClient, self)._submit(url=self.url, data=self.data, headers=self.headers, method=self.method,
+                                                    timeout=self.timeout, engine=self.engine)
+
+    def _callback(self, future):
+        err = future.exception()
+        if err is None:
+            self.onsuccess(future.result(), client=self)
+        elif isinstance(err, (urllib2.HTTPError, urllib2.URLError)):
+            logging.getLogger().debug('Error in request to %s: %s', self.url, err)
+            self.onerror(err, client=self)
+        else:
+            logging.getLogger().error('Error in request to %s: %r', self.url, err)
+
+    def run(self, future=None):
+        ''' makes the request (blocking) - as with engine=False. The response (or error) is set on future if specified '''
         try:
             rv = super(HTTPAsyncClient, self)._request(url=self.url, data=self.data, headers=self.headers, method=self.method)
-            self.onsuccess(rv, client=self)
-        except (urllib2.HTTPError, urllib2.URLError) as err:
-            self.onerror(err, client=self)
+        except Exception:
+            if future is None: raise
+            future.set_exception(sys.exc_info())
+        else:
+            if future is None: return rv
+            future.set_result(rv)
+        if future is not None and not self.sync:
+            self._callback(future)
             
 if __name__ == '__main__':
     
@@ -18,6 +18,9 @@ else:
     import zmq
     
 from boots.common.threadpool import ThreadPool
+from boots.common.inflight import InFlight
+from boots.common.resolver import Resolver
+from boots.common.utils import ShardedCounter
 from boots.endpoints.endpoint import EndPoint
 
 class Locker(object):
@@ -83,6 +86,11 @@ class ZMQBaseEndPoint(EndPoint):
     All socket functionalities are wrapped within this and sub classes
     Keeping the complexity of the functionality away from server writers
     '''
+    
+    #: address to the counters (sent, received) of the messages on the sockets of that address. See :py:meth:`message_stats`
+    _messages = {}
+    _messages_lock = RLock()
+    
     def __init__(self, socket_type, address, bind=False, **kargs):
         '''
         Constructor
@@ -94,18 +102,35 @@ class ZMQBaseEndPoint(EndPoint):
         super(ZMQBaseEndPoint, self).__init__(**kargs)
         self.bind = bind
         
-        # split off the port to resolve hostname tcp://<host>:<port>
+        # split off the port to resolve hostname tcp://<host>:<port> (through the shared resolver cache)
         gr = re.match("tcp://([^:]+):([0-9]+)", address)
         if gr is not None and len(gr.groups()) == 2:
             groups = gr.groups()
-            address = "tcp://" + socket.gethostbyname(groups[0]) + ":" + groups[1] # No exception catching on purpose
+            address = "tcp://" + Resolver.gethostbyname(groups[0]) + ":" + groups[1] # No exception catching on purpose
             
         self.address = address
+        self.sent, self.received = self.message_counters(address)
         
         self.socket_type = socket_type
         self.socket = None
         self._activated = False
     
+    @classmethod
+    def message_counters(cls, address):
+        ''' returns the counters (sent, received) of the messages of an address '''
+        counters = cls._messages.get(address)
+        if counters is None:
+            with cls._messages_lock:
+                counters = cls._messages.setdefault(address, (ShardedCounter(), ShardedCounter()))
+        return counters
+    
+    @classmethod
+    def message_stats(cls):
+        ''' returns the number of messages sent and received by address '''
+        with cls._messages_lock:
+            messages = cls._messages.items()
+        return dict((address, dict(sent=sent.value(), received=received.value())) for address, (sent, received) in messages)
+    
     def activate(self):
         """
         Should be called when endpoints are being activated
@@ -145,6 +170,7 @@ class ZMQBaseEndPoint(EndPoint):
         if type(data) == str:
             data = [data]
         self.socket.send_multipart(data)
+        self.sent.increment()
     
     def close(self, linger=1):
         self.socket.close(linger=linger)
@@ -237,7 +263,7 @@ class ZMQListenEndPoint(ZMQEndPoint):
         self.filters = []
         self._threads = threads
         self.receive_plugins = filter(lambda x: x.plugin_type & ZMQBasePlugin.RECEIVE, self.plugins)
-        self._thread_pool = ThreadPool(processes=threads)
+        self._thread_pool = ThreadPool(processes=threads, name='zmq %s' % self.address)
     
     def setup(self, extended_setup=[], **kargs):
         extended_setup += [(self._set_filter, [p]) for p in self.filters]
@@ -273,22 +299,35 @@ class ZMQListenEndPoint(ZMQEndPoint):
         if self.socket.closed:
             return
         
+        # Leave messages on the socket while draining
+        if not InFlight.accepting:
+            return
+        
         try:
             n = self._threads
             while n:
                 msg = socket.recv_multipart(flags=zmq.NOBLOCK)
+                self.received.increment()
+                # the message is off the socket. So it is processed (and drained) even if draining started since
+                InFlight.admit('zmq')
                 self._thread_pool.apply_async(self._recv_thread, args=(msg, self.receive_plugins))
+                if not InFlight.accepting:
+                    self.server.logger.warning('Processing a message received as draining started. Leaving the rest on the socket')
+                    return
                 n -= 1
         except zmq.ZMQError as e: 
             if e.errno is not zmq.EAGAIN: 
                 raise
     
     def _recv_thread(self, msg, plugins):
-        for p in plugins:
-            try: 
-                msg = p.apply(msg)
-            except Exception as e: self.server.logger.exception('Error %s - %s ', p, e)
-        self.callback(msg)
+        try:
+            for p in plugins:
+                try: 
+                    msg = p.apply(msg)
+                except Exception as e: self.server.logger.exception('Error %s - %s ', p, e)
+            self.callback(msg)
+        finally:
+            InFlight.exit('zmq')
     
     def add_filter(self, pattern):
         """
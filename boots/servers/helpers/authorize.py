@@ -1,9 +1,74 @@
 from barrel.form import FormAuth
 import re
 import logging
+import hashlib
+import hmac
 from boots.common.template import BootsTemplate
+from boots.common.utils import LRUCache
 import collections
 
+class OpenURLMatcher(object):
+    '''
+    matches a path against a list of open url patterns (regular expressions, searched as with re.search). Patterns that are 
+    anchored literals (e.g. ^/static/, ^/static/.* or ^/login$) are matched through a prefix trie (or a set for exact matches) and 
+    the rest through a single combined regular expression.
+    '''
+    
+    #: an anchored pattern whose body is literal (escaped punctuation allowed), optionally followed by .* and/or $
+    literal_pattern = re.compile(r'^\^((?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9])*)(\.\*)?(\$)?$')
+    #: inline flags (e.g. (?i)) or numbered backreferences - patterns that cannot be combined with others into one expression
+    uncombinable_pattern = re.compile(r'\(\?[iLmsux]+\)|\\[1-9]')
+    _end = None # the trie key marking the end of a prefix
+    
+    def __init__(self, patterns):
+        self.patterns = list(patterns or [])
+        self.trie, self.exact, regexes = {}, set(), []
+        for pattern in self.patterns:
+            literal = self.literal_pattern.match(pattern)
+            if literal is None:
+                regexes.append(pattern)
+                continue
+            body, any_suffix, anchored = literal.groups()
+            body = re.sub(r'\\(.)', r'\1', body)
+            if anchored and not any_suffix:
+                self.exact.add(body)
+            else:
+                self.add_prefix(body)
+        # patterns with inline flags (which apply to the whole expression) or numbered backreferences are searched on their own
+        combined = [ p for p in regexes if not self.uncombinable_pattern.search(p) ]
+        searches = [ re.compile(p).search for p in regexes if self.uncombinable_pattern.search(p) ]
+        if combined:
+            try:
+                searches.append(re.compile('|'.join('(?:%s)' % p for p in combined)).search)
+            except re.error: # e.g. repeated group names. search them one at a time
+                searches += [ re.compile(p).search for p in combined ]
+        if not searches:
+            self.search = None
+        elif len(searches) == 1:
+            self.search = searches[0]
+        else:
+            self.search = lambda path: any(search(path) for search in searches)
+    
+    def add_prefix(self, prefix):
+        node = self.trie
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node[self._end] = True
+    
+    def prefix_match(self, path):
+        node = self.trie
+        if self._end in node: return True
+        for c in path:
+            node = node.get(c)
+            if node is None: return False
+            if self._end in node: return True
+        return False
+    
+    def __call__(self, path):
+        ''' returns True if path matches any of the open url patterns '''
+        return path in self.exact or (bool(self.trie) and self.prefix_match(path)) or \
+            (self.search is not None and bool(self.search(path)))
+
 class SimpleAuth(FormAuth):
     '''
     Custom Web Form authentication middleware. This middleware forms a WSGI app that can sit in the request stack, intercept
@@ -42,7 +107,8 @@ class SimpleAuth(FormAuth):
 </body>
 </html>
     ''' 
-    def __init__(self, app, logins=None, open_urls=None, session_key='barrel.session', template=None, template_args={}, domain_setter=None, remote_user_key='REMOTE_USER', **kargs):
+    def __init__(self, app, logins=None, open_urls=None, session_key='barrel.session', template=None, template_args={}, domain_setter=None, remote_user_key='REMOTE_USER', 
+                 decision_cache_size=1024, **kargs):
         '''
         Take the app and template to wrap and optional settings.
 
@@ -62,10 +128,15 @@ class SimpleAuth(FormAuth):
         @type session_key: str
         
         :param remote_user_key: optional. If specified, indicates the environ key in which the authenticated user information is stored. Defaults to REMOTE_USER 
+        
+        :param decision_cache_size: the number of paths for which the open/secure decision is cached
 
         '''
         self.unsecure_urls = open_urls or []
-        self.unsecure_compiled_urls = [ re.compile(p) for p in self.unsecure_urls ]
+        self.is_open_url = OpenURLMatcher(self.unsecure_urls)
+        self.decisions = LRUCache(decision_cache_size) # path to True (open) or False (secure)
+        # passwords are kept (and compared) as digests
+        self.credentials = dict((username, self.digest(password)) for username, password in logins or [])
         self.domain_setter = domain_setter
         self.remote_user_key = remote_user_key
         
@@ -97,6 +168,26 @@ class SimpleAuth(FormAuth):
             
         return retval
     
+    @staticmethod
+    def digest(password):
+        if isinstance(password, unicode): password = password.encode('utf-8')
+        return hashlib.sha256(password or '').digest()
+    
+    def valid_user(self, username, password):
+        '''
+        Overridden to look the user up in a dict (instead of scanning the logins) and compare password digests in constant time
+        '''
+        digest = self.credentials.get(username)
+        return digest is not None and hmac.compare_digest(digest, self.digest(password))
+    
+    def open_url(self, path):
+        ''' returns True if path is an open url (allowed without authentication). Decisions are cached by path '''
+        decision = self.decisions.get(path)
+        if decision is None:
+            decision = self.is_open_url(path)
+            self.decisions.put(path, decision)
+        return decision
+    
     @classmethod
     def root_level_domain(cls, full_domain):
         ''' 
@@ -127,12 +218,13 @@ class SimpleAuth(FormAuth):
             session.domain, session.path = self.domain_setter(environ.get('SERVER_NAME'))
             session.path = '/'
         
-        path =   environ.get('SCRIPT_NAME', '') + ("" if environ.get('SCRIPT_NAME', '')[-1:] == '/' else '/') + environ.get('PATH_INFO', '')
+        script_name = environ.get('SCRIPT_NAME', '')
+        path = script_name + ("" if script_name[-1:] == '/' else '/') + environ.get('PATH_INFO', '')
         
         #logging.getLogger().debug('Authenticator %s: checking open url %s against %s', type(self), path, self.unsecure_urls)
         
         # determine if the url is unsecure
-        if list(filter(None, [ p.search(path) for p in self.unsecure_compiled_urls ])) != []:
+        if self.unsecure_urls and self.open_url(path):
             #logging.getLogger().debug('Authenticator %s: Skipping open url %s', type(self), path)
             return self.app(environ, start_response)
         
@@ -0,0 +1,499 @@
+'''
+Serving modes for standalone HTTP servers (see :py:meth:`boots.servers.httpserver.HTTPBaseServer.start_main_server`).
+
+* *threaded* serves requests from a bounded pool of worker threads (or greenlets with gevent) in a single process
+* *prefork* forks a number of worker processes that each serve (threaded or with gevent). Workers listen on their own socket
+    with SO_REUSEPORT (where available, so that the kernel balances connections across them) or share the master's socket.
+    Workers may be pinned to a CPU each (requires psutil).
+
+In both modes, the listen backlog and the keep-alive timeout are configurable and workers are recycled gracefully: a worker stops
+accepting requests after max_requests, completes the requests in progress and is replaced. With prefork, a SIGHUP to the master
+recycles all workers (one at a time) and a SIGTERM (or SIGINT) stops them gracefully.
+'''
+from boots import concurrency
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
+import errno
+import itertools
+import logging
+import os
+import Queue
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MODES = [ 'default', 'threaded', 'prefork' ]
+
+#: SO_REUSEPORT is not exposed by the socket module of python 2. This is its value on linux
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
+class KeepAliveServerHandler(ServerHandler):
+    ''' A ServerHandler that speaks HTTP/1.1 and retains the response headers (for the keep-alive decision) after closing '''
+    http_version = '1.1'
+    response_headers = None
+
+    def close(self):
+        self.response_headers = self.headers
+        ServerHandler.close(self)
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    '''
+    A WSGIRequestHandler that serves more than one request on a connection (HTTP/1.1 keep-alive). The connection is kept alive
+    only if the response has a Content-Length and the request had no body (so that an unread body cannot be mistaken for the next request).
+    An idle connection is closed after the server's keepalive timeout.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.keepalive or None # applied to the connection by StreamRequestHandler
+        WSGIRequestHandler.setup(self)
+
+    def handle(self):
+        self.close_connection = 1
+        while True:
+            try:
+                self.raw_requestline = self.rfile.readline(65537)
+            except socket.timeout:
+                return
+            except socket.error as e: # e.g. the client reset an idle connection
+                if e.args and e.args[0] in [ errno.ECONNRESET, errno.EPIPE ]:
+                    return
+                raise
+            if not self.raw_requestline:
+                return
+            if len(self.raw_requestline) > 65536:
+                self.requestline = self.request_version = self.command = ''
+                self.send_error(414)
+                return
+            if not self.parse_request(): # An error code has been sent, just exit
+                return
+
+            handler = KeepAliveServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ())
+            handler.request_handler = self      # backpointer for logging
+            handler.run(self.server.get_app())
+            has_body = self.headers.get('Content-Length', '0') not in [ '', '0' ] or 'Transfer-Encoding' in self.headers
+            if not self.server.keepalive or self.close_connection or has_body or handler.response_headers is None \
+                or 'Content-Length' not in handler.response_headers or self.server.stopping:
+                return
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            WSGIRequestHandler.log_message(self, format, *args)
+
+class PooledWSGIServer(WSGIServer):
+    '''
+    A WSGI server that serves connections from a bounded pool of worker threads. When all workers are busy, the server stops
+    accepting connections (which then wait in the listen backlog).
+    '''
+
+    def __init__(self, server_address, app, threads=10, backlog=128, keepalive=5, reuse_port=False, listener=None, quiet=True):
+        '''
+        :param server_address: (host, port) to listen on
+        :param app: the WSGI application
+        :param int threads: the number of worker threads
+        :param int backlog: the listen backlog
+        :param keepalive: the keep-alive timeout (in seconds) of idle connections. 0 disables keep-alive
+        :param bool reuse_port: whether to set SO_REUSEPORT on the listening socket
+        :param listener: an already listening socket to use. It is not closed when the server stops (so that a new server can take over)
+        :param bool quiet: whether to suppress the logging of each request (to stderr)
+        '''
+        self.request_queue_size = int(backlog)
+        self.threads = int(threads)
+        self.keepalive = float(keepalive or 0)
+        self.reuse_port = reuse_port
+        self.quiet = quiet
+        self.stopping = False
+        self.stopped = threading.Event() # set once stopped and the requests in progress are complete
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue(self.threads)
+        self._owns_socket = listener is None
+        if listener is None:
+            WSGIServer.__init__(self, server_address, KeepAliveRequestHandler)
+        else:
+            WSGIServer.__init__(self, server_address, KeepAliveRequestHandler, bind_and_activate=False)
+            self.socket.close()
+            self.socket = listener
+            self.server_address = listener.getsockname()
+            self.server_name, self.server_port = socket.getfqdn(self.server_address[0]), self.server_address[1]
+            self.setup_environ()
+        self.set_app(app)
+        self._workers = [ self._start_worker() for _ in range(self.threads) ]
+
+    def server_bind(self):
+        if self.reuse_port:
+            if SO_REUSEPORT is None:
+                raise RuntimeError('SO_REUSEPORT is not available on this platform')
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        WSGIServer.server_bind(self)
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._work, name='PooledWSGIServer')
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self._queue.put((request, client_address)) # blocks when all workers are busy
+
+    def stop(self, timeout=30):
+        '''
+        stops gracefully - stops accepting connections and waits (upto timeout seconds) for the requests in progress
+        '''
+        with self._lock:
+            if self.stopping: return
+            self.stopping = True
+        self.shutdown()
+        if self._owns_socket: 
+            self._drain()
+            self.server_close()
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            worker.join(max(deadline - time.time(), 0))
+        self.stopped.set()
+    
+    def _drain(self):
+        '''
+        accepts (and serves) the connections waiting in the backlog of our socket. With SO_REUSEPORT, each socket has its own backlog
+        and the connections in it would be reset when the socket is closed
+        '''
+        self.socket.setblocking(0)
+        while True:
+            try:
+                request, client_address = self.socket.accept()
+            except socket.error:
+                return
+            request.setblocking(1)
+            self.process_request(request, client_address)
+
+def make_listener(host, port, backlog=128, reuse_port=False):
+    '''
+    returns a listening socket bound to (host, port)
+    '''
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind((host, int(port)))
+    sock.listen(int(backlog))
+    return sock
+
+def count_requests(app, max_requests, on_limit):
+    '''
+    wraps app to count requests. on_limit is called (once) on the max_requests th request
+    '''
+    counter = itertools.count(1).next
+    max_requests = int(max_requests)
+    def counted_app(environ, start_response):
+        if counter() == max_requests:
+            logging.getLogger().info('Recycling worker %s after %s requests', os.getpid(), max_requests)
+            on_limit()
+        return app(environ, start_response)
+    return counted_app
+
+def gevent_handler_class(keepalive):
+    '''
+    returns a gevent WSGIHandler that closes a connection once it has been idle for keepalive seconds after a request (at once if 0).
+    gevent otherwise keeps connections alive until the client closes them
+    '''
+    from gevent.pywsgi import WSGIHandler
+    import gevent
+    keepalive = float(keepalive or 0)
+    
+    class KeepAliveWSGIHandler(WSGIHandler):
+        requests = 0 # on this connection (a handler serves one connection)
+        
+        def read_requestline(self):
+            self.requests += 1
+            if self.requests == 1:
+                return WSGIHandler.read_requestline(self)
+            if not keepalive:
+                return None # closes the connection
+            with gevent.Timeout(keepalive, False):
+                return WSGIHandler.read_requestline(self)
+            return None # idle for keepalive seconds
+    
+    return KeepAliveWSGIHandler
+
+def make_server(app, host, port, threads=10, backlog=128, keepalive=5, max_requests=0, listener=None, reuse_port=False, quiet=True, 
+                on_recycle=None):
+    '''
+    returns a server (with serve_forever and stop methods) based on the concurrency setting. With gevent, a gevent WSGIServer
+    with a pool of threads greenlets, else a :py:class:`PooledWSGIServer`
+    
+    :param max_requests: the number of requests after which the server is recycled (0 for never)
+    :param on_recycle: called to recycle the server. Defaults to stopping the server gracefully
+    '''
+    if concurrency == 'gevent':
+        from gevent.pywsgi import WSGIServer as GeventWSGIServer
+        from gevent.pool import Pool
+        import gevent
+        listener = listener or make_listener(host, port, backlog, reuse_port)
+        server = GeventWSGIServer(listener, app, spawn=Pool(int(threads)), log=None if quiet else 'default',
+                                  handler_class=gevent_handler_class(keepalive))
+        stop = lambda: gevent.spawn(server.stop, 30)
+    else:
+        server = PooledWSGIServer((host, int(port)), app, threads=threads, backlog=backlog, keepalive=keepalive,
+                                  listener=listener, reuse_port=reuse_port, quiet=quiet)
+        stop = lambda: threading.Thread(target=server.stop).start()
+    if max_requests:
+        counted_app = count_requests(app, max_requests, on_recycle or stop)
+        if concurrency == 'gevent': server.application = counted_app
+        else: server.set_app(counted_app)
+    return server
+
+def wait_stopped(server, timeout=60):
+    '''
+    waits for a server (from :py:func:`make_server`) that has stopped serving, to complete the requests in progress 
+    '''
+    if hasattr(server, 'stopped'):
+        server.stopped.wait(timeout)
+    elif getattr(server, 'pool', None) is not None: # gevent
+        server.pool.join(timeout=timeout)
+
+def serve_threaded(app, host, port, threads=10, backlog=128, keepalive=5, max_requests=0, quiet=True, **kargs):
+    '''
+    serves app from a bounded pool of threads in this process. With max_requests, the pool is replaced (gracefully) after
+    every max_requests requests
+    '''
+    listener = make_listener(host, port, backlog)
+    logging.getLogger().info('Serving on %s:%s with %s threads', host, port, threads)
+    while True:
+        server = make_server(app, host, port, threads, backlog, keepalive, max_requests, listener=listener, quiet=quiet)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
+            return
+        if not max_requests:
+            return
+        # the server stopped after max_requests. a new one takes over the listener while the old one completes its requests
+
+class PreforkMaster(object):
+    '''
+    forks and supervises worker processes. Workers that reach max_requests are recycled - a replacement is started before the worker
+    is stopped gracefully. Workers that exit unexpectedly are replaced. SIGHUP recycles all workers one at a time. 
+    SIGTERM and SIGINT stop all workers gracefully
+    
+    A worker that exits within :py:attr:`min_uptime` seconds of starting (e.g. since it cannot bind) is replaced after a delay that
+    doubles with each such exit (from :py:attr:`backoff` upto :py:attr:`max_backoff` seconds). After :py:attr:`max_failures` such 
+    exits in a row, the master gives up - it stops the workers and :py:meth:`run` raises a RuntimeError
+    '''
+    
+    #: workers that exit within min_uptime seconds of starting are considered to have failed to start
+    min_uptime = 5
+    #: the delay (in seconds) before replacing a worker that failed to start. Doubles with each failure in a row
+    backoff = 1
+    #: the maximum delay (in seconds) before replacing a worker that failed to start
+    max_backoff = 30
+    #: the number of failures to start in a row (of a worker slot) after which the master gives up
+    max_failures = 5
+
+    def __init__(self, app, host, port, workers=None, threads=10, backlog=128, keepalive=5, max_requests=0, cpu_affinity=False, quiet=True):
+        self.app = app
+        self.host, self.port = host, int(port)
+        self.num_workers = int(workers or 0) or self.cpu_count()
+        self.server_kargs = dict(threads=threads, backlog=backlog, keepalive=keepalive, max_requests=max_requests, quiet=quiet)
+        self.backlog = backlog
+        self.cpu_affinity = cpu_affinity
+        if cpu_affinity and psutil is None:
+            logging.getLogger().warning('cpu_affinity requires psutil. Workers will not be pinned')
+            self.cpu_affinity = False
+        self.reuse_port = SO_REUSEPORT is not None
+        # without SO_REUSEPORT, workers share the master's socket
+        self.listener = None if self.reuse_port else make_listener(host, port, backlog)
+        self.workers = {} # pid to slot
+        self.started = {} # slot to the time its worker was started
+        self.failures = {} # slot to the number of its workers in a row that failed to start
+        self.respawns = {} # slot to the time at which it is to be replaced
+        self.failed = False
+        self.stopping = False
+        self.recycle_requested = False
+        self._recycle_r, self._recycle_w = os.pipe() # workers that reach max_requests write their pid
+
+    @staticmethod
+    def cpu_count():
+        try:
+            import multiprocessing
+            return multiprocessing.cpu_count()
+        except (ImportError, NotImplementedError):
+            return 1
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = slot
+            self.started[slot] = time.time()
+            return pid
+        # worker
+        try:
+            if concurrency == 'gevent':
+                import gevent; gevent.reinit()
+            for sig in [ signal.SIGHUP, signal.SIGINT ]:
+                signal.signal(sig, signal.SIG_IGN)
+            terminated = [] # a SIGTERM may arrive before the server is ready
+            signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+            os.close(self._recycle_r)
+            if self.cpu_affinity:
+                cpus = psutil.Process().cpu_affinity()
+                psutil.Process().cpu_affinity([ cpus[slot % len(cpus)] ])
+            # on max_requests, ask the master to start a replacement (which then stops us) so that we always have listeners
+            on_recycle = lambda: os.write(self._recycle_w, '%d\n' % os.getpid())
+            server = make_server(self.app, self.host, self.port, listener=self.listener, reuse_port=self.reuse_port, 
+                                 on_recycle=on_recycle, **self.server_kargs)
+            stop = lambda *args: threading.Thread(target=server.stop).start()
+            signal.signal(signal.SIGTERM, stop)
+            if terminated: stop()
+            logging.getLogger().info('Worker %s serving on %s:%s', os.getpid(), self.host, self.port)
+            server.serve_forever()
+            wait_stopped(server)
+        except Exception:
+            logging.getLogger().exception('Worker %s failed', os.getpid())
+            os._exit(1)
+        os._exit(0)
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.recycle_requested = True
+        else:
+            self.stopping = True
+
+    def replace(self, pid):
+        '''
+        replaces a worker - a new worker is started before the old one is stopped (gracefully)
+        '''
+        slot = self.workers.pop(pid, None)
+        if slot is None or self.stopping: 
+            return
+        self.spawn(slot)
+        self._kill(pid, signal.SIGTERM)
+
+    def recycle(self):
+        ''' replaces all the workers one at a time '''
+        for pid in self.workers.keys():
+            self.replace(pid)
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass
+
+    def _reap(self):
+        ''' reaps exited workers. Workers that exited unexpectedly are replaced '''
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR: continue
+                return # no children
+            if not pid: 
+                return
+            slot = self.workers.pop(pid, None)
+            if slot is not None and not self.stopping:
+                self._exited(pid, slot, status)
+
+    def _exited(self, pid, slot, status):
+        ''' replaces a worker that exited unexpectedly - after a delay if it failed to start, or gives up '''
+        now = time.time()
+        if now - self.started.get(slot, 0) >= self.min_uptime:
+            self.failures[slot] = 0
+            logging.getLogger().warning('Worker %s exited (status %s). Replacing it', pid, status)
+            self.spawn(slot)
+            return
+        failures = self.failures[slot] = self.failures.get(slot, 0) + 1
+        if failures >= self.max_failures:
+            logging.getLogger().error('Worker %s exited (status %s) within %ss of starting %s times in a row. Giving up', 
+                                      pid, status, self.min_uptime, failures)
+            self.failed = self.stopping = True
+            return
+        delay = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+        logging.getLogger().warning('Worker %s exited (status %s) within %ss of starting. Replacing it in %ss', 
+                                    pid, status, self.min_uptime, delay)
+        self.respawns[slot] = now + delay
+
+    def _respawn(self):
+        ''' replaces the workers whose delay (after failing to start) is over. returns the time until the next replacement or None '''
+        now = time.time()
+        for slot, when in self.respawns.items():
+            if when <= now:
+                del self.respawns[slot]
+                self.spawn(slot)
+        return min(self.respawns.values()) - now if self.respawns else None
+
+    def run(self):
+        for sig in [ signal.SIGHUP, signal.SIGTERM, signal.SIGINT ]:
+            signal.signal(sig, self._on_signal)
+        logging.getLogger().info('Prefork serving on %s:%s with %s workers (%s)', self.host, self.port, self.num_workers,
+                                 'SO_REUSEPORT' if self.reuse_port else 'shared socket')
+        for slot in range(self.num_workers):
+            self.spawn(slot)
+        pending = ''
+        while not self.stopping:
+            if self.recycle_requested:
+                self.recycle_requested = False
+                self.recycle()
+            next_respawn = self._respawn()
+            try:
+                readable, _, _ = select.select([ self._recycle_r ], [], [], 1 if next_respawn is None else max(min(next_respawn, 1), 0))
+            except select.error as e:
+                if e.args[0] == errno.EINTR: continue # a signal
+                raise
+            if readable: # workers that reached max_requests
+                pending += os.read(self._recycle_r, 4096)
+                pids, pending = pending.split('\n')[:-1], pending.split('\n')[-1]
+                for pid in pids:
+                    self.replace(int(pid))
+            self._reap()
+        self.stop()
+        if self.failed:
+            raise RuntimeError('Workers failed to start on %s:%s (see the log)' % (self.host, self.port))
+
+    def stop(self, timeout=30):
+        for pid in self.workers.keys():
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.time() + timeout
+        while self.workers and time.time() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+            if pid: self.workers.pop(pid, None)
+            else: time.sleep(0.1)
+        for pid in self.workers.keys():
+            self._kill(pid, signal.SIGKILL)
+
+def serve(app, host, port, mode='threaded', **kargs):
+    '''
+    serves app in the given mode (threaded or prefork) until stopped. See :py:class:`PooledWSGIServer` and :py:class:`PreforkMaster`
+    for the other arguments
+    '''
+    if mode == 'prefork':
+        PreforkMaster(app, host, port, **kargs).run()
+    elif mode == 'threaded':
+        kargs.pop('workers', None), kargs.pop('cpu_affinity', None)
+        serve_threaded(app, host, port, **kargs)
+    else:
+        raise ValueError('Unknown serving mode %s. Should be one of %s' % (mode, MODES[1:]))
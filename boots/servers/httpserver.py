@@ -11,20 +11,30 @@ basic exception handling for requests, session, cache and authentication for the
 
 
 '''
+import boots
 from boots import concurrency
+if concurrency == 'gevent':
+    from gevent.coros import RLock
+elif concurrency == 'threading':
+    from threading import RLock
 from boots.endpoints.http_ep import Tracer, WrapException, RequestParams,\
-    HTTPServerEndPoint
+    HTTPServerEndPoint, Compress, ResponseCache, Coalesce, Drain
 
+from collections import OrderedDict
 import argparse
 import beaker.middleware as bkmw
 import beaker.cache as bkcache
 import beaker.util as bkutil
 from boots.servers.helpers.authorize import SimpleAuth
+from boots.endpoints.http_pool import ConnectionPool
+from boots.endpoints.http_resilience import CircuitBreaker
+from boots.servers.helpers import serving
 from boots.servers.server import Server
 import bottle
 import logging
 from boots.common.dirutils import DirUtils
-from boots.common.template import BootsTemplate
+from boots.common.template import TemplateRegistry
+from boots.common.config import Config
 
 # since we are a library, let's add null handler to root to allow us logging
 # without getting warnings about no handlers specified
@@ -51,13 +61,46 @@ class HTTPBaseServer(Server):
             Essentially, a request URL is matched against (mount_prefix + mountpoint + methodroute)
 
         '''
-        self.app = bottle.default_app() # this will get overridden by the callback handlers as appropriate
+        self.base_app = self.app = bottle.default_app() # self.app is rebuilt when middleware is set (see set_middleware)
+        self.middleware = OrderedDict() # name to factory, innermost first
+        self._middleware_lock = RLock()
         super(HTTPBaseServer, self).__init__(name=name, endpoints=endpoints, parent_server=parent_server, **kargs)
         
     # make the object act like a WSGI server
     def __call__(self, environ, start_response):
         assert(self.app is not None)
         return self.app(environ, start_response)
+    
+    def set_middleware(self, name, factory):
+        '''
+        sets the WSGI middleware identified by name and rebuilds the app (see :py:meth:`rebuild_app`). Setting a name that
+        already exists replaces that middleware in place, so that repeated configuration updates do not add layers. 
+        Middleware is applied in the order in which names are first set, the 1st being the innermost (closest to bottle)
+        
+        :param name: a unique name for the middleware (e.g. the configuration section that defines it)
+        :param factory: a callable that takes the app (WSGI callable) to wrap and returns the wrapped app 
+        '''
+        with self._middleware_lock:
+            self.middleware[name] = factory
+            self.rebuild_app()
+    
+    def remove_middleware(self, name):
+        ''' removes the middleware identified by name (if set) and rebuilds the app '''
+        with self._middleware_lock:
+            if self.middleware.pop(name, None) is not None:
+                self.rebuild_app()
+    
+    def rebuild_app(self):
+        '''
+        builds the app from scratch - the base (bottle) app wrapped by each middleware - and swaps it in. Requests in progress
+        complete with the app they started with
+        '''
+        with self._middleware_lock:
+            app = self.base_app
+            for factory in self.middleware.itervalues():
+                app = factory(app)
+            self.app = app # a single assignment - requests see either the old or the new app
+        return app
 
     @classmethod
     def get_arg_parser(cls, description='', add_help=False, parents=[], 
@@ -77,12 +120,50 @@ class HTTPBaseServer(Server):
         _argparser.add_argument('-p', '--port', dest='port', type=int, default=kargs.get('defport', '8080'),
                                  help='port number. (default: {})'.format(kargs.get('defport', '8080'))),                                 
         _argparser.add_argument('--debug', action="store_true", help='start bottle server in debug mode')
+        _argparser.add_argument('--mode', dest='mode', choices=boots.mode.MODES, default=None,
+                                 help='production or development. (default: from [Boots] mode in the configuration or development)')
+        _argparser.add_argument('--serving', dest='serving', choices=serving.MODES, default=None,
+                                 help='serving mode. threaded or prefork (multi-process). (default: from [Serving] mode in the configuration or default)')
+        _argparser.add_argument('--workers', dest='workers', type=int, default=None, help='number of worker processes with prefork. (default: number of cpus)')
+        _argparser.add_argument('--threads', dest='threads', type=int, default=None, help='number of worker threads (per process). (default: 10)')
+        _argparser.add_argument('--backlog', dest='backlog', type=int, default=None, help='listen backlog. (default: 128)')
+        _argparser.add_argument('--keepalive', dest='keepalive', type=float, default=None, help='keep-alive timeout (in seconds). 0 disables keep-alive. (default: 5)')
+        _argparser.add_argument('--max-requests', dest='max_requests', type=int, default=None, 
+                                 help='requests after which a worker is recycled gracefully. 0 implies never. (default: 0)')
+        _argparser.add_argument('--cpu-affinity', dest='cpu_affinity', action='store_true', default=None, help='pin prefork workers to a cpu each (requires psutil)')
         return _argparser
+    
+    #: the defaults for the serving options (see :py:meth:`start_main_server`)
+    serving_defaults = dict(mode='default', workers=0, threads=10, backlog=128, keepalive=5.0, max_requests=0, cpu_affinity=False, debug=False)
+    
+    def serving_options(self):
+        '''
+        returns the serving options. The command line arguments override the [Serving] section of the configuration which
+        overrides :py:attr:`serving_defaults`
+        '''
+        options = dict(self.serving_defaults)
+        options.update(self.config.get('Serving', {}))
+        args = self.cmmd_line_args or {}
+        args = dict(args, mode=args.get('serving'))
+        options.update((name, args[name]) for name in self.serving_defaults if args.get(name) is not None and args.get(name) is not False)
+        for name, default in self.serving_defaults.items(): # the configuration may not have a configspec
+            if isinstance(options[name], basestring) and type(default) is bool:
+                options[name] = options[name].lower() in [ 'true', 'yes', 'on', '1' ]
+            elif isinstance(options[name], basestring) and type(default) in [ int, float ]:
+                options[name] = type(default)(options[name])
+        return options
         
     def start_main_server(self, **kargs):
         '''
         starts the main server - in our case bottle. We will start the server only if self.standalone is 
-        True. The specific bottle server is controlled by the boots.concurrency setting
+        True. The serving mode is controlled by the command line (--serving etc) or the [Serving] section of the configuration
+        (see :py:meth:`serving_options`):
+        
+        * default - the server is run by bottle. The specific bottle server is controlled by the boots.concurrency setting 
+        * threaded - requests are served from a bounded pool of threads (greenlets with gevent). 
+        * prefork - requests are served by a number of worker processes (each with a pool of threads) 
+        
+        See :py:mod:`boots.servers.helpers.serving` for the details of threaded and prefork (including graceful recycling of workers)
         
         :param default_host: default host for the http server
         :param default_port: default port for the http server
@@ -92,11 +173,16 @@ class HTTPBaseServer(Server):
         if self.standalone:
             host = kargs.get('default_host', None) or self.cmmd_line_args['host'] or '127.0.0.1'
             port = kargs.get('default_port', None) or self.cmmd_line_args['port'] or '9000'
-            server = kargs.get('server', 'wsgiref')
             quiet = kargs.get('quiet', True)
-            if concurrency == 'gevent': server = 'gevent'
-            bottle.debug(True)
-            bottle.run(app=self, host=host, port=port, server=server)
+            options = self.serving_options()
+            mode, debug = options.pop('mode'), options.pop('debug')
+            bottle.debug(debug or boots.mode == boots.mode.DEVELOPMENT) # debug disables bottle's template caching
+            if mode in [ 'threaded', 'prefork' ]:
+                serving.serve(self, host, port, mode=mode, quiet=quiet, **options)
+            else:
+                server = kargs.get('server', 'wsgiref')
+                if concurrency == 'gevent': server = 'gevent'
+                bottle.run(app=self, host=host, port=port, server=server)
 
     def activate_endpoints(self):
         '''
@@ -113,17 +199,30 @@ class HTTPServer(HTTPBaseServer):
     
     The standard plugins are 
     
+    * :py:class:`Drain` for tracking requests in flight (and refusing new requests while the server stops)
     * :py:class:`RequestParams` for parameter processing
     * :py:class:`WrapException` for generic exception handling. If a specific exception handler has been 
         added by the endpoint, this generic excaption handler is ignored 
-    * :py:class:`Tracer` for request and response tracing/logging of http requests
+    * :py:class:`ResponseCache` for caching responses of routes that specify the cache parameter (in the cache configured
+        through the cache parameter)
+    * :py:class:`Tracer` for request and response tracing/logging of http requests. It is enabled through the [Tracer] 
+        section of the configuration (enabled, paths and optionally match_on, sample and background - see :py:class:`Tracer`). 
+        background defaults to True in production mode (see :py:class:`boots.mode`)
+    * :py:class:`Compress` for gzip/deflate compression of responses. It is enabled through the [Compress] section of the 
+        configuration (enabled and optionally min_size, level and cache_size - see :py:class:`Compress`)
+    * :py:class:`Coalesce` for collapsing identical concurrent requests. It is enabled through the [Coalesce] section of the 
+        configuration (enabled and optionally methods, vary and timeout - see :py:class:`Coalesce`)
+    
+    The [HTTPClientPool] section of the configuration (max_per_host and idle_timeout) configures the pool of persistent connections 
+    shared by HTTP client endpoints (see :py:class:`ConnectionPool`) and the [HTTPClientBreaker] section (failure_threshold and 
+    reset_timeout) configures the circuit breakers of HTTP client endpoints (see :py:class:`CircuitBreaker`)
     '''
     
     auth_classes = { '--no-key-specified': SimpleAuth } # subclasses should ADD to (NOT OVERWRITE) this dict
     config_callbacks = { }  # we can set these directly out of the class body or in __init__
 
     def __init__(self,  name=None, endpoints=None, parent_server=None, mount_prefix='',
-                 session=False, cache=False, auth=False, handle_exception=False, **kargs):
+                 session=False, cache=False, auth=False, handle_exception=False, fuse_plugins=False, **kargs):
         '''
         :params bool session: controls whether sessions based on configuration ini should be instantiated. sessions
             will be available through the HTTPServerEndPoint. If a string, implies the name of the config section. If session is a list of strings, 
@@ -138,9 +237,10 @@ class HTTPServer(HTTPBaseServer):
             or it can be a list of config sections that will be auth related (allowing multiple auth layers). Note, the last entry in the configuration file 
             will challenge the user the 1st (i.e. it is the outermost auth layer) 
         :params handle_exception: controls whether a default exception handler should be setup
+        :params bool fuse_plugins: controls whether endpoints fuse consecutive fusable plugins into a single dispatcher per route 
+            (see :py:class:`FusedPlugins`). Endpoints may override this individually
         '''
 
-        self.app = None
         self.mount_prefix = mount_prefix or ''
         
         # setup the callbacks for configuration
@@ -176,15 +276,21 @@ class HTTPServer(HTTPBaseServer):
         else:
             self.auth_configs = []
         
+        self.config_callbacks['HTTPClientPool'] = self.client_pool_config_update
+        self.config_callbacks['HTTPClientBreaker'] = self.client_breaker_config_update
         self.login_templates = {}
         self.handle_exception = handle_exception
+        self.fuse_plugins = fuse_plugins
         super(HTTPServer, self).__init__(name=name, endpoints=endpoints, parent_server=parent_server, **kargs)
     
     def login_template_finder(self, base_dir, base_path):
-        ''' the function to setup a dynamic template finder. It can be overrriden to return a partial that will return an appropriate Template object to be used by SimpleAuth '''
+        ''' the function to setup a dynamic template finder. It can be overrriden to return a partial that will return an appropriate Template object to be used by SimpleAuth.
+        By default, returns a finder that returns the compiled template from :py:class:`TemplateRegistry` (recompiled only when the file is modified) '''
         
         default_template = DirUtils().resolve_path(base_dir, base_path) # validate that template is under the base_dir 
-        return BootsTemplate(DirUtils().read_file(default_template, None))
+        if TemplateRegistry.get_file(default_template) is None: # compile it now
+            raise IOError('Login template %s not found' % (default_template,))
+        return lambda environ: TemplateRegistry.get_file(default_template)
     
     def auth_config_update(self, action, full_key, new_val, config_obj):
         '''
@@ -192,6 +298,8 @@ class HTTPServer(HTTPBaseServer):
         
         BootsAuth relies on a session management middleware(i.e.Beaker) upfront in the stack. 
         '''
+        if action == Config.Action.ondel:
+            return self.remove_middleware('.'.join(full_key))
         auth_class_key = new_val.get('auth_class_key', '--no-key-specified--')
         self.AuthClass = self.auth_classes.get(auth_class_key) or SimpleAuth
         login_template = new_val.get('login_template', '')
@@ -216,10 +324,11 @@ class HTTPServer(HTTPBaseServer):
         conf.pop('beaker', None) # remove beaker from the copied conf
         conf.pop('caching', None) # remove caching from the copied conf
         conf.pop('key', None) # remove auth cookie key from copied conf
-        self.app = self.AuthClass(self.app, **conf)
+        AuthClass, beaker_config, session_key = self.AuthClass, dict(new_val['beaker']), new_val['session_key']
         
-        # a persistent, cookie based session
-        self.app = bkmw.SessionMiddleware(self.app, new_val['beaker'], environ_key=new_val['session_key'])
+        # auth relies on a persistent, cookie based session
+        self.set_middleware('.'.join(full_key), 
+                            lambda app: bkmw.SessionMiddleware(AuthClass(app, **conf), beaker_config, environ_key=session_key))
         
         logging.getLogger().debug('Auth config updated for %s. Open urls %s', '.'.join(full_key), conf['open_urls'])
     
@@ -227,7 +336,11 @@ class HTTPServer(HTTPBaseServer):
         '''
         Called by Config to update the session Configuration.
         '''
-        self.app = bkmw.SessionMiddleware(self.app, new_val, environ_key=new_val.get('session.key', full_key[-1]))
+        if action == Config.Action.ondel:
+            return self.remove_middleware('.'.join(full_key))
+        session_config = dict(new_val)
+        self.set_middleware('.'.join(full_key), 
+                            lambda app: bkmw.SessionMiddleware(app, session_config, environ_key=session_config.get('session.key', full_key[-1])))
         logging.getLogger().debug('Session config updated for %s', '.'.join(full_key))
     
     def cache_creator(self, caching_config):
@@ -242,6 +355,22 @@ class HTTPServer(HTTPBaseServer):
         setattr(self, cache_name, self.cache_creator(sanitized_config))
         logging.getLogger().debug('Cache config updated for %s available in self.%s with type %s', '.'.join(full_key), cache_name, type(getattr(self, cache_name)))
     
+    def client_pool_config_update(self, action, full_key, new_val, config_obj):
+        '''
+        Called by Config to update the settings (max_per_host, idle_timeout) of the connection pool shared by HTTP client endpoints
+        (see :py:class:`ConnectionPool`)
+        '''
+        if new_val:
+            ConnectionPool.shared().configure(**dict(new_val))
+
+    def client_breaker_config_update(self, action, full_key, new_val, config_obj):
+        '''
+        Called by Config to update the settings (failure_threshold, reset_timeout) of the circuit breakers of HTTP client endpoints
+        (see :py:class:`CircuitBreaker`)
+        '''
+        if new_val:
+            CircuitBreaker.configure(**dict(new_val))
+    
     def template_config(self, action, full_key, new_val, config_obj):
         self.logger.debug("Template Config updated for %s", full_key)
         sub_config_obj = config_obj
@@ -258,23 +387,45 @@ class HTTPServer(HTTPBaseServer):
         instantiate plugins of the super classes. Subclasses can also inspect the plugins that the endpoint
         has been explicitly provided to change their behavior.
         
-        :py:class:`HTTPServer` instantiates :py:class:`Tracer`, :py:class:`RequestParams` and optionally (governed
-        by self.handle_exception) :py:class:`WrapException`
+        :py:class:`HTTPServer` instantiates :py:class:`Drain`, :py:class:`Tracer`, :py:class:`RequestParams`, :py:class:`ResponseCache` and optionally (governed
+        by self.handle_exception) :py:class:`WrapException` and (governed by the [Compress] and [Coalesce] sections of the configuration) 
+        :py:class:`Compress` and :py:class:`Coalesce`
         
         :param plugins: the list of plugins explicitly provided to an endpoint
         '''
 
-        if self.config.get('Tracer', {}).get('enabled', False):
-            tracer_paths = self.config.get('Tracer', {}).get('paths', None) or  ['.*']
-            tracer_plugin = [ Tracer(tracer_paths) ]
+        tracer_config = self.config.get('Tracer', {})
+        if tracer_config.get('enabled', False):
+            tracer_paths = tracer_config.get('paths', None) or  ['.*']
+            tracer_plugin = [ Tracer(tracer_paths, match_on=tracer_config.get('match_on', 'url'), sample=tracer_config.get('sample', None),
+                                     background=tracer_config.get('background', boots.mode == boots.mode.PRODUCTION)) ]
         else:
             tracer_plugin = []
 
         exception_handler = [ WrapException() ] if WrapException not in plugins and self.handle_exception else []
         
-        return exception_handler + [ RequestParams() ] + tracer_plugin  # outermost to innermost
+        compress_config = dict(self.config.get('Compress', {}))
+        enabled = compress_config.pop('enabled', False)
+        if isinstance(enabled, basestring): enabled = enabled.lower() in [ 'true', 'yes', 'on', '1' ] # without a configspec
+        if enabled and not filter(lambda p: isinstance(p, Compress), plugins):
+            compress_plugin = [ Compress(**compress_config) ]
+        else:
+            compress_plugin = []
+        
+        coalesce_config = dict(self.config.get('Coalesce', {}))
+        enabled = coalesce_config.pop('enabled', False)
+        if isinstance(enabled, basestring): enabled = enabled.lower() in [ 'true', 'yes', 'on', '1' ] # without a configspec
+        coalesce_plugin = [ Coalesce(**coalesce_config) ] if enabled and not filter(lambda p: isinstance(p, Coalesce), plugins) else []
+        
+        drain_plugin = [ Drain() ] if not filter(lambda p: isinstance(p, Drain), plugins) else []
+        
+        return drain_plugin + compress_plugin + exception_handler + [ RequestParams() ] + coalesce_plugin + [ ResponseCache() ] + tracer_plugin  # outermost to innermost
     
     def add_template_path(self, template_path):
+        '''
+        adds a template directory. The templates within it are compiled now (see :py:class:`TemplateRegistry`) 
+        '''
 #        self.logger.debug("Adding template path:%s",template_path)
         bottle.TEMPLATE_PATH.append(template_path)
+        TemplateRegistry.add_path(template_path)
 #        self.logger.debug("Added template path:%s",bottle.TEMPLATE_PATH)
\ No newline at end of file
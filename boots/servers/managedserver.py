@@ -9,10 +9,22 @@ if concurrency == 'gevent':
 elif concurrency == 'threading':
     from threading import RLock
 
-from boots.endpoints.http_ep import HTTPServerEndPoint, methodroute, Hook, Tracer, template    
+from boots.endpoints.http_ep import HTTPServerEndPoint, methodroute, Hook, Tracer, WrapException, Coalesce, Drain, template    
 from boots.servers.httpserver import HTTPServer
+from boots.common.inflight import InFlight
+from boots.common.template import TemplateRegistry
+from boots.endpoints.http_pool import ConnectionPool
+from boots.endpoints.http_async import AsyncHTTPEngine
+from boots.endpoints.http_resilience import CircuitBreaker
+from boots.common.resolver import Resolver
+from boots.common.histogram import LatencyHistogram
+from boots.common.windowstats import WindowedStats
+from boots.common.threadpool import ThreadPool
+from boots.common.metrics import MetricFamily, render, CONTENT_TYPE, LATENCY_BUCKETS
 import logging
 import json
+import sys
+import threading
 import time
 
 # since we are a library, let's add null handler to root to allow us logging
@@ -20,7 +32,6 @@ import time
 logging.getLogger().addHandler(logging.NullHandler())
 
 def admin_auth(user, password):
-    print "user:",user, "password:",password
     if user == "incharge" and password == "1gniter0cks":
         return True
     return False
@@ -30,6 +41,17 @@ class Stats(Hook):
     def create_request_context(self, **kargs):
         return super(Stats, self).create_request_context(**kargs), time.time()
     
+    @staticmethod
+    def status(result, exception):
+        ''' the HTTP status of a request from its result or exception '''
+        if isinstance(exception, bottle.HTTPResponse):
+            return exception.status_code
+        if exception is not None:
+            return 500
+        if isinstance(result, bottle.HTTPResponse):
+            return result.status_code
+        return bottle.response.status_code
+    
     def handler(self, before_or_after, request_context, callback, url, result=None, exception=None, **kargs):
         if before_or_after == 'after':
             callback_obj = getattr(callback, '_callback_obj', None) or getattr(callback, 'im_self', None)
@@ -37,7 +59,8 @@ class Stats(Hook):
             if server and getattr(server, 'stats_collector', None):
                 _, start_time = request_context
                 end_time = time.time()
-                server.stats_collector(callback.__name__, url, end_time - start_time, start_time, end_time, **kargs)
+                server.stats_collector(callback.__name__, url, end_time - start_time, start_time, end_time, 
+                                       _status=self.status(result, exception), _endpoint=getattr(callback_obj, 'name', None), **kargs)
         return result
 
 class ManagedEP(HTTPServerEndPoint):
@@ -126,14 +149,30 @@ class ManagedEP(HTTPServerEndPoint):
         '''
         return self.server.stats()
     
-    @methodroute(skip_by_type=[Stats, Tracer])
+    @methodroute(skip_by_type=[Stats, Tracer, Drain])
+    def metrics(self):
+        '''
+        returns the metrics of the server in the Prometheus text exposition format. metrics are obtained by calling 
+        :py:meth:`ManagedServer.metrics`. It responds while the server drains
+        '''
+        self.response.content_type = CONTENT_TYPE
+        return render(self.server.metrics())
+    
+    @methodroute(skip_by_type=[Stats, Tracer, Drain])
     def health(self):
         '''
-        returns the health of the server. The health is obtained from the server's :py:meth:`boots.servers.server.health` method
+        returns the health of the server. The health is obtained from the server's :py:meth:`boots.servers.server.health` method.
+        It responds while the server drains
         '''
         return self.server.health()
     
 class StatsEntry(dict):
+    '''
+    the statistics of a handler - total time, count, mean, min and max and the percentiles (p50, p90, p99 and p999) of its latency.
+    The latencies are counted in a fixed memory :py:class:`LatencyHistogram` (and exactly against the buckets of the exported 
+    latency histogram, :py:data:`LATENCY_BUCKETS`). The percentiles are computed from it when the entry is read (see 
+    :py:meth:`update_percentiles`) 
+    '''
     
     def __init__(self):
         self['total_time'] = 0
@@ -141,9 +180,15 @@ class StatsEntry(dict):
         self['mean'] = None
         self['max'] = None
         self['min'] = None
+        self.histogram = LatencyHistogram(bounds=LATENCY_BUCKETS)
+        self.update_percentiles()
+        
+    def update_percentiles(self):
+        self.update(self.histogram.percentiles())
         
     def add(self, val, url, **kargs):
         if isinstance(val, StatsEntry):
+            self.histogram.merge(val.histogram)
             self['total_time'] += val['total_time']
             self['total_count'] += val['total_count']
             self['mean'] = self['total_time'] / self['total_count']
@@ -152,6 +197,7 @@ class StatsEntry(dict):
             self['max'] = max(self['max'], val['max'])
             self['min'] = val['min'] if self['min'] is None else min(self['min'], val['min'])
         else:
+            self.histogram.record(val)
             self['total_count'] += 1
             self['total_time'] += val
             self['mean'] = self['total_time'] / self['total_count']
@@ -164,21 +210,85 @@ class StatsEntry(dict):
         
 class StatsCollection(object):
     '''
-    the default stat collection class.
+    the default stat collection class. Statistics are collected in per thread shards that are written without a lock, 
+    and merged when they are read (see :py:meth:`get`). With gevent (greenlets are not preempted during an update) a 
+    single shard is used. Shards of threads that have exited are folded into a retired shard (their statistics remain)
     '''
     
-    lock = RLock()
-    statstable = {}
+    lock = RLock() # only to register, retire and read shards
+    #: (thread, shard) of the threads that collected statistics. A shard is a dict of name to :py:class:`StatsEntry`
+    shards = []
+    #: the statistics collected by threads that have exited
+    retired = {}
+    _local = threading.local() if concurrency == 'threading' else None
+    
+    @classmethod
+    def _shard(cls):
+        ''' returns this thread's shard, creating and registering it on first use '''
+        if cls._local is None:
+            if not cls.shards:
+                with cls.lock:
+                    if not cls.shards: cls.shards.append((None, {}))
+            return cls.shards[0][1]
+        try:
+            return cls._local.shard
+        except AttributeError:
+            shard = cls._local.shard = {}
+            with cls.lock:
+                cls._retire()
+                cls.shards.append((threading.current_thread(), shard))
+            return shard
+    
+    @classmethod
+    def _retire(cls):
+        ''' folds the shards of threads that have exited into the retired shard. Called with the lock held '''
+        live = []
+        for thread, shard in cls.shards:
+            if thread is None or thread.is_alive():
+                live.append((thread, shard))
+            else:
+                cls._merge(cls.retired, shard)
+        cls.shards[:] = live
     
+    @staticmethod
+    def _merge(table, shard):
+        for name, entry in shard.items():
+            table.setdefault(name, StatsEntry()).add(entry, None)
+        
     @classmethod
     def get(cls):
+        ''' returns the statistics (name to :py:class:`StatsEntry`) merged from all the shards '''
         with cls.lock:
-            return cls.statstable
+            cls._retire()
+            table = {}
+            cls._merge(table, cls.retired)
+            for _, shard in cls.shards:
+                cls._merge(table, shard)
+        for entry in table.itervalues():
+            entry.update_percentiles()
+        return table
         
     @classmethod
     def add(cls, __name, __delta, __url, **kargs):
-        with cls.lock:
-            cls.statstable.setdefault(__name, StatsEntry()).add(__delta, __url, **kargs)
+        shard = cls._shard()
+        entry = shard.get(__name)
+        if entry is None: # published once it has a value (it may be read meanwhile)
+            entry = StatsEntry()
+            entry.add(__delta, __url, **kargs)
+            shard[__name] = entry
+        else:
+            entry.add(__delta, __url, **kargs)
+    
+class RouteStatsCollection(StatsCollection):
+    '''
+    the statistics of requests by (endpoint, handler, status class) - e.g. ('users', 'get_user', '2xx'). Collected as 
+    :py:class:`StatsCollection` (in its own shards). Used for the /admin/metrics route
+    '''
+    
+    lock = RLock()
+    shards = []
+    retired = {}
+    _local = threading.local() if concurrency == 'threading' else None
     
 class ManagedServer(HTTPServer):
     '''
@@ -192,16 +302,149 @@ class ManagedServer(HTTPServer):
         '''
         returns a statistical data dict. this can be overriden by subclasses to provide a different
         view of statistics. This method is invoked
-        by the /admin/stats route to obtain the statistics for this server
+        by the /admin/stats route to obtain the statistics for this server. The counters of exceptions trapped by 
+        :py:class:`WrapException` are under the key 'exceptions', those of :py:class:`Coalesce` under 'coalesced' and the template cache
+        hits and misses (see :py:class:`TemplateRegistry`) under 'templates' and those of the shared HTTP client connection pool 
+        (see :py:class:`ConnectionPool`) under 'http_pool'. Those of the asynchronous HTTP client engine (see :py:class:`AsyncHTTPEngine`),
+        once it is in use, are under 'http_engine' and the state and trips of the HTTP client circuit breakers (see :py:class:`CircuitBreaker`),
+        by host, under 'circuit_breakers'. The hit rate and latency of the host name resolution cache (see :py:class:`Resolver`) are 
+        under 'resolver'. The requests per second, error rate and latency percentiles of each handler over the last 1, 5 and 15 minutes
+        (see :py:class:`WindowedStats`) are under 'windows'
+        '''
+        stats = dict(self._stats.get())
+        stats['exceptions'] = self.exception_stats()
+        stats['coalesced'] = Coalesce.coalesce_stats()
+        stats['templates'] = TemplateRegistry.stats()
+        stats['http_pool'] = ConnectionPool.shared().stats()
+        if AsyncHTTPEngine._shared is not None:
+            stats['http_engine'] = AsyncHTTPEngine._shared.stats()
+        stats['circuit_breakers'] = CircuitBreaker.stats()
+        stats['resolver'] = Resolver.stats()
+        stats['windows'] = self._windows.stats()
+        return stats
+    
+    def metrics(self):
+        '''
+        returns the metrics of the server (a list of :py:class:`MetricFamily`) rendered by the /admin/metrics route. Every series is
+        labelled with the name of the server. Requests are counted (and their latency histograms are labelled) by endpoint, 
+        handler and status class. Also included are the thread pool queues, the HTTP client pools, circuit breakers and resolver,
+        and - if they are in use - the database connection pools and the ZMQ message counts. Subclasses may extend the list
+        '''
+        server = self.name
+        requests = MetricFamily('boots_requests_total', 'counter', 'Requests handled', server=server)
+        latency = MetricFamily('boots_request_duration_seconds', 'histogram', 'Time taken to handle requests', server=server)
+        for (endpoint, route, status), entry in sorted(self._route_stats.get().iteritems()):
+            labels = dict(endpoint=endpoint or '', route=route, status=status)
+            requests.add(entry['total_count'], **labels)
+            latency.add_histogram(entry.histogram.cumulative(LATENCY_BUCKETS), LATENCY_BUCKETS, entry['total_count'], 
+                                  entry['total_time'], **labels)
+        families = [ requests, latency ]
+        
+        exceptions = MetricFamily('boots_exceptions_total', 'counter', 'Exceptions trapped by WrapException', server=server)
+        for entry in self.exception_stats():
+            exceptions.add(entry['count'], type=entry['type'], route=entry['route'])
+        coalesced = MetricFamily('boots_coalesced_requests_total', 'counter', 'Requests that led or were collapsed by Coalesce', server=server)
+        for role, count in Coalesce.coalesce_stats().iteritems():
+            coalesced.add(count, role=role)
+        inflight = InFlight.stats()
+        in_flight = MetricFamily('boots_in_flight', 'gauge', 'Work in flight', server=server)
+        for kind, count in inflight['in_flight'].iteritems():
+            in_flight.add(count, kind=kind)
+        draining = MetricFamily('boots_draining', 'gauge', 'Whether the server is draining', server=server).add(inflight['draining'])
+        families += [ exceptions, coalesced, in_flight, draining ]
+        
+        workers = MetricFamily('boots_thread_pool_workers', 'gauge', 'Worker threads of thread pools', server=server)
+        queued = MetricFamily('boots_thread_pool_queued', 'gauge', 'Tasks waiting for a worker thread', server=server)
+        for pool in ThreadPool.stats():
+            workers.add(pool['workers'], pool=pool['name'])
+            queued.add(pool['queued'], pool=pool['name'])
+        families += [ workers, queued ]
+        
+        templates = TemplateRegistry.stats()
+        families.append(MetricFamily('boots_template_cache_total', 'counter', 'Template cache lookups', server=server)
+                        .add(templates['hits'], result='hit').add(templates['misses'], result='miss'))
+        
+        # the connection events are counters - the idle connections and the requests in flight are gauges
+        connections = MetricFamily('boots_http_client_connections_total', 'counter', 'HTTP client connection events', server=server)
+        idle = MetricFamily('boots_http_client_idle_connections', 'gauge', 'Idle HTTP client connections', server=server)
+        client_in_flight = MetricFamily('boots_http_client_in_flight', 'gauge', 'HTTP client requests in flight', server=server)
+        engines = [ ('pool', ConnectionPool.shared().stats()) ]
+        if AsyncHTTPEngine._shared is not None:
+            engines.append(('engine', AsyncHTTPEngine._shared.stats()))
+        for client, stats in engines:
+            for event in ('created', 'reused', 'released', 'discarded', 'retried'):
+                if event in stats:
+                    connections.add(stats[event], client=client, event=event)
+            for host, count in stats.get('idle', {}).iteritems():
+                idle.add(count, client=client, host=host)
+            if 'in_flight' in stats:
+                client_in_flight.add(stats['in_flight'], client=client)
+        families += [ connections, idle, client_in_flight ]
+        
+        breaker_open = MetricFamily('boots_circuit_breaker_open', 'gauge', 'Whether the circuit of a host is (half) open', server=server)
+        trips = MetricFamily('boots_circuit_breaker_trips_total', 'counter', 'Times the circuit of a host opened', server=server)
+        rejected = MetricFamily('boots_circuit_breaker_rejected_total', 'counter', 'Requests failed fast by an open circuit', server=server)
+        for host, breaker in CircuitBreaker.stats().iteritems():
+            breaker_open.add(breaker['state'] != CircuitBreaker.CLOSED, host=host)
+            trips.add(breaker['trips'], host=host)
+            rejected.add(breaker['rejected'], host=host)
+        families += [ breaker_open, trips, rejected ]
+        
+        resolver = Resolver.stats()
+        families.append(MetricFamily('boots_resolver_lookups_total', 'counter', 'Host name resolutions', server=server)
+                        .add(resolver['hits'], result='hit').add(resolver['misses'], result='miss'))
+        families.append(MetricFamily('boots_resolver_failures_total', 'counter', 'Failed host name resolutions', server=server)
+                        .add(resolver['failures']))
+        
+        # database and ZMQ endpoints are optional (and their modules need sqlalchemy and zmq) - reported if they are in use
+        dbengine = sys.modules.get('boots.datastore.dbengine')
+        if dbengine is not None:
+            db_connections = MetricFamily('boots_db_pool_connections', 'gauge', 'Database pool connections', server=server)
+            db_size = MetricFamily('boots_db_pool_size', 'gauge', 'Size of database pools', server=server)
+            for db, pool in dbengine.DatabaseEngineFactory.pool_stats().iteritems():
+                db_size.add(pool['size'], db=db)
+                for state in ('checked_out', 'checked_in', 'overflow'):
+                    db_connections.add(pool[state], db=db, state=state)
+            families += [ db_connections, db_size ]
+        zmq_base = sys.modules.get('boots.endpoints.zmqendpoints.zmq_base')
+        if zmq_base is not None:
+            messages = MetricFamily('boots_zmq_messages_total', 'counter', 'ZMQ messages sent and received', server=server)
+            for address, counts in zmq_base.ZMQBaseEndPoint.message_stats().iteritems():
+                for direction, count in counts.iteritems():
+                    messages.add(count, address=address, direction=direction)
+            families.append(messages)
+        return families
+        
+    def exception_stats(self):
+        '''
+        returns the counters of the exceptions trapped by :py:class:`WrapException` (see :py:meth:`WrapException.exception_stats`).
+        Empty if no endpoint traps exceptions
+        '''
+        for endpoint in self.endpoints:
+            for plugin in getattr(endpoint, 'plugins', None) or []:
+                if isinstance(plugin, WrapException):
+                    return plugin.exception_stats()
+        return []
+        
+    def health(self):
+        '''
+        returns the health of the server. The work in flight, whether the server is draining and the report of the last drain
+        (duration and dropped work - see :py:meth:`boots.servers.server.Server.drain`) are under the key 'inflight'
         '''
-        return self._stats.get()
+        health = dict(super(ManagedServer, self).health())
+        health['inflight'] = InFlight.stats()
+        return health
         
-    def stats_collector(self, handler_name, url, time_taken, start_time, end_time, **kargs):
+    def stats_collector(self, handler_name, url, time_taken, start_time, end_time, _status=None, _endpoint=None, **kargs):
         '''
         stats_collector is invokved by the Stats plugin to collect statistics. Can be overriden by
-        subclasses to redefine statistics collection
+        subclasses to redefine statistics collection. _status is the HTTP status of the response (a status of 500 or more
+        is counted as an error) and _endpoint the name of the endpoint of the handler
         '''
         self._stats.add(handler_name, time_taken, url, **kargs)
+        status = '%dxx' % (_status // 100) if _status else 'unknown'
+        self._route_stats.add((_endpoint, handler_name, status), time_taken, url, **kargs)
+        self._windows.add(handler_name, time_taken, error=_status is not None and _status >= 500)
     
     def __init__(self,  endpoints=None, **kargs):
         self.config_callbacks['Template'] = self.template_config
@@ -209,14 +452,18 @@ class ManagedServer(HTTPServer):
         endpoints = [ endpoints ] if type(endpoints) not in [list, tuple] else endpoints
         endpoints = endpoints + [ ManagedEP()]
         self._stats = StatsCollection()
+        self._windows = WindowedStats()
+        self._route_stats = RouteStatsCollection()
         super(ManagedServer, self).__init__(endpoints=endpoints, **kargs)
 
     def get_standard_plugins(self, plugins):
         '''
-        Adds the Stats plugin to all endpoints (except the ManagedEP)
+        Adds the Stats plugin to all endpoints (except the ManagedEP). It is the outermost plugin, so that the requests answered
+        by the other plugins (e.g. the 503s of :py:class:`Drain`, the hits of :py:class:`ResponseCache` and the requests collapsed
+        by :py:class:`Coalesce`) are counted too, with the status that is sent
         '''
         try:
             par_plugins = super(ManagedServer, self).get_standard_plugins(plugins)
         except AttributeError:
             par_plugins = []
-        return par_plugins + [ Stats() ] 
+        return [ Stats() ] + par_plugins
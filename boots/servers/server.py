@@ -25,12 +25,17 @@ import inspect
 import logging
 import functools
 import atexit
+import signal
+import thread
+import threading
 from warnings import warn
 from logging.config import dictConfig
 
 import boots
 from boots.servers.helpers.serverconfig import ServerConfig
 from boots.common.utils import new_counter, generate_uuid
+from boots.common.inflight import InFlight
+from boots.common.resolver import Resolver
 from boots.common.boots_logging import BootsLogging
 
 class Server(object):
@@ -79,6 +84,7 @@ class Server(object):
         self._proj_dir = None
         logger = kargs.get('logger', False)
         if logger: self.__class__.config_callbacks['Logging'] = Server._logger_config_update # defined in this class
+        self.__class__.config_callbacks['Resolver'] = Server._resolver_config_update
         self.uuid = generate_uuid()
         atexit.register(self._atexit)
         
@@ -204,6 +210,7 @@ class Server(object):
             
         if self.is_master:
             self.configure(proj_dir=proj_dir, conf_subdir=conf_subdir, config_files=config_files)
+            self.configure_mode()
         
         self.pre_activate_hook()        
         self.activate_endpoints()
@@ -211,9 +218,20 @@ class Server(object):
         
         if self.is_master:
             Server.main_server = self
+            if self.standalone and self.drain_on_sigterm: self.handle_sigterm()
             self.start_main_server()
         self.post_activate_hook() 
             
+    def configure_mode(self):
+        '''
+        sets :py:class:`boots.mode` from the command line (--mode) or the mode in the [Boots] section of the configuration 
+        (in that order). Leaves the mode unchanged if neither is specified
+        '''
+        new_mode = (self.cmmd_line_args or {}).get('mode') or self.config.get('Boots', {}).get('mode')
+        if new_mode:
+            boots.mode.set(new_mode)
+            self.logger.info('Server %s running in %s mode', self.name, boots.mode)
+    
     # these can be overridden defined by the subclasses
     def activate_endpoints(self):
         '''
@@ -223,9 +241,13 @@ class Server(object):
     
     def pre_activate_hook(self):
         '''
-        This is hook to do pre-start processing
+        This is hook to do pre-start processing. Starts resolving (in the background) the hosts listed in prefetch of the [Resolver]
+        section of the configuration (see :py:class:`Resolver`). Subclasses that override this should invoke super
         '''
-        pass
+        hosts = self.config.get('Resolver', {}).get('prefetch', [])
+        if isinstance(hosts, basestring): hosts = [ hosts ]
+        if hosts:
+            Resolver.prefetch(hosts)
     
     def post_activate_hook(self):
         '''
@@ -242,7 +264,57 @@ class Server(object):
             runs the main event loop (if any) for the servers. Typically overridden in subclasses '''
         pass
     
+    #: the maximum time (in seconds) that :py:meth:`stop_server` waits for work in flight to complete
+    drain_timeout = 10
+    
+    def drain(self, timeout=None):
+        '''
+        stops accepting new work and waits (up to timeout, defaulting to :py:attr:`drain_timeout`) for the work in flight 
+        (see :py:class:`boots.common.inflight.InFlight`) to complete. returns the drain report
+        '''
+        report = InFlight.drain(self.drain_timeout if timeout is None else timeout)
+        if report['dropped']:
+            self.logger.warning('Server %s drained in %.2fs. Dropped work in flight %s', self.name, report['duration'], report['dropped'])
+        elif report['pending']:
+            self.logger.info('Server %s drained %s in %.2fs', self.name, report['completed'], report['duration'])
+        return report
+    
+    #: whether a SIGTERM drains the (standalone) master server while it is still serving, before it is stopped
+    drain_on_sigterm = True
+    
+    def handle_sigterm(self):
+        '''
+        installs a SIGTERM handler that drains (see :py:meth:`drain`) while the main server continues to serve (and refuse new work), 
+        and then interrupts the main server (which in turn stops the server). Does nothing if a SIGTERM handler is already installed
+        or if not called from the main thread
+        '''
+        if not isinstance(threading.current_thread(), threading._MainThread) or signal.getsignal(signal.SIGTERM) != signal.SIG_DFL:
+            return False
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+        return True
+    
+    def _on_sigterm(self, signum, frame):
+        if not InFlight.accepting: # a 2nd SIGTERM does not wait for the drain
+            self.logger.warning('Server %s received SIGTERM while draining. Stopping', self.name)
+            thread.interrupt_main()
+            return
+        self.logger.warning('Server %s received SIGTERM. Draining', self.name)
+        # the work in flight may be served by this (main) thread. So, drain in another thread
+        drainer = threading.Thread(target=self._drain_and_interrupt, name='drain %s' % self.name)
+        drainer.daemon = True
+        drainer.start()
+    
+    def _drain_and_interrupt(self):
+        try:
+            self.drain()
+        finally:
+            thread.interrupt_main() # a KeyboardInterrupt stops the main server. stop_server runs from atexit
+    
     def stop_server(self):
+        '''
+        drains (see :py:meth:`drain`) and closes all endpoints
+        '''
+        self.drain()
         for e in self.endpoints:
             try:
                 e.close()
@@ -407,6 +479,13 @@ class Server(object):
         
         return vars(submost_parser.parse_args())
 
+    def _resolver_config_update(self, action, full_key, new_val, config_obj):
+        '''
+        Called by Config to update the settings (ttl, negative_ttl, max_entries) of the host name resolution cache (see :py:class:`Resolver`)
+        '''
+        if new_val:
+            Resolver.configure(**dict(new_val))
+
     def _logger_config_update(self, action, full_key, new_val, config_obj):
         '''
         Called by Config to update the logging Configuration.
@@ -50,6 +50,7 @@ class ZMQServer(server.Server):
         super(ZMQServer, self).add_endpoint(endpoint)
     
     def stop_server(self):
+        self.drain()
         [ self.ep_hash[uuid].close() for uuid in self.ep_hash if isinstance(self.ep_hash[uuid], ZMQBaseEndPoint) ]
         
 if __name__ == '__main__':
@@ -12,7 +12,8 @@ setup(name='boots',
       author=boots.__author__,
       author_email='boots@ignitesol.com',
       url='',
-      packages=find_packages(),
+      packages=find_packages(exclude=['tests', 'tests.*']),
+      test_suite='tests',
       data_files=[ ('docs', glob('docs/source/*.rst') + ['docs/source/conf.py' ]) ],
       license='',
       platforms = 'any',
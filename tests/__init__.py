@@ -0,0 +1,5 @@
+'''
+Tests of boots. Run them with::
+
+    python -m unittest discover -s tests -t .
+'''
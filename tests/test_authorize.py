@@ -0,0 +1,75 @@
+'''
+Tests of :py:class:`boots.servers.helpers.authorize.OpenURLMatcher` and the credential and decision caches of
+:py:class:`boots.servers.helpers.authorize.SimpleAuth`
+'''
+import re
+import unittest
+try:
+    from boots.servers.helpers.authorize import OpenURLMatcher, SimpleAuth
+except ImportError: # requires barrel
+    OpenURLMatcher = SimpleAuth = None
+
+@unittest.skipIf(OpenURLMatcher is None, 'requires barrel')
+class OpenURLMatcherTest(unittest.TestCase):
+    
+    patterns = [ '^/static/', '^/public/.*', '^/login$', '^/api/v1\\.0/status', '/health$', 'favicon\\.ico', '^/docs/[a-z]+\\.html$' ]
+    paths = [ '/static/app.js', '/public/', '/login', '/login/x', '/api/v1.0/status', '/api/v1x0/status', '/admin/health', 
+              '/healthz', '/x/favicon.ico', '/docs/intro.html', '/docs/Intro.html', '/private', '' ]
+    
+    def expected(self, patterns, path):
+        return any(re.search(pattern, path) for pattern in patterns)
+    
+    def assertMatchesLikeSearch(self, patterns, paths):
+        matcher = OpenURLMatcher(patterns)
+        for path in paths:
+            self.assertEqual(matcher(path), self.expected(patterns, path), '%r with %r' % (path, patterns))
+    
+    def test_like_search(self):
+        self.assertMatchesLikeSearch(self.patterns, self.paths)
+    
+    def test_split(self):
+        matcher = OpenURLMatcher(self.patterns)
+        self.assertEqual(matcher.exact, set([ '/login' ]))
+        self.assertTrue(matcher.prefix_match('/api/v1.0/status/x'))
+        self.assertFalse(matcher.prefix_match('/api'))
+    
+    def test_inline_flags(self):
+        patterns = [ '(?i)^/Reports/', '^/docs/[a-z]+\\.html$' ]
+        self.assertMatchesLikeSearch(patterns, [ '/reports/x', '/REPORTS/x', '/docs/intro.html', '/docs/INTRO.HTML', '/DOCS/intro.html' ])
+        self.assertFalse(OpenURLMatcher(patterns)('/docs/INTRO.HTML')) # the flag does not apply to the other patterns
+    
+    def test_backreferences(self):
+        patterns = [ '^/(x)/', '^/(a|b)/\\1$' ]
+        self.assertMatchesLikeSearch(patterns, [ '/a/a', '/a/b', '/x/', '/x/x' ])
+    
+    def test_repeated_group_names(self):
+        patterns = [ '^/(?P<id>[0-9]+)$', '^/users/(?P<id>[0-9]+)$' ]
+        self.assertMatchesLikeSearch(patterns, [ '/12', '/users/12', '/users/x' ])
+    
+    def test_empty(self):
+        self.assertFalse(OpenURLMatcher(None)('/x'))
+        self.assertTrue(OpenURLMatcher([ '^/.*' ])('/x'))
+    
+@unittest.skipIf(SimpleAuth is None, 'requires barrel')
+class SimpleAuthTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.auth = SimpleAuth(None, logins=[ ('bob', 'secret'), ('eve', u'p\xe4ss') ], open_urls=[ '^/static/' ], decision_cache_size=2)
+    
+    def test_valid_user(self):
+        self.assertTrue(self.auth.valid_user('bob', 'secret'))
+        self.assertTrue(self.auth.valid_user('eve', u'p\xe4ss'))
+        self.assertFalse(self.auth.valid_user('bob', 'Secret'))
+        self.assertFalse(self.auth.valid_user('mallory', 'secret'))
+        self.assertFalse(self.auth.valid_user('bob', None))
+    
+    def test_decisions_cached(self):
+        self.assertTrue(self.auth.open_url('/static/x.js'))
+        self.assertFalse(self.auth.open_url('/private'))
+        self.assertEqual((self.auth.decisions.get('/static/x.js'), self.auth.decisions.get('/private')), (True, False))
+        self.auth.open_url('/other')
+        self.assertEqual(len(self.auth.decisions), 2) # bounded
+        self.assertFalse(self.auth.open_url('/private'))
+
+if __name__ == '__main__':
+    unittest.main()
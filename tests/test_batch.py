@@ -0,0 +1,125 @@
+'''
+Tests of :py:meth:`boots.endpoints.httpclient_ep.HTTPClientEndPoint.batch` - results in order, per request errors, quorums and
+deadlines (requests that are not needed any more are abandoned) - and of cancelling futures
+'''
+from boots.endpoints.http_async import AsyncHTTPEngine, Future, FutureCancelled
+from boots.endpoints.httpclient_ep import HTTPClientEndPoint, BatchIncomplete
+from tests.test_http_async import ScriptedServer, response
+import logging
+import time
+import unittest
+import urllib2
+
+class BatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = AsyncHTTPEngine(max_per_host=5)
+        cls.server = ScriptedServer({
+            '/a': [ response(body='a') ],
+            '/b': [ response(body='b') ],
+            '/json': [ response(body='{"x": 1}') ],
+            '/missing': [ response('404 Not Found', body='no') ],
+            '/hang': 'hang',
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        cls.engine.close()
+
+    def setUp(self):
+        self.endpoint = HTTPClientEndPoint(breaker=False)
+        self.endpoint.engine = self.engine
+        self.root = logging.getLogger()
+        self.level, self.root.level = self.root.level, logging.CRITICAL + 1
+
+    def tearDown(self):
+        self.root.level = self.level
+
+    def url(self, path):
+        return self.server.url + path
+
+    def wait_idle(self):
+        for _ in range(100):
+            if not self.engine.in_flight: break
+            time.sleep(0.02)
+        return self.engine.in_flight
+
+    def test_order_and_errors(self):
+        results = self.endpoint.batch([ dict(url=self.url('/b'), method='GET'), dict(url=self.url('/missing'), method='GET'),
+                                        dict(url=self.url('/json'), method='GET', json_out=True), dict(url=self.url('/a'), method='GET') ],
+                                      timeout=5)
+        self.assertEqual(results[0].read(), 'b')
+        self.assertIsInstance(results[1], urllib2.HTTPError)
+        self.assertEqual(results[1].code, 404)
+        self.assertEqual(results[2].data, { 'x': 1 })
+        self.assertEqual(results[3].read(), 'a')
+
+    def test_deadline_abandons(self):
+        start = time.time()
+        results = self.endpoint.batch([ dict(url=self.url('/a'), method='GET'), dict(url=self.url('/hang'), method='GET') ], deadline=0.5)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(results[0].read(), 'a')
+        self.assertIsInstance(results[1], urllib2.URLError) # timed out (the deadline caps the timeout) or BatchIncomplete
+        self.assertEqual(self.wait_idle(), 0)
+
+    def test_quorum_abandons(self):
+        results = self.endpoint.batch([ dict(url=self.url('/hang'), method='GET'), dict(url=self.url('/a'), method='GET'),
+                                        dict(url=self.url('/b'), method='GET') ], wait_for=2, timeout=5)
+        self.assertIsInstance(results[0], BatchIncomplete)
+        self.assertEqual([ r.read() for r in results[1:] ], [ 'a', 'b' ])
+        self.assertEqual(self.wait_idle(), 0)
+
+    def test_impossible_quorum(self):
+        results = self.endpoint.batch([ dict(url=self.url('/missing'), method='GET'), dict(url=self.url('/hang'), method='GET') ],
+                                      wait_for=2, timeout=5)
+        self.assertIsInstance(results[0], urllib2.HTTPError)
+        self.assertIsInstance(results[1], BatchIncomplete)
+        self.assertEqual(self.wait_idle(), 0)
+
+    def test_default_deadline(self):
+        self.endpoint.batch_deadline = 0.5
+        start = time.time()
+        results = self.endpoint.batch([ dict(url=self.url('/hang'), method='GET') ])
+        self.assertLess(time.time() - start, 2)
+        self.assertIsInstance(results[0], urllib2.URLError)
+
+    def test_timeout_without_deadline(self):
+        self.endpoint.batch_deadline = 0.01 # not applied - each request has a timeout
+        results = self.endpoint.batch([ dict(url=self.url('/a'), method='GET') ], timeout=5)
+        self.assertEqual(results[0].read(), 'a')
+
+class CancelTest(unittest.TestCase):
+
+    def test_cancel(self):
+        future = Future()
+        cancelled = []
+        future.on_cancel(lambda: cancelled.append(True))
+        self.assertTrue(future.cancel())
+        self.assertTrue(future.cancelled())
+        self.assertIsInstance(future.exception(), FutureCancelled)
+        self.assertEqual(cancelled, [ True ])
+
+    def test_cancel_done(self):
+        future = Future()
+        future.set_result(1)
+        self.assertFalse(future.cancel())
+        self.assertEqual(future.result(), 1)
+
+    def test_cancel_transformed(self):
+        future = Future()
+        transformed = future.transform(lambda result: result * 2)
+        transformed.cancel()
+        self.assertTrue(future.cancelled())
+
+    def test_not_cancelled_by_error(self):
+        future = Future()
+        cancelled = []
+        future.on_cancel(lambda: cancelled.append(True))
+        future.set_exception(ValueError('failed'))
+        self.assertFalse(future.cancelled())
+        self.assertEqual(cancelled, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+'''
+Tests of :py:class:`boots.endpoints.http_ep.Coalesce` - identical concurrent requests share the leader's response (or exception)
+'''
+from boots.endpoints.http_ep import Coalesce
+from threading import Event, Thread
+import bottle
+import time
+import unittest
+
+class Handlers(object):
+    response = bottle.response
+    
+    def __init__(self):
+        self.calls = []
+        self.release = Event()
+    
+    def report(self, name=None):
+        self.calls.append(name)
+        self.release.wait(5)
+        bottle.response.headers['X-Report'] = name
+        bottle.response.content_type = 'application/json'
+        origin = bottle.request.environ.get('HTTP_ORIGIN')
+        if origin:
+            bottle.response.headers['Access-Control-Allow-Origin'] = origin # as CrossOriginPlugin does
+        return dict(name=name, call=len(self.calls))
+    
+    def fail(self, name=None):
+        self.calls.append(name)
+        self.release.wait(5)
+        raise ValueError('failed %s' % (name, ))
+    
+    def login(self, name=None):
+        self.calls.append(name)
+        self.release.wait(5)
+        bottle.response.set_cookie('session', name)
+        return 'welcome %s' % (name, )
+
+class CoalesceTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.handlers = Handlers()
+        self.plugin = Coalesce(timeout=5)
+        self.stats = Coalesce.coalesce_stats()
+    
+    def route(self, callback, method='GET', **config):
+        return self.plugin.apply(callback, dict(config=config, method=method, rule='/report', skip=[]))
+    
+    def delta(self):
+        stats = Coalesce.coalesce_stats()
+        return dict((key, stats[key] - self.stats[key]) for key in stats)
+    
+    def concurrently(self, wrapper, requests):
+        ''' invokes wrapper with each of the requests (kargs, environ) in a thread of its own. returns the outcomes in order '''
+        outcomes = [ None ] * len(requests)
+        def run(i, kargs, environ):
+            bottle.request.bind(dict(environ, REQUEST_METHOD='GET', PATH_INFO='/report'))
+            bottle.response.bind()
+            try:
+                headers = bottle.response.headers
+                outcomes[i] = ('result', wrapper(**kargs), bottle.response.status_code, headers.get('Content-Type'),
+                               headers.get('X-Report'), headers.get('Access-Control-Allow-Origin'))
+            except Exception as e:
+                outcomes[i] = ('error', e)
+        threads = [ Thread(target=run, args=(i, kargs, environ)) for i, (kargs, environ) in enumerate(requests) ]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while len(self.handlers.calls) < 1 and time.time() < deadline: # the leader is in progress
+            time.sleep(0.005)
+        time.sleep(0.1) # let the others reach the flight
+        self.handlers.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+    
+    def test_collapsed(self):
+        outcomes = self.concurrently(self.route(self.handlers.report), [ (dict(name='daily'), {}) ] * 5)
+        self.assertEqual(self.handlers.calls, [ 'daily' ])
+        self.assertEqual(set(outcomes[i][1]['call'] for i in range(5)), set([ 1 ]))
+        self.assertEqual([ outcome[3] for outcome in outcomes ], [ 'application/json' ] * 5) # the leader's content type is shared
+        self.assertEqual(sorted(outcome[4] for outcome in outcomes), [ None ] * 4 + [ 'daily' ]) # its other headers are not
+        self.assertEqual(self.delta(), dict(leaders=1, collapsed=4))
+    
+    def test_origins(self):
+        requests = [ (dict(name='daily'), dict(HTTP_ORIGIN='https://a.example')) ] * 2 + \
+                   [ (dict(name='daily'), dict(HTTP_ORIGIN='https://b.example')) ] * 2
+        outcomes = self.concurrently(self.route(self.handlers.report), requests)
+        self.assertEqual(self.handlers.calls, [ 'daily' ] * 2) # a leader for each origin
+        self.assertEqual([ outcome[5] for outcome in outcomes ], [ 'https://a.example' ] * 2 + [ 'https://b.example' ] * 2)
+        self.assertEqual(self.delta(), dict(leaders=2, collapsed=2))
+    
+    def test_different_keys(self):
+        requests = [ (dict(name='daily'), {}), (dict(name='weekly'), {}), (dict(name='daily'), dict(REMOTE_USER='bob')) ]
+        self.concurrently(self.route(self.handlers.report), requests)
+        self.assertEqual(sorted(self.handlers.calls), [ 'daily', 'daily', 'weekly' ])
+        self.assertEqual(self.delta(), dict(leaders=3, collapsed=0))
+    
+    def test_error_shared(self):
+        outcomes = self.concurrently(self.route(self.handlers.fail), [ (dict(name='daily'), {}) ] * 3)
+        self.assertEqual(self.handlers.calls, [ 'daily' ])
+        errors = [ outcome[1] for outcome in outcomes ]
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+        self.assertTrue(all(error is errors[0] for error in errors)) # the leader's exception is re-raised
+        self.assertEqual(self.delta(), dict(leaders=1, collapsed=0))
+    
+    def test_cookies_not_shared(self):
+        outcomes = self.concurrently(self.route(self.handlers.login), [ (dict(name='bob'), {}) ] * 3)
+        self.assertEqual(self.handlers.calls, [ 'bob' ] * 3) # the followers invoked the route themselves
+        self.assertEqual([ outcome[1] for outcome in outcomes ], [ 'welcome bob' ] * 3)
+        self.assertEqual(self.delta(), dict(leaders=1, collapsed=0))
+    
+    def test_sequential(self):
+        self.handlers.release.set()
+        wrapper = self.route(self.handlers.report)
+        for _ in range(2):
+            bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'PATH_INFO': '/report' })
+            bottle.response.bind()
+            wrapper(name='daily')
+        self.assertEqual(len(self.handlers.calls), 2)
+        self.assertEqual(self.plugin.flights, {})
+    
+    def test_not_applied(self):
+        callback = self.handlers.report
+        self.assertIs(self.route(callback, method='POST'), callback)
+        self.assertIs(self.route(callback, coalesce=False), callback)
+
+if __name__ == '__main__':
+    unittest.main()
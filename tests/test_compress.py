@@ -0,0 +1,115 @@
+'''
+Tests of :py:class:`boots.endpoints.http_ep.Compress` - Accept-Encoding negotiation, the thresholds and the cache of
+compressed bodies
+'''
+from boots.endpoints.http_ep import Compress
+import bottle
+import gzip
+import json
+import StringIO
+import unittest
+import zlib
+
+def gunzip(body):
+    return gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+
+class Handlers(object):
+    def __init__(self, result):
+        self.result = result
+    
+    def get(self):
+        return self.result
+
+class CompressTest(unittest.TestCase):
+    
+    body = 'the quick brown fox jumps over the lazy dog. ' * 100
+    
+    def setUp(self):
+        self.compress = Compress(min_size=1024)
+    
+    def respond(self, result, accept='gzip, deflate', method='GET', content_type='text/plain', plugin=None, **headers):
+        bottle.request.bind({ 'REQUEST_METHOD': method, 'HTTP_ACCEPT_ENCODING': accept })
+        bottle.response.bind()
+        bottle.response.content_type = content_type
+        for key, value in headers.iteritems():
+            bottle.response.headers[key] = value
+        wrapper = (plugin or self.compress).apply(Handlers(result).get, dict(config={}, method=method, skip=[], rule='/'))
+        return wrapper()
+    
+    def test_gzip(self):
+        body = self.respond(self.body)
+        self.assertEqual(bottle.response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(bottle.response.headers['Content-Length'], str(len(body)))
+        self.assertEqual(bottle.response.headers['Vary'], 'Accept-Encoding')
+        self.assertLess(len(body), len(self.body))
+        self.assertEqual(gunzip(body), self.body)
+    
+    def test_deflate(self):
+        body = self.respond(self.body, accept='deflate')
+        self.assertEqual(bottle.response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(body), self.body)
+    
+    def test_quality(self):
+        body = self.respond(self.body, accept='gzip;q=0, deflate;q=0.5')
+        self.assertEqual(bottle.response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(body), self.body)
+        self.assertEqual(self.respond(self.body, accept='*;q=0'), self.body)
+        self.assertEqual(gunzip(self.respond(self.body, accept='*')), self.body)
+    
+    def test_not_accepted(self):
+        self.assertEqual(self.respond(self.body, accept=''), self.body)
+        self.assertNotIn('Content-Encoding', bottle.response.headers)
+        self.assertEqual(self.respond(self.body, accept='br, identity'), self.body)
+        self.assertNotIn('Content-Encoding', bottle.response.headers)
+        self.assertEqual(bottle.response.headers['Vary'], 'Accept-Encoding')
+    
+    def test_small(self):
+        self.assertEqual(self.respond('small'), 'small')
+        self.assertNotIn('Content-Encoding', bottle.response.headers)
+        self.assertNotIn('Vary', bottle.response.headers)
+    
+    def test_content_type(self):
+        self.assertEqual(self.respond(self.body, content_type='image/png'), self.body)
+        self.assertNotIn('Content-Encoding', bottle.response.headers)
+        self.assertEqual(gunzip(self.respond(self.body, content_type='application/json')), self.body)
+    
+    def test_already_encoded(self):
+        self.assertEqual(self.respond(self.body, **{ 'Content-Encoding': 'br' }), self.body)
+        self.assertEqual(bottle.response.headers['Content-Encoding'], 'br')
+    
+    def test_head(self):
+        self.assertEqual(self.respond(self.body, method='HEAD'), self.body)
+        self.assertNotIn('Content-Encoding', bottle.response.headers)
+    
+    def test_dict(self):
+        result = dict(rows=[ self.body ])
+        body = self.respond(result)
+        self.assertEqual(bottle.response.content_type, 'application/json')
+        self.assertEqual(json.loads(gunzip(body)), result)
+    
+    def test_unicode(self):
+        text = u'\u20ac' * 2000
+        body = self.respond(text)
+        self.assertEqual(gunzip(body).decode('utf-8'), text)
+    
+    def test_cache(self):
+        first = self.respond(self.body, ETag='"v1"')
+        self.assertIs(self.respond(self.body, ETag='"v1"'), first)
+        self.assertIsNot(self.respond(self.body, accept='deflate', ETag='"v1"'), first)
+        self.assertIs(self.respond(self.body), self.respond(self.body)) # keyed by a digest of the body without an ETag
+        self.assertEqual(len(self.compress.cache), 3)
+    
+    def test_no_cache(self):
+        compress = Compress(cache_size=0)
+        self.assertIsNone(compress.cache)
+        self.assertEqual(gunzip(self.respond(self.body, plugin=compress)), self.body)
+    
+    def test_phases(self):
+        bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip' })
+        bottle.response.bind()
+        bottle.response.content_type = 'text/plain'
+        phases = self.compress.phases(None, {})
+        self.assertEqual(gunzip(phases.after(None, self.body, {})), self.body)
+
+if __name__ == '__main__':
+    unittest.main()
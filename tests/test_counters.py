@@ -0,0 +1,102 @@
+'''
+Tests of the counter primitives and the LRU cache of :py:mod:`boots.common.utils`
+'''
+from boots.common.utils import new_counter, ShardedCounter, Gauge, Accumulator, LRUCache
+import gc
+import threading
+import time
+import unittest
+
+def in_threads(fn, count=4):
+    threads = [ threading.Thread(target=fn) for _ in range(count) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    gc.collect()
+
+def retired(counter, shards=2, timeout=2):
+    ''' waits for the shards of exited threads to be retired (a thread's local storage is released just after it is joined) '''
+    deadline = time.time() + timeout
+    while len(counter._cells) > shards and time.time() < deadline:
+        time.sleep(0.01)
+    return len(counter._cells)
+
+class CountersTest(unittest.TestCase):
+    
+    def test_new_counter(self):
+        counter = new_counter(10)
+        self.assertEqual([ counter(), counter(), counter() ], [ 10, 11, 12 ])
+    
+    def test_sharded_counter(self):
+        hits = ShardedCounter()
+        hits.increment()
+        hits.increment(5)
+        hits.decrement(2)
+        self.assertEqual(hits.value(), 4)
+        self.assertEqual(hits(), 4)
+    
+    def test_sharded_counter_across_threads(self):
+        hits = ShardedCounter(initial=3)
+        def work():
+            for _ in range(1000): hits.increment()
+        in_threads(work, 8)
+        self.assertEqual(hits.value(), 8003)
+    
+    def test_shards_of_exited_threads_are_retired(self):
+        hits = ShardedCounter()
+        hits.increment() # this thread's shard
+        for _ in range(20):
+            in_threads(lambda: hits.increment(2), 5)
+        self.assertEqual(hits.value(), 201)
+        self.assertEqual(retired(hits), 2) # the retired shard and this thread's
+        self.assertEqual(len(hits._owners), 1)
+    
+    def test_reset(self):
+        hits = ShardedCounter()
+        in_threads(lambda: hits.increment(3))
+        hits.increment(2)
+        hits.reset(7)
+        self.assertEqual(hits.value(), 7)
+        hits.increment()
+        self.assertEqual(hits.value(), 8)
+    
+    def test_gauge(self):
+        gauge = Gauge()
+        gauge.increment(3)
+        gauge.decrement()
+        self.assertEqual(gauge.value(), 2)
+        gauge.set(10)
+        self.assertEqual(gauge.value(), 10)
+    
+    def test_accumulator(self):
+        timings = Accumulator()
+        timings.add(0.5)
+        in_threads(lambda: timings.add(2.0), 2)
+        in_threads(lambda: timings.add(0.25), 1)
+        self.assertEqual(timings.value(), { 'count': 4, 'total': 4.75, 'min': 0.25, 'max': 2.0 })
+        self.assertEqual(retired(timings), 2)
+        self.assertRaises(TypeError, timings.decrement)
+        timings.reset()
+        self.assertEqual(timings.value(), { 'count': 0, 'total': 0, 'min': None, 'max': None })
+
+class LRUCacheTest(unittest.TestCase):
+    
+    def test_discards_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+    
+    def test_pop_and_clear(self):
+        cache = LRUCache(4)
+        cache.put('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a', 'gone'), 'gone')
+        cache.put('b', 2)
+        cache.clear()
+        self.assertEqual(cache.get('b', 'none'), 'none')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+'''
+Tests of :py:class:`boots.common.histogram.LatencyHistogram` - bucketing, percentiles (within the relative error), merging and
+the cumulative counts of exported (Prometheus) buckets
+'''
+from boots.common.histogram import LatencyHistogram
+import random
+import unittest
+
+BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def exact_cumulative(values, bounds):
+    return [ len([ v for v in values if v <= bound ]) for bound in bounds ]
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_buckets(self):
+        h = LatencyHistogram()
+        for units in [ 0, 1, 31, 32, 33, 1000, 12345, 10 ** 9, 2 ** 45 ]:
+            low, high = h.bounds(h.index(units))
+            if units < 2 ** h.max_bits:
+                self.assertTrue(low <= units <= high, units)
+                self.assertLessEqual(high - low + 1, max(1, units / (h.half - 1)), units) # the relative width of a bucket
+            else:
+                self.assertEqual(h.index(units), len(h.counts) - 1) # counted in the last bucket
+        for index in range(1, len(h.counts)): # the buckets are contiguous
+            self.assertEqual(h.bounds(index)[0], h.bounds(index - 1)[1] + 1)
+
+    def test_percentiles(self):
+        rng = random.Random(7)
+        values = sorted(rng.expovariate(1 / 0.05) for _ in xrange(20000))
+        h = LatencyHistogram()
+        for value in values:
+            h.record(value)
+        self.assertEqual(h.total, len(values))
+        percentiles = h.percentiles()
+        for key, fraction in h.reported:
+            expected = values[int(fraction * len(values)) - 1]
+            self.assertAlmostEqual(percentiles[key] / expected, 1, delta=0.04, msg=key)
+
+    def test_percentile_small(self):
+        h = LatencyHistogram()
+        self.assertIsNone(h.percentile(0.5))
+        self.assertEqual(h.percentiles(), dict(p50=None, p90=None, p99=None, p999=None))
+        for value in (0.001, 0.002, 0.003, 0.004):
+            h.record(value)
+        self.assertAlmostEqual(h.percentile(0.5), 0.002, delta=0.0001)
+        self.assertAlmostEqual(h.percentile(1.0), 0.004, delta=0.0002)
+
+    def test_merge(self):
+        a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for i, value in enumerate(random.Random(1).uniform(0, 2) for _ in xrange(1000)):
+            (a if i % 2 else b).record(value)
+            both.record(value)
+        a.merge(b)
+        self.assertEqual((list(a.counts), a.total), (list(both.counts), both.total))
+        with self.assertRaises(ValueError):
+            a.merge(LatencyHistogram(sub_bucket_bits=4))
+        with self.assertRaises(ValueError):
+            a.merge(LatencyHistogram(bounds=BOUNDS))
+
+    def test_clear(self):
+        h = LatencyHistogram(bounds=BOUNDS)
+        h.record(0.2)
+        h.clear()
+        self.assertEqual((h.total, sum(h.counts), h.cumulative(BOUNDS)), (0, 0, [ 0 ] * len(BOUNDS)))
+
+    def test_cumulative_exact(self):
+        values = [ 0.005, 0.0051, 0.0099, 0.01, 0.0249, 0.1, 0.1001, 0.99, 1.0, 1.5, 30 ] + \
+                 [ random.Random(3).uniform(0, 1.2) for _ in xrange(1000) ]
+        a, b = LatencyHistogram(bounds=BOUNDS), LatencyHistogram(bounds=BOUNDS)
+        for i, value in enumerate(values):
+            (a if i % 2 else b).record(value)
+        a.merge(b)
+        self.assertEqual(a.cumulative(BOUNDS), exact_cumulative(values, BOUNDS))
+
+    def test_cumulative_never_overcounts(self):
+        # values just above the bounds share a log-linear bucket with values at them
+        values = [ bound * 1.001 for bound in BOUNDS ] + [ random.Random(5).uniform(0, 1.2) for _ in xrange(1000) ]
+        h = LatencyHistogram()
+        for value in values:
+            h.record(value)
+        estimated, exact = h.cumulative(BOUNDS), exact_cumulative(values, BOUNDS)
+        for bound, count, expected in zip(BOUNDS, estimated, exact):
+            self.assertLessEqual(count, expected, bound)
+            self.assertGreaterEqual(count, expected * 0.9, bound)
+        self.assertEqual(h.cumulative([ 100 ]), [ len(values) ])
+
+if __name__ == '__main__':
+    unittest.main()
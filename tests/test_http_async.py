@@ -0,0 +1,238 @@
+'''
+Tests of :py:class:`boots.endpoints.http_async.AsyncHTTPEngine` - responses (including chunked ones), redirects, timeouts, retries,
+address fallback and errors - against a scripted server
+'''
+from boots.common.resolver import Resolver
+from boots.endpoints.http_async import AsyncHTTPEngine, Future, FutureTimeout
+import logging
+import socket
+import threading
+import time
+import unittest
+import urllib2
+
+def response(status='200 OK', body='', headers=()):
+    head = [ 'HTTP/1.1 %s' % status ] + [ '%s: %s' % header for header in headers ]
+    if not [ name for name, _ in headers if name.lower() in [ 'content-length', 'transfer-encoding' ] ]:
+        head.append('Content-Length: %d' % len(body))
+    return '\r\n'.join(head) + '\r\n\r\n' + body
+
+class ScriptedServer(object):
+    '''
+    a keep-alive server whose responses are scripted by path. A script is a list of strings (sent in turn, with a pause in between)
+    and numbers (further pauses in seconds), None (to close the connection without responding) or 'hang' (to never respond)
+    '''
+    
+    def __init__(self, scripts):
+        self.scripts = scripts
+        self.requests = [] # (path, connection number)
+        self.connections = 0
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(50)
+        self.port = self.listener.getsockname()[1]
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.start(self.accept)
+    
+    def start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+    
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            self.start(self.serve, conn, self.connections)
+    
+    def serve(self, conn, number):
+        data = ''
+        try:
+            while True:
+                while '\r\n\r\n' not in data:
+                    received = conn.recv(4096)
+                    if not received: return
+                    data += received
+                head, data = data.split('\r\n\r\n', 1)
+                path = head.split(' ')[1]
+                self.requests.append((path, number))
+                script = self.scripts[path]
+                script = script(number) if callable(script) else script
+                if script is None: return
+                if script == 'hang':
+                    time.sleep(5)
+                    return
+                for i, part in enumerate(script):
+                    if isinstance(part, (int, float)):
+                        time.sleep(part)
+                        continue
+                    if i: time.sleep(0.05)
+                    conn.sendall(part)
+        finally:
+            conn.close()
+    
+    def close(self):
+        self.listener.close()
+
+class AsyncHTTPEngineTest(unittest.TestCase):
+    
+    chunked = response(headers=[ ('Transfer-Encoding', 'chunked') ])
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = AsyncHTTPEngine(max_per_host=5)
+        cls.server = ScriptedServer({
+            '/hello': [ response(body='hello') ],
+            '/split': [ response(body='hello world')[:-6], ' world' ],
+            # chunk data that looks like the last chunk, split where the old check would have completed the response
+            '/chunked': [ cls.chunked + 'a\r\nabc\r\n0\r\n\r\n', '\r\n5\r\nhello\r\n0\r\n\r\n' ],
+            '/trailers': [ cls.chunked + '3;ext=1\r\nabc\r', '\n0\r\nX-Checksum: 1\r\n', '\r\n' ],
+            '/bad-chunk': [ cls.chunked + 'zz\r\nabc\r\n0\r\n\r\n' ],
+            '/old': [ response('302 Found', headers=[ ('Location', '/hello') ]) ],
+            '/missing': [ response('404 Not Found', body='no') ],
+            '/hang': 'hang',
+            # closes a connection (without responding) when it is reused
+            '/close-reused': lambda number: None if len([ n for _, n in cls.server.requests if n == number ]) > 1 else [ response(body='again') ],
+        })
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        cls.engine.close()
+    
+    def setUp(self):
+        self.engine.close() # no idle connections from other tests
+        self.counters = dict(self.engine.stats())
+        self.root = logging.getLogger()
+        self.level, self.root.level = self.root.level, logging.CRITICAL + 1
+    
+    def tearDown(self):
+        self.root.level = self.level
+    
+    def get(self, path, timeout=5):
+        return self.engine.submit(urllib2.Request(self.server.url + path), timeout=timeout).result(10)
+    
+    def delta(self, name):
+        return self.engine.stats()[name] - self.counters[name]
+    
+    def test_content_length(self):
+        response = self.get('/split')
+        self.assertEqual((response.code, response.read()), (200, 'hello world'))
+        self.assertEqual(response.info()['Content-Length'], '11')
+    
+    def test_chunked(self):
+        self.assertEqual(self.get('/chunked').read(), 'abc\r\n0\r\n\r\nhello')
+    
+    def test_trailers(self):
+        self.assertEqual(self.get('/trailers').read(), 'abc')
+        self.assertEqual(self.get('/hello').read(), 'hello')
+        self.assertEqual(self.delta('reused'), 1) # the connection was reused after the trailers
+    
+    def test_bad_chunk(self):
+        with self.assertRaises(urllib2.URLError) as error:
+            self.get('/bad-chunk')
+        self.assertIsInstance(error.exception.reason, ValueError)
+    
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self.get('/hello').read(), 'hello')
+        self.assertEqual((self.delta('created'), self.delta('reused')), (1, 2))
+    
+    def test_redirect(self):
+        submitted = []
+        submit = self.engine.submit
+        def recording(req, **kargs):
+            submitted.append((req.get_full_url(), threading.current_thread().name))
+            return submit(req, **kargs)
+        self.engine.submit = recording
+        try:
+            response = self.engine.submit(urllib2.Request(self.server.url + '/old'), timeout=5).result(10)
+        finally:
+            del self.engine.submit
+        self.assertEqual((response.code, response.read(), response.geturl()), (200, 'hello', self.server.url + '/hello'))
+        self.assertEqual([ url for url, _ in submitted ], [ self.server.url + '/old', self.server.url + '/hello' ])
+        self.assertNotEqual(submitted[1][1], 'AsyncHTTPEngine') # the redirect is not resolved on the engine's thread
+    
+    def test_http_error(self):
+        with self.assertRaises(urllib2.HTTPError) as error:
+            self.get('/missing')
+        self.assertEqual((error.exception.code, error.exception.read()), (404, 'no'))
+    
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(urllib2.URLError) as error:
+            self.get('/hang', timeout=0.2)
+        self.assertIsInstance(error.exception.reason, socket.timeout)
+        self.assertLess(time.time() - start, 2)
+    
+    def test_timeout_not_retried(self):
+        self.get('/hello')
+        requests = len(self.server.requests)
+        with self.assertRaises(urllib2.URLError):
+            self.get('/hang', timeout=0.2) # on the reused connection
+        self.assertEqual(self.delta('reused'), 1)
+        self.assertEqual(self.delta('retried'), 0)
+        self.assertEqual([ path for path, _ in self.server.requests[requests:] ], [ '/hang' ])
+    
+    def test_retried_when_closed(self):
+        self.get('/hello')
+        self.assertEqual(self.get('/close-reused').read(), 'again') # the server closes the reused connection
+        self.assertEqual(self.delta('retried'), 1)
+    
+    def test_next_address(self):
+        unused = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        unused.bind(('127.0.0.1', 0))
+        refused = unused.getsockname()
+        unused.close()
+        addresses = [ (socket.AF_INET, socket.SOCK_STREAM, 6, '', refused), (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', self.server.port)) ]
+        getaddrinfo = Resolver.__dict__['getaddrinfo']
+        Resolver.getaddrinfo = staticmethod(lambda host, port, family=0, socktype=0: list(addresses))
+        try:
+            self.assertEqual(self.engine.submit(urllib2.Request('http://example.test:%d/hello' % self.server.port), timeout=5).result(10).read(), 'hello')
+            addresses.pop()
+            self.engine.close()
+            with self.assertRaises(urllib2.URLError):
+                self.engine.submit(urllib2.Request('http://example.test:%d/hello' % self.server.port), timeout=5).result(10)
+        finally:
+            Resolver.getaddrinfo = getaddrinfo
+    
+    def test_survives_poll_errors(self):
+        poll = self.engine._poll
+        failures = []
+        def failing(timeout):
+            if not failures:
+                failures.append(timeout)
+                raise IOError('poll failed')
+            return poll(timeout)
+        self.engine._poll = failing
+        try:
+            self.engine.submit(urllib2.Request(self.server.url + '/hello'), timeout=5) # wakes the engine
+            self.assertEqual(self.get('/hello').read(), 'hello')
+        finally:
+            del self.engine._poll
+        self.assertEqual(len(failures), 1)
+
+class FutureTest(unittest.TestCase):
+    
+    def test_callbacks(self):
+        future, called = Future(), []
+        future.add_done_callback(lambda f: called.append(f.result()))
+        self.assertRaises(FutureTimeout, future.result, 0.01)
+        future.set_result(1)
+        future.set_result(2) # ignored
+        future.add_done_callback(lambda f: called.append(-f.result()))
+        self.assertEqual(called, [ 1, -1 ])
+    
+    def test_transform(self):
+        future = Future()
+        doubled = future.transform(lambda x: x * 2)
+        failed = future.transform(lambda x: 1 / 0)
+        future.set_result(2)
+        self.assertEqual(doubled.result(), 4)
+        self.assertIsInstance(failed.exception(), ZeroDivisionError)
+
+if __name__ == '__main__':
+    unittest.main()
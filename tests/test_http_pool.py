@@ -0,0 +1,117 @@
+'''
+Tests of :py:class:`boots.endpoints.http_pool.ConnectionPool` - reuse, limits, expiry and health of pooled connections
+'''
+from boots.endpoints.http_pool import ConnectionPool, split_timeout
+from boots.servers.helpers.serving import PooledWSGIServer
+import threading
+import time
+import unittest
+import urllib2
+
+def app(environ, start_response):
+    body = 'x' * int(environ.get('QUERY_STRING') or 10)
+    start_response('200 OK', [ ('Content-Type', 'text/plain'), ('Content-Length', str(len(body))) ])
+    return [ body ]
+
+class ConnectionPoolTest(unittest.TestCase):
+    
+    keepalive = 5
+    
+    def setUp(self):
+        self.server = PooledWSGIServer(('127.0.0.1', 0), app, threads=4, keepalive=self.keepalive)
+        thread = threading.Thread(target=self.server.serve_forever, kwargs=dict(poll_interval=0.05))
+        thread.daemon = True
+        thread.start()
+        self.pool = ConnectionPool(max_per_host=2, idle_timeout=30)
+        self.opener = urllib2.build_opener(*self.pool.handlers())
+        self.url = 'http://127.0.0.1:%s/' % self.server.server_address[1]
+    
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop(5)
+    
+    def get(self, query='', read=True):
+        response = self.opener.open(self.url + ('?' + query if query else ''), timeout=5)
+        return response.read() if read else response
+    
+    def counters(self, *names):
+        stats = self.pool.stats()
+        return tuple(stats[name] for name in names)
+    
+    def test_reused(self):
+        self.assertEqual(self.get(), 'x' * 10)
+        self.assertEqual(self.get('100000'), 'x' * 100000)
+        self.assertEqual(self.get(), 'x' * 10)
+        self.assertEqual(self.counters('created', 'reused', 'released'), (1, 2, 3))
+        self.assertEqual(self.pool.stats()['idle'], { 'http://127.0.0.1:%s' % self.server.server_address[1]: 1 })
+    
+    def idle_timeout_of(self):
+        ''' the timeout of the socket of the idle connection '''
+        (conns,) = self.pool.idle.values()
+        return conns[-1][0].sock.gettimeout()
+    
+    def test_reused_timeout(self):
+        self.opener.open(self.url, timeout=0.25).read()
+        self.opener.open(self.url).read() # no timeout
+        self.assertEqual(self.counters('created', 'reused'), (1, 1))
+        self.assertIsNone(self.idle_timeout_of())
+        self.opener.open(self.url, timeout=2).read()
+        self.assertEqual(self.idle_timeout_of(), 2)
+    
+    def test_read_timeout_restored(self):
+        request = urllib2.Request(self.url)
+        request.read_timeout = 0.25
+        self.opener.open(request, timeout=5).read()
+        self.assertEqual(self.idle_timeout_of(), 5) # the connect timeout, not the read timeout
+        self.opener.open(self.url).read() # reused, without a timeout
+        self.assertEqual(self.counters('created', 'reused'), (1, 1))
+        self.assertIsNone(self.idle_timeout_of())
+    
+    def test_max_per_host(self):
+        responses = [ self.get(read=False) for _ in range(3) ] # concurrently in use
+        for response in responses:
+            response.read()
+        self.assertEqual(self.counters('created', 'released', 'discarded'), (3, 2, 1))
+        self.get()
+        self.assertEqual(self.counters('created', 'reused'), (3, 1))
+    
+    def test_idle_timeout(self):
+        self.pool.configure(idle_timeout=0.05)
+        self.get()
+        time.sleep(0.1)
+        self.get()
+        self.assertEqual(self.counters('created', 'reused', 'discarded'), (2, 0, 1))
+    
+    def test_unread_response_closes_connection(self):
+        response = self.get('100000', read=False)
+        response.read(10)
+        response.close()
+        self.assertEqual(self.counters('released', 'discarded'), (0, 1))
+        self.assertEqual(self.pool.stats()['idle'], {})
+    
+    def test_connection_refused(self):
+        self.server.stop(5)
+        self.assertRaises(urllib2.URLError, self.get)
+
+class ServerClosesTest(ConnectionPoolTest):
+    ''' the server closes idle connections (before the pool's idle_timeout) '''
+    
+    keepalive = 0.1
+    
+    def test_stale(self):
+        self.get()
+        time.sleep(0.3) # closed by the server
+        self.assertEqual(self.get(), 'x' * 10)
+        self.assertEqual(self.counters('created', 'reused', 'discarded'), (2, 0, 1)) # not reused as it is not healthy
+    
+    test_reused = test_reused_timeout = test_read_timeout_restored = test_max_per_host = None
+
+class SplitTimeoutTest(unittest.TestCase):
+    
+    def test_split(self):
+        self.assertEqual(split_timeout(None), (None, None))
+        self.assertEqual(split_timeout(2), (2.0, 2.0))
+        self.assertEqual(split_timeout((1, None)), (1.0, None))
+
+if __name__ == '__main__':
+    unittest.main()
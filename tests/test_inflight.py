@@ -0,0 +1,130 @@
+'''
+Tests of :py:class:`boots.common.inflight.InFlight` and the drain of a :py:class:`boots.servers.server.Server` on SIGTERM
+'''
+from boots.common.inflight import InFlight
+from boots.servers.server import Server
+import os
+import signal
+import threading
+import time
+import unittest
+
+class InFlightTest(unittest.TestCase):
+    
+    def setUp(self):
+        InFlight.resume()
+        InFlight.counts.clear()
+        InFlight.last_drain = None
+    
+    tearDown = setUp
+    
+    def test_enter_exit(self):
+        self.assertTrue(InFlight.enter('http'))
+        self.assertTrue(InFlight.enter('zmq'))
+        self.assertEqual((InFlight.in_flight('http'), InFlight.in_flight()), (1, 2))
+        InFlight.exit('http')
+        self.assertEqual((InFlight.in_flight('http'), InFlight.in_flight()), (0, 1))
+    
+    def test_lock_free(self):
+        class CountingLock(object):
+            acquired = 0
+            def __enter__(self):
+                CountingLock.acquired += 1
+            def __exit__(self, *args):
+                pass
+        lock, InFlight.lock = InFlight.lock, CountingLock()
+        try:
+            for _ in range(100):
+                InFlight.enter('http')
+                InFlight.exit('http')
+        finally:
+            InFlight.lock = lock
+        self.assertEqual(CountingLock.acquired, 1) # only to add the kind
+    
+    def test_concurrent(self):
+        def run():
+            for _ in xrange(1000):
+                InFlight.enter('http')
+                InFlight.enter('http')
+                InFlight.exit('http')
+        threads = [ threading.Thread(target=run) for _ in range(8) ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(InFlight.in_flight('http'), 8000)
+        self.assertEqual(InFlight.stats()['in_flight'], { 'http': 8000 })
+    
+    def test_drain_completes(self):
+        InFlight.enter('http')
+        threading.Timer(0.1, InFlight.exit, args=('http', )).start()
+        report = InFlight.drain(timeout=5, poll=0.01)
+        self.assertEqual((report['pending'], report['completed'], report['dropped']), (1, 1, {}))
+        self.assertGreaterEqual(report['duration'], 0.05)
+        self.assertLess(report['duration'], 5)
+        self.assertIs(InFlight.last_drain, report)
+    
+    def test_drain_timeout(self):
+        InFlight.enter('zmq')
+        InFlight.enter('zmq')
+        report = InFlight.drain(timeout=0.1, poll=0.01)
+        self.assertEqual((report['pending'], report['completed'], report['dropped']), (2, 0, { 'zmq': 2 }))
+        self.assertIs(InFlight.drain(timeout=0)['pending'], 2)
+    
+    def test_refused_while_draining(self):
+        InFlight.drain(timeout=0)
+        self.assertFalse(InFlight.enter('http'))
+        self.assertEqual(InFlight.in_flight(), 0)
+        InFlight.admit('zmq') # already accepted work is still counted
+        self.assertEqual(InFlight.in_flight('zmq'), 1)
+        stats = InFlight.stats()
+        self.assertEqual((stats['draining'], stats['refused'], stats['in_flight']), (True, { 'http': 1 }, { 'zmq': 1 }))
+        InFlight.resume()
+        self.assertTrue(InFlight.enter('http'))
+    
+    def test_last_drain_kept(self):
+        InFlight.enter('http')
+        threading.Timer(0.05, InFlight.exit, args=('http', )).start()
+        report = InFlight.drain(timeout=5, poll=0.01)
+        InFlight.drain(timeout=0) # e.g. from stop_server after a drain on SIGTERM
+        self.assertIs(InFlight.last_drain, report)
+
+class SigtermTest(unittest.TestCase):
+    
+    def setUp(self):
+        InFlight.resume()
+        InFlight.counts.clear()
+        self.previous = signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.server = Server.__new__(Server)
+        self.server.name = 'tests.inflight'
+        self.server.drain_timeout = 5
+    
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, self.previous)
+        InFlight.resume()
+        InFlight.counts.clear()
+    
+    def test_drains_while_serving(self):
+        self.assertTrue(self.server.handle_sigterm())
+        InFlight.enter('http')
+        done = []
+        def request(): # completes after the SIGTERM
+            time.sleep(0.2)
+            done.append(InFlight.enter('http')) # a new request is refused while draining
+            InFlight.exit('http')
+        threading.Thread(target=request).start()
+        start = time.time()
+        with self.assertRaises(KeyboardInterrupt): # stops the main server (once drained)
+            os.kill(os.getpid(), signal.SIGTERM)
+            while time.time() - start < 5:
+                time.sleep(0.01)
+        self.assertEqual(done, [ False ])
+        self.assertEqual(InFlight.last_drain['completed'], 1)
+        self.assertGreaterEqual(time.time() - start, 0.15)
+    
+    def test_existing_handler(self):
+        handler = lambda signum, frame: None
+        signal.signal(signal.SIGTERM, handler)
+        self.assertFalse(self.server.handle_sigterm())
+        self.assertIs(signal.getsignal(signal.SIGTERM), handler)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+'''
+Tests of :py:mod:`boots.common.metrics` (the Prometheus text exposition format) and of the metrics of a
+:py:class:`boots.servers.managedserver.ManagedServer` - their types and the /admin/metrics route while draining
+'''
+from boots.common.metrics import MetricFamily, render, format_value, escape
+from boots.endpoints.http_async import AsyncHTTPEngine
+from boots.endpoints.http_ep import Drain
+import unittest
+try:
+    from boots.servers.managedserver import ManagedServer, ManagedEP, RouteStatsCollection, Stats
+except ImportError: # requires barrel
+    ManagedServer = None
+
+def parse(text):
+    ''' returns the types (by family) and the samples (name, labels, value) of a text exposition '''
+    types, samples = {}, []
+    for line in text.decode('utf-8').splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, metric_type = line.split(' ')
+            types[name] = metric_type
+        elif line and not line.startswith('#'):
+            series, value = line.rsplit(' ', 1)
+            samples.append((series, value))
+    return types, samples
+
+class RenderTest(unittest.TestCase):
+
+    def test_counter(self):
+        requests = MetricFamily('boots_requests_total', 'counter', 'Requests handled', server='s1')
+        requests.add(10, route='get_user', status='2xx').add(2.5, route='get_user', status='5xx')
+        self.assertEqual(render([ requests ]),
+                         '# HELP boots_requests_total Requests handled\n'
+                         '# TYPE boots_requests_total counter\n'
+                         'boots_requests_total{route="get_user",server="s1",status="2xx"} 10\n'
+                         'boots_requests_total{route="get_user",server="s1",status="5xx"} 2.5\n')
+
+    def test_without_labels(self):
+        self.assertEqual(render([ MetricFamily('up', 'gauge', 'Up').add(True) ]), '# HELP up Up\n# TYPE up gauge\nup 1\n')
+
+    def test_skipped(self):
+        empty = MetricFamily('empty', 'gauge', 'No samples')
+        unknown = MetricFamily('unknown', 'gauge', 'Unknown value').add(None)
+        self.assertEqual(render([ empty, unknown ]), '\n')
+
+    def test_escaping(self):
+        family = MetricFamily('m', 'gauge', 'Help with \\ and\nnewline').add(1, path='a"b\\c\nd', name=u'\u20ac')
+        text = render([ family ])
+        self.assertIn('# HELP m Help with \\\\ and\\nnewline\n', text)
+        self.assertIn('m{name="\xe2\x82\xac",path="a\\"b\\\\c\\nd"} 1\n', text)
+        self.assertEqual(escape('\xff'), u'\ufffd') # invalid utf-8 is replaced
+
+    def test_values(self):
+        self.assertEqual([ format_value(v) for v in (1, 10L, 0.25, float('inf'), float('-inf'), float('nan'), False) ],
+                         [ '1', '10', '0.25', '+Inf', '-Inf', 'NaN', '0' ])
+
+    def test_histogram(self):
+        latency = MetricFamily('latency_seconds', 'histogram', 'Latency')
+        latency.add_histogram([ 1, 3 ], (0.1, 1.0), 4, 5.5, route='r')
+        types, samples = parse(render([ latency ]))
+        self.assertEqual(types, { 'latency_seconds': 'histogram' })
+        self.assertEqual(samples, [ ('latency_seconds_bucket{le="0.1",route="r"}', '1'), ('latency_seconds_bucket{le="1.0",route="r"}', '3'),
+                                    ('latency_seconds_bucket{le="+Inf",route="r"}', '4'), ('latency_seconds_sum{route="r"}', '5.5'),
+                                    ('latency_seconds_count{route="r"}', '4') ])
+
+@unittest.skipIf(ManagedServer is None, 'requires barrel')
+class ManagedServerMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ManagedServer.__new__(ManagedServer)
+        self.server.name, self.server.endpoints = 'tests.metrics', []
+        self.server._route_stats = RouteStatsCollection()
+
+    def test_types(self):
+        AsyncHTTPEngine.shared() # so that the engine is reported
+        types, samples = parse(render(self.server.metrics()))
+        self.assertEqual(types['boots_http_client_connections_total'], 'counter')
+        self.assertEqual(types['boots_http_client_in_flight'], 'gauge')
+        self.assertIn('boots_http_client_idle_connections', [ family.name for family in self.server.metrics() ])
+        events = [ series for series, _ in samples if series.startswith('boots_http_client_connections_total') ]
+        self.assertFalse([ series for series in events if 'in_flight' in series or 'idle' in series ], events)
+        self.assertIn('boots_http_client_in_flight{client="engine",server="tests.metrics"}', [ series for series, _ in samples ])
+        for name, metric_type in types.iteritems(): # counters (and only counters) are named _total
+            self.assertEqual(name.endswith('_total'), metric_type == 'counter', name)
+
+    def test_served_while_draining(self):
+        skip = ManagedEP.metrics._route_kargs[None]['skip_by_type']
+        self.assertTrue(Drain in skip and Stats in skip)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+Tests of the WSGI middleware pipeline of :py:class:`boots.servers.httpserver.HTTPBaseServer` - rebuilt from scratch on changes
+'''
+from boots.common.config import Config
+import unittest
+try:
+    from boots.servers.httpserver import HTTPBaseServer, HTTPServer
+except ImportError: # requires barrel
+    HTTPBaseServer = HTTPServer = None
+
+class Tag(object):
+    ''' middleware that appends its name to the response '''
+    def __init__(self, app, name):
+        self.app, self.name = app, name
+    
+    def __call__(self, environ, start_response):
+        return [ ''.join(self.app(environ, start_response)) + ' ' + self.name ]
+
+def base_app(environ, start_response):
+    start_response('200 OK', [])
+    return [ 'app' ]
+
+def depth(app):
+    ''' the number of middleware layers around the base app '''
+    layers = 0
+    while hasattr(app, 'app') or hasattr(app, 'wrap_app'):
+        app = getattr(app, 'wrap_app', None) or app.app
+        layers += 1
+    return layers
+
+@unittest.skipIf(HTTPBaseServer is None, 'requires barrel')
+class MiddlewareTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = HTTPBaseServer(name='tests.middleware')
+        self.server.base_app = self.server.app = base_app
+    
+    def call(self):
+        return ''.join(self.server({ 'REQUEST_METHOD': 'GET', 'PATH_INFO': '/' }, lambda status, headers: None))
+    
+    def test_order(self):
+        self.server.set_middleware('session', lambda app: Tag(app, 'session'))
+        self.server.set_middleware('auth', lambda app: Tag(app, 'auth'))
+        self.assertEqual(self.call(), 'app session auth') # the 1st set is innermost
+    
+    def test_replace_in_place(self):
+        self.server.set_middleware('session', lambda app: Tag(app, 'session'))
+        self.server.set_middleware('auth', lambda app: Tag(app, 'auth'))
+        for version in range(5):
+            self.server.set_middleware('session', lambda app: Tag(app, 'session%s' % version))
+        self.assertEqual(self.call(), 'app session4 auth')
+        self.assertEqual(depth(self.server.app), 2)
+    
+    def test_remove(self):
+        self.server.set_middleware('session', lambda app: Tag(app, 'session'))
+        self.server.set_middleware('auth', lambda app: Tag(app, 'auth'))
+        self.server.remove_middleware('session')
+        self.assertEqual(self.call(), 'app auth')
+        self.server.remove_middleware('missing')
+        self.server.remove_middleware('auth')
+        self.assertIs(self.server.app, base_app)
+    
+    def test_session_updates(self):
+        self.server = HTTPServer(name='tests.middleware.session')
+        self.server.base_app = self.server.app = base_app
+        config = { 'session.type': 'memory', 'session.key': 'sid' }
+        for _ in range(10):
+            self.server.session_config_update(Config.Action.onset, [ 'Session' ], config, {})
+        self.assertEqual(depth(self.server.app), 1)
+        self.assertEqual(self.server.app.environ_key, 'sid')
+        self.server.session_config_update(Config.Action.ondel, [ 'Session' ], None, {})
+        self.assertIs(self.server.app, base_app)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+'''
+Tests of :py:class:`boots.mode` - the production and development modes
+'''
+from boots.endpoints.http_ep import WrapException
+import boots
+import bottle
+import logging
+import unittest
+
+class Handlers(object):
+    def fail(self):
+        raise ValueError('down')
+
+class ModeTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.saved = boots.mode.state
+        WrapException.exceptions.clear()
+        bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'PATH_INFO': '/fail' })
+        bottle.response.bind()
+        self.root = logging.getLogger()
+        self.level, self.root.level = self.root.level, logging.CRITICAL + 1 # the exceptions are logged
+    
+    def tearDown(self):
+        boots.mode.set(self.saved)
+        WrapException.exceptions.clear()
+        self.root.level = self.level
+    
+    def errstr(self):
+        ''' returns the error message that WrapException passes to the handler of a failing route '''
+        messages = []
+        handler = lambda errstr, qstr, exception=None, **kargs: messages.append(errstr)
+        WrapException().apply(Handlers().fail, dict(config=dict(handler=handler), method='GET', rule='/fail', skip=[]))()
+        return messages[0]
+    
+    def test_set(self):
+        boots.mode.set(boots.mode.PRODUCTION)
+        self.assertTrue(boots.mode == boots.mode.PRODUCTION)
+        self.assertEqual(repr(boots.mode), 'production')
+        self.assertFalse(logging.raiseExceptions)
+        self.assertFalse(logging.logMultiprocessing)
+        boots.mode.set(boots.mode.DEVELOPMENT)
+        self.assertTrue(boots.mode == boots.mode.DEVELOPMENT)
+        self.assertTrue(logging.raiseExceptions)
+        self.assertTrue(logging.logMultiprocessing)
+    
+    def test_unknown(self):
+        self.assertRaises(ValueError, boots.mode.set, 'staging')
+        self.assertEqual(boots.mode.state, self.saved)
+    
+    def test_development_trace(self):
+        boots.mode.set(boots.mode.DEVELOPMENT)
+        errstr = self.errstr()
+        self.assertTrue(errstr.startswith('down<br/>'))
+        self.assertIn('in fail: raise ValueError', errstr)
+    
+    def test_production_message(self):
+        boots.mode.set(boots.mode.PRODUCTION)
+        self.assertEqual(self.errstr(), 'down')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+'''
+Tests of :py:class:`boots.endpoints.http_ep.FusedPlugins` - a fused stack of plugins behaves as the same plugins nested
+'''
+from boots.endpoints.http_ep import BasePlugin, FusedPlugins, PluginPhases, Hook, RequestParams, ResponseHeader, WrapException
+from functools import wraps
+import bottle
+import unittest
+
+class Recorder(BasePlugin):
+    ''' records the order of its phases (and the kargs it sees) in a shared log '''
+    fusable = True
+    
+    def __init__(self, name, log, fail_after=False):
+        self.name, self.log, self.fail_after = name, log, fail_after
+    
+    def apply(self, callback, context):
+        @wraps(callback)
+        def wrapper(*args, **kargs):
+            self.log.append(('before', self.name))
+            try:
+                result = callback(*args, **kargs)
+            except Exception as e:
+                self.log.append(('error', self.name, type(e).__name__, sorted(kargs)))
+                raise
+            self.log.append(('after', self.name, sorted(kargs)))
+            if self.fail_after: raise ValueError('after ' + self.name)
+            return result
+        self.plugin_post_apply(callback, wrapper)
+        return wrapper
+    
+    def phases(self, callback, context):
+        def before(kargs):
+            self.log.append(('before', self.name))
+        def after(state, result, kargs):
+            self.log.append(('after', self.name, sorted(kargs)))
+            if self.fail_after: raise ValueError('after ' + self.name)
+            return result
+        def on_error(state, exc_info, args, kargs):
+            self.log.append(('error', self.name, exc_info[0].__name__, sorted(kargs)))
+            return PluginPhases.PROPAGATE
+        return PluginPhases(before=before, after=after, on_error=on_error)
+
+class Handlers(object):
+    response = bottle.response
+    
+    def ok(self, a=None, header_dict=None):
+        return 'ok %s' % (a, )
+    
+    def fail(self, a=None, header_dict=None):
+        raise KeyError('fail')
+
+def nested(plugins, callback, context):
+    wrapper = callback
+    for plugin in reversed(plugins):
+        wrapper = plugin.apply(wrapper, context)
+    return wrapper
+
+class FusedPluginsTest(unittest.TestCase):
+    
+    context = dict(config=dict(params=dict(a=int)), method='GET', skip=[], rule='/ok')
+    
+    def setUp(self):
+        bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'QUERY_STRING': 'a=5', 'PATH_INFO': '/ok' })
+        bottle.response.bind()
+    
+    def both(self, make_plugins, method):
+        ''' runs the route nested and fused. returns the (result or exception, log) of each '''
+        outcomes = []
+        for fuse in (False, True):
+            log = []
+            plugins = make_plugins(log)
+            callback = getattr(Handlers(), method)
+            route = FusedPlugins(plugins).apply(callback, self.context) if fuse else nested(plugins, callback, self.context)
+            try:
+                outcome = route()
+            except Exception as e:
+                outcome = (type(e).__name__, str(e))
+            outcomes.append((outcome, log))
+        return outcomes
+    
+    def test_base_plugin_is_not_fused(self):
+        self.assertIsNone(BasePlugin().phases(None, None))
+        plain, fusable = BasePlugin(), Recorder('r', [])
+        self.assertEqual(FusedPlugins.fuse([ plain, fusable ]), [ plain, fusable ])
+        fused = FusedPlugins.fuse([ fusable, Recorder('s', []), plain ])
+        self.assertIsInstance(fused[0], FusedPlugins)
+        self.assertIs(fused[1], plain)
+    
+    def test_order_and_kargs_match_nesting(self):
+        make = lambda log: [ Recorder('outer', log), RequestParams(), ResponseHeader({ 'X-Test': '1' }), Recorder('inner', log) ]
+        (nested_result, nested_log), (fused_result, fused_log) = self.both(make, 'ok')
+        self.assertEqual(fused_result, 'ok 5')
+        self.assertEqual(fused_result, nested_result)
+        self.assertEqual(fused_log, nested_log)
+        # the outer plugin does not see the kargs bound (or added) by the inner plugins
+        self.assertEqual(fused_log[-1], ('after', 'outer', []))
+        self.assertEqual(fused_log[-2], ('after', 'inner', [ 'a', 'header_dict' ]))
+    
+    def test_errors_unwind_as_nested(self):
+        make = lambda log: [ Recorder('outer', log), RequestParams(), Recorder('inner', log) ]
+        (nested_result, nested_log), (fused_result, fused_log) = self.both(make, 'fail')
+        self.assertEqual(fused_result, ('KeyError', "'fail'"))
+        self.assertEqual((fused_result, fused_log), (nested_result, nested_log))
+    
+    def test_error_in_after_phase_reaches_outer_plugins(self):
+        make = lambda log: [ Recorder('outer', log), Recorder('inner', log, fail_after=True) ]
+        (nested_result, nested_log), (fused_result, fused_log) = self.both(make, 'ok')
+        self.assertEqual(fused_result, ('ValueError', 'after inner'))
+        self.assertEqual(fused_log, nested_log)
+        self.assertEqual(fused_log[-1], ('error', 'outer', 'ValueError', []))
+    
+    def test_wrap_exception_handler_gets_args_and_kargs(self):
+        calls = []
+        def handler(errstr, qstr, *args, **kargs):
+            calls.append((args, sorted(kargs)))
+            return 'handled'
+        route = FusedPlugins([ WrapException(handler), RequestParams() ]).apply(Handlers().fail, self.context)
+        self.assertEqual(route('positional'), 'handled')
+        # the handler gets the kargs of WrapException's level (outside RequestParams) and the positional arguments
+        self.assertEqual(calls, [ (('positional', ), [ 'exception' ]) ])
+    
+    def test_hook_sees_its_level(self):
+        seen = []
+        def handler(before_or_after, request_context, callback, url, result=None, exception=None, **kargs):
+            seen.append((before_or_after, sorted(kargs)))
+            return result
+        route = FusedPlugins([ Hook(handler), RequestParams() ]).apply(Handlers().ok, self.context)
+        self.assertEqual(route(), 'ok 5')
+        self.assertEqual(seen, [ ('before', []), ('after', []) ])
+    
+    def test_skip(self):
+        log = []
+        recorder = Recorder('skipped', log)
+        context = dict(self.context, skip=[ recorder ])
+        route = FusedPlugins([ recorder, RequestParams() ]).apply(Handlers().ok, context)
+        self.assertEqual(route(), 'ok 5')
+        self.assertEqual(log, [])
+
+if __name__ == '__main__':
+    unittest.main()
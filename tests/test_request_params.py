@@ -0,0 +1,81 @@
+'''
+Tests of :py:class:`boots.endpoints.http_ep.RequestParams` - the compiled binding plan and the errors it reports
+'''
+from boots.endpoints.http_ep import RequestParams
+import bottle
+import unittest
+
+class Handlers(object):
+    def index(self, a, b='', slist=None, flag=False):
+        return dict(a=a, b=b, slist=slist, flag=flag)
+
+def bind_request(query='', method='GET', body=''):
+    environ = { 'REQUEST_METHOD': method, 'QUERY_STRING': query, 'PATH_INFO': '/index' }
+    if body:
+        from StringIO import StringIO
+        environ.update({ 'CONTENT_TYPE': 'application/x-www-form-urlencoded', 'CONTENT_LENGTH': str(len(body)), 
+                         'wsgi.input': StringIO(body) })
+    bottle.request.bind(environ)
+
+class RequestParamsTest(unittest.TestCase):
+    
+    def route(self, method='GET', **params):
+        context = dict(config=dict(params=params or dict(a=int, b=str, slist=[str], flag=bool)), method=method, skip=[])
+        return RequestParams().apply(Handlers().index, context)
+    
+    def test_compile(self):
+        context = dict(config=dict(params=dict(a=int, slist=[int], flag=bool)), method='GET')
+        slots = dict((slot[0], slot) for slot in RequestParams().compile(Handlers().index, context))
+        self.assertEqual(sorted(slots), [ 'a', 'b', 'flag', 'slist' ])
+        self.assertEqual(slots['a'], ('a', int, False, True))
+        self.assertEqual(slots['slist'][1:], (int, True, False))
+        self.assertEqual(slots['flag'][1], RequestParams.boolean)
+        self.assertEqual(slots['b'][1], RequestParams._identity)
+    
+    def test_binds_and_converts(self):
+        bind_request('a=10&b=hello&slist=x&slist=y&flag=true')
+        self.assertEqual(self.route()(), dict(a=10, b='hello', slist=[ 'x', 'y' ], flag=True))
+    
+    def test_optional_parameters_default(self):
+        bind_request('a=1')
+        self.assertEqual(self.route()(), dict(a=1, b='', slist=None, flag=False))
+    
+    def test_last_value_of_single_valued_parameter(self):
+        bind_request('a=1&a=2')
+        self.assertEqual(self.route()()['a'], 2)
+    
+    def test_empty_values_of_lists_are_dropped(self):
+        bind_request('a=1&slist=&slist=z')
+        self.assertEqual(self.route()()['slist'], [ 'z' ])
+    
+    def test_missing_parameter(self):
+        bind_request('b=x')
+        with self.assertRaises(bottle.HTTPError) as raised:
+            self.route()()
+        self.assertEqual(raised.exception.status_code, 400)
+        self.assertIn('Missing parameters: a', raised.exception.body)
+    
+    def test_errors_are_reported_together(self):
+        bind_request('slist=1&slist=x', )
+        route = self.route(a=int, slist=[int])
+        with self.assertRaises(bottle.HTTPError) as raised:
+            route()
+        self.assertIn('Wrong parameter format for: slist', raised.exception.body)
+        self.assertIn('Missing parameters: a', raised.exception.body)
+    
+    def test_post_parameters(self):
+        bind_request(query='a=1', method='POST', body='a=5&b=posted')
+        self.assertEqual(self.route(method='POST')()['a'], 5)
+        self.assertEqual(self.route(method='POST')()['b'], 'posted')
+    
+    def test_validate(self):
+        positive = RequestParams.validate(int, lambda x: x > 0)
+        self.assertEqual(positive('3'), 3)
+        self.assertRaises(ValueError, positive, '-3')
+    
+    def test_boolean(self):
+        for value, expected in [ ('true', True), ('False', False), ('1', True), ('0', False), ('none', False), ('2', True) ]:
+            self.assertEqual(RequestParams.boolean(value), expected, value)
+
+if __name__ == '__main__':
+    unittest.main()
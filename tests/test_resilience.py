@@ -0,0 +1,154 @@
+'''
+Tests of :py:mod:`boots.endpoints.http_resilience` - the retry policy, the states of circuit breakers - and of timeouts, retries
+and breakers with :py:class:`boots.endpoints.httpclient_ep.HTTPClientEndPoint` (including timeouts while reading the body)
+'''
+from boots.endpoints.http_resilience import RetryPolicy, CircuitBreaker, CircuitOpen
+from boots.endpoints.http_pool import ConnectionPool
+from boots.endpoints.httpclient_ep import HTTPClientEndPoint
+from tests.test_http_async import ScriptedServer, response
+import logging
+import socket
+import time
+import unittest
+import urllib2
+
+def http_error(code):
+    return urllib2.HTTPError('http://host/', code, 'error', {}, None)
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_should_retry(self):
+        policy = RetryPolicy(retries=2)
+        timeout = urllib2.URLError(socket.timeout('timed out'))
+        self.assertTrue(policy.should_retry('GET', timeout, 0))
+        self.assertTrue(policy.should_retry('get', timeout, 1))
+        self.assertFalse(policy.should_retry('GET', timeout, 2)) # no retries left
+        self.assertFalse(policy.should_retry('POST', timeout, 0)) # not idempotent
+        self.assertTrue(policy.should_retry('GET', http_error(503), 0))
+        self.assertFalse(policy.should_retry('GET', http_error(500), 0))
+        self.assertFalse(policy.should_retry('GET', http_error(404), 0))
+        self.assertFalse(policy.should_retry('GET', CircuitOpen('open'), 0))
+        self.assertFalse(RetryPolicy().should_retry('GET', timeout, 0))
+
+    def test_delay(self):
+        policy = RetryPolicy(retries=10, backoff=0.1, max_backoff=1.0)
+        for attempt in range(10):
+            delay = policy.delay(attempt)
+            self.assertTrue(0 <= delay <= min(1.0, 0.1 * 2 ** attempt))
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('http://test-%s' % id(self))
+        self.breaker.failure_threshold, self.breaker.reset_timeout = 3, 0.1
+
+    def test_opens_after_threshold(self):
+        for _ in range(2):
+            self.breaker.record(urllib2.URLError('refused'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record(http_error(503))
+        self.assertEqual((self.breaker.state, self.breaker.trips), (CircuitBreaker.OPEN, 1))
+        with self.assertRaises(CircuitOpen):
+            self.breaker.check()
+        self.assertEqual(self.breaker.rejected, 1)
+
+    def test_success_resets(self):
+        for _ in range(2):
+            self.breaker.record(urllib2.URLError('refused'))
+        self.breaker.record(http_error(404)) # the host is up
+        self.assertEqual(self.breaker.failures, 0)
+        for _ in range(2):
+            self.breaker.record(urllib2.URLError('refused'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open(self):
+        for _ in range(3):
+            self.breaker.record(urllib2.URLError('refused'))
+        time.sleep(0.15)
+        self.assertTrue(self.breaker.allow()) # the trial request
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow()) # while the trial is in progress
+        self.breaker.record(urllib2.URLError('refused'))
+        self.assertEqual((self.breaker.state, self.breaker.trips), (CircuitBreaker.OPEN, 2))
+        time.sleep(0.15)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(None)
+        self.assertEqual((self.breaker.state, self.breaker.failures), (CircuitBreaker.CLOSED, 0))
+        self.assertTrue(self.breaker.allow())
+
+    def test_ignores_circuit_open(self):
+        self.breaker.record(CircuitOpen('open'))
+        self.assertEqual(self.breaker.failures, 0)
+
+class ClientResilienceTest(unittest.TestCase):
+
+    body = response(body='hello world')
+
+    @classmethod
+    def setUpClass(cls):
+        def once(slow):
+            ''' the first request of the path is scripted by slow and the rest respond immediately '''
+            return lambda number: slow if len([ p for p, _ in cls.server.requests if p == '/slow-body' ]) == 1 else [ cls.body ]
+        cls.server = ScriptedServer({
+            '/hello': [ cls.body ],
+            '/slow-body': once([ cls.body[:-5], 1.0, cls.body[-5:] ]),
+            '/stalls': [ cls.body[:-5], 1.0, cls.body[-5:] ],
+            '/unavailable': [ response('503 Service Unavailable', body='down') ],
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def setUp(self):
+        CircuitBreaker._breakers.pop(self.server.url, None)
+        self.breaker = CircuitBreaker.for_host(self.server.url)
+        self.root = logging.getLogger()
+        self.level, self.root.level = self.root.level, logging.CRITICAL + 1
+
+    def tearDown(self):
+        self.root.level = self.level
+        CircuitBreaker._breakers.pop(self.server.url, None)
+
+    def client(self, **kargs):
+        return HTTPClientEndPoint(pool=ConnectionPool(), timeout=0.3, backoff=0.01, **kargs)
+
+    def paths(self, path):
+        return len([ p for p, _ in self.server.requests if p == path ])
+
+    def test_body_timeout_retried(self):
+        response = self.client(retries=1).request(self.server.url + '/slow-body', method='GET')
+        self.assertEqual(response.data, 'hello world')
+        self.assertEqual(self.paths('/slow-body'), 2)
+        self.assertEqual(self.breaker.failures, 0) # the retry succeeded
+
+    def test_body_timeout_is_urlerror(self):
+        with self.assertRaises(urllib2.URLError) as error:
+            self.client().request(self.server.url + '/stalls', method='GET')
+        self.assertIsInstance(error.exception.reason, socket.timeout)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_streamed_body_timeout(self):
+        response = self.client().stream_request(self.server.url + '/stalls', method='GET')
+        self.assertEqual(self.breaker.failures, 0)
+        with self.assertRaises(urllib2.URLError) as error:
+            list(response.iter_content())
+        self.assertIsInstance(error.exception.reason, socket.timeout)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_stream_request(self):
+        response = self.client().stream_request(self.server.url + '/hello', method='GET')
+        self.assertEqual(''.join(response.iter_content(4)), 'hello world')
+
+    def test_breaker_opens(self):
+        client = self.client(retries=1)
+        self.breaker.failure_threshold = 2
+        with self.assertRaises(urllib2.HTTPError):
+            client.request(self.server.url + '/unavailable', method='GET') # retried once - both attempts fail
+        self.assertEqual(self.paths('/unavailable'), 2)
+        with self.assertRaises(CircuitOpen):
+            client.request(self.server.url + '/unavailable', method='GET')
+        self.assertEqual(self.paths('/unavailable'), 2) # failed fast
+
+if __name__ == '__main__':
+    unittest.main()
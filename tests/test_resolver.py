@@ -0,0 +1,95 @@
+'''
+Tests of :py:class:`boots.common.resolver.Resolver` - caching of resolutions, negative caching (of hosts that do not exist only),
+the bound on the cache and invalidation - with a scripted socket.getaddrinfo
+'''
+from boots.common.resolver import Resolver
+import socket
+import unittest
+
+class ResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.failures = {} # host to the gaierror errno it fails with
+        self.getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = self.resolve
+        self.settings = Resolver.ttl, Resolver.negative_ttl, Resolver.max_entries
+        Resolver.invalidate()
+
+    def tearDown(self):
+        socket.getaddrinfo = self.getaddrinfo
+        Resolver.ttl, Resolver.negative_ttl, _ = self.settings
+        Resolver.configure(max_entries=self.settings[2])
+        Resolver.invalidate()
+
+    def resolve(self, host, port, family=0, socktype=0):
+        self.calls.append(host)
+        if host in self.failures:
+            raise socket.gaierror(self.failures[host], 'failed')
+        return [ (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.%d' % len(self.calls), port or 0)) ]
+
+    def test_cached(self):
+        first = Resolver.getaddrinfo('backend.test', 80, 0, socket.SOCK_STREAM)
+        self.assertEqual(first[0][4], ('10.0.0.1', 80))
+        self.assertEqual(Resolver.getaddrinfo('backend.test', 8080, 0, socket.SOCK_STREAM)[0][4], ('10.0.0.1', 8080))
+        self.assertEqual(Resolver.gethostbyname('backend.test'), '10.0.0.1')
+        self.assertEqual(self.calls, [ 'backend.test' ])
+
+    def test_expires(self):
+        Resolver.ttl = -1
+        Resolver.getaddrinfo('backend.test', 80)
+        Resolver.getaddrinfo('backend.test', 80)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_addresses_not_cached(self):
+        Resolver.getaddrinfo('127.0.0.1', 80)
+        self.assertEqual(Resolver.stats()['entries'], 0)
+
+    def test_negative_cached(self):
+        self.failures['missing.test'] = socket.EAI_NONAME
+        errors = []
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror) as error:
+                Resolver.getaddrinfo('missing.test', 80)
+            errors.append(error.exception)
+        self.assertEqual(self.calls, [ 'missing.test' ])
+        self.assertEqual(errors[1].args, (socket.EAI_NONAME, 'failed'))
+        self.assertIsNot(errors[0], errors[1]) # a new exception each time
+
+    def test_transient_not_cached(self):
+        self.failures['flaky.test'] = socket.EAI_AGAIN
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                Resolver.getaddrinfo('flaky.test', 80)
+        self.assertEqual(self.calls, [ 'flaky.test' ] * 2)
+        del self.failures['flaky.test']
+        self.assertEqual(Resolver.getaddrinfo('flaky.test', 80)[0][4][1], 80) # resolved once the resolver recovers
+
+    def test_bounded(self):
+        Resolver.configure(max_entries=3)
+        for i in range(5):
+            Resolver.getaddrinfo('host%d.test' % i, 80)
+        self.assertEqual(Resolver.stats()['entries'], 3)
+        Resolver.getaddrinfo('host0.test', 80) # evicted
+        self.assertEqual(self.calls.count('host0.test'), 2)
+
+    def test_invalidate(self):
+        Resolver.getaddrinfo('a.test', 80)
+        Resolver.getaddrinfo('a.test', 80, socket.AF_INET)
+        Resolver.getaddrinfo('b.test', 80)
+        Resolver.invalidate('a.test')
+        self.assertEqual(Resolver.stats()['entries'], 1)
+        Resolver.getaddrinfo('b.test', 80)
+        Resolver.getaddrinfo('a.test', 80)
+        self.assertEqual(self.calls.count('a.test'), 3)
+        self.assertEqual(self.calls.count('b.test'), 1)
+
+    def test_stats(self):
+        hits, misses = Resolver.hits.value(), Resolver.misses.value()
+        Resolver.getaddrinfo('backend.test', 80)
+        Resolver.getaddrinfo('backend.test', 80)
+        self.assertEqual((Resolver.hits.value() - hits, Resolver.misses.value() - misses), (1, 1))
+        self.assertIsNotNone(Resolver.stats()['latency_ms']['mean'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+'''
+Tests of :py:class:`boots.endpoints.http_ep.ResponseCache` - cache keys, hits, ETags and 304s
+'''
+from boots.endpoints.http_ep import ResponseCache
+import bottle
+import unittest
+
+class Namespace(object):
+    ''' a beaker cache namespace (get raises KeyError for missing keys) '''
+    def __init__(self, **options):
+        self.options = options
+        self.data = {}
+    
+    def get(self, key):
+        return self.data[key]
+    
+    def put(self, key, value):
+        self.data[key] = value
+
+class CacheManager(object):
+    def __init__(self):
+        self.namespaces = {}
+    
+    def get_cache(self, namespace, **options):
+        return self.namespaces.setdefault(namespace, Namespace(**options))
+    
+    def get_cache_region(self, namespace, region):
+        return self.get_cache(namespace, region=region)
+
+class Server(object):
+    def __init__(self, cache):
+        self.cache = cache
+
+class Handlers(object):
+    name = 'catalog_ep'
+    response = bottle.response
+    
+    def __init__(self, cache=None):
+        self.server = Server(cache)
+        self.calls = []
+    
+    def catalog(self, lang='en', page=1):
+        self.calls.append((lang, page))
+        bottle.response.headers['X-Lang'] = lang
+        return dict(lang=lang, page=page)
+    
+    def login(self):
+        self.calls.append('login')
+        bottle.response.set_cookie('session', 'abc')
+        return 'welcome'
+    
+    def shared(self):
+        self.calls.append('shared')
+        origin = bottle.request.environ.get('HTTP_ORIGIN')
+        bottle.response.headers['Access-Control-Allow-Origin'] = origin # as CrossOriginPlugin does
+        bottle.response.headers['Cache-Control'] = 'max-age=60'
+        bottle.response.headers['Vary'] = 'Origin'
+        return 'shared'
+    
+    def missing(self):
+        self.calls.append('missing')
+        bottle.response.status = 404
+        return 'not found'
+
+class ResponseCacheTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.manager = CacheManager()
+        self.handlers = Handlers(self.manager)
+        self.plugin = ResponseCache()
+    
+    def route(self, callback, cache=dict(expire=300), method='GET'):
+        return self.plugin.apply(callback, dict(config=dict(cache=cache), method=method, rule='/catalog', skip=[]))
+    
+    def request(self, wrapper, method='GET', path='/catalog', **kargs):
+        environ = { 'REQUEST_METHOD': method, 'PATH_INFO': path }
+        if 'origin' in kargs:
+            environ['HTTP_ORIGIN'] = kargs.pop('origin')
+        if 'if_none_match' in kargs:
+            environ['HTTP_IF_NONE_MATCH'] = kargs.pop('if_none_match')
+        bottle.request.bind(environ)
+        bottle.response.bind()
+        return wrapper(**kargs)
+    
+    def test_hit(self):
+        wrapper = self.route(self.handlers.catalog)
+        body = self.request(wrapper, lang='fr', page=2)
+        self.assertEqual(bottle.response.headers['X-Cache'], 'MISS')
+        self.assertEqual(bottle.response.content_type, 'application/json')
+        etag = bottle.response.headers['ETag']
+        self.assertEqual(self.request(wrapper, lang='fr', page=2), body)
+        headers = bottle.response.headers
+        self.assertEqual(headers['X-Cache'], 'HIT')
+        self.assertEqual(headers['ETag'], etag)
+        self.assertEqual(headers['Content-Type'], 'application/json') # restored from the cache
+        self.assertNotIn('X-Lang', headers) # set by the route for the request, not cached
+        self.assertIn('Last-Modified', headers)
+        self.assertEqual(self.handlers.calls, [ ('fr', 2) ])
+        self.assertEqual(self.manager.namespaces['boots.response.catalog_ep./catalog'].options, dict(expire=300))
+    
+    def test_per_request_headers_not_replayed(self):
+        wrapper = self.route(self.handlers.shared)
+        self.request(wrapper, origin='https://a.example')
+        self.assertEqual(bottle.response.headers['Access-Control-Allow-Origin'], 'https://a.example')
+        self.assertEqual(self.request(wrapper, origin='https://b.example'), 'shared')
+        headers = bottle.response.headers
+        self.assertEqual(headers['X-Cache'], 'HIT')
+        self.assertNotIn('Access-Control-Allow-Origin', headers) # not a's
+        self.assertEqual((headers['Cache-Control'], headers['Vary']), ('max-age=60', 'Origin'))
+    
+    def test_key_parameters(self):
+        wrapper = self.route(self.handlers.catalog)
+        self.request(wrapper, lang='fr', page=1)
+        self.request(wrapper, lang='fr', page=2)
+        self.request(wrapper, path='/other', lang='fr', page=2)
+        self.assertEqual(len(self.handlers.calls), 3)
+    
+    def test_vary(self):
+        wrapper = self.route(self.handlers.catalog, cache=dict(expire=60, vary=[ 'lang' ]))
+        self.request(wrapper, lang='fr', page=1)
+        self.assertEqual(self.request(wrapper, lang='fr', page=2), bottle.json_dumps(dict(lang='fr', page=1)))
+        self.request(wrapper, lang='de', page=1)
+        self.assertEqual(self.handlers.calls, [ ('fr', 1), ('de', 1) ])
+    
+    def test_not_modified(self):
+        wrapper = self.route(self.handlers.catalog)
+        self.request(wrapper, lang='en')
+        etag = bottle.response.headers['ETag']
+        self.assertEqual(self.request(wrapper, if_none_match='"other", %s' % etag, lang='en'), '')
+        self.assertEqual(bottle.response.status_code, 304)
+        self.assertNotIn('Content-Type', bottle.response.headers)
+        self.assertEqual(bottle.response.headers['ETag'], etag)
+        self.assertEqual(self.request(wrapper, if_none_match='*', lang='en'), '')
+        self.assertEqual(bottle.response.status_code, 304)
+        self.assertEqual(len(self.handlers.calls), 1)
+    
+    def test_not_modified_on_miss(self):
+        wrapper = self.route(self.handlers.catalog)
+        body = self.request(wrapper, lang='en')
+        etag = bottle.response.headers['ETag']
+        self.manager.namespaces.clear() # e.g. expired
+        self.assertEqual(self.request(wrapper, if_none_match=etag, lang='en'), '')
+        self.assertEqual(bottle.response.status_code, 304)
+        self.assertEqual(self.request(wrapper, if_none_match='"stale"', lang='en'), body)
+        self.assertEqual(bottle.response.status_code, 200)
+    
+    def test_head(self):
+        wrapper = self.route(self.handlers.catalog, method='HEAD')
+        self.assertEqual(self.request(wrapper, method='HEAD', lang='en'), '')
+        self.assertIn('ETag', bottle.response.headers)
+    
+    def test_uncached(self):
+        login = self.route(self.handlers.login)
+        missing = self.route(self.handlers.missing)
+        for _ in range(2):
+            self.assertEqual(self.request(login), 'welcome')
+            self.assertEqual(self.request(missing), 'not found')
+        self.assertEqual(self.handlers.calls, [ 'login', 'missing' ] * 2)
+    
+    def test_not_applied(self):
+        callback = self.handlers.catalog
+        self.assertIs(self.route(callback, cache=None), callback)
+        self.assertIs(self.route(callback, method='POST'), callback)
+    
+    def test_no_cache_configured(self):
+        handlers = Handlers(None)
+        wrapper = self.route(handlers.catalog)
+        self.request(wrapper)
+        self.request(wrapper)
+        self.assertEqual(len(handlers.calls), 2)
+        self.assertNotIn('ETag', bottle.response.headers)
+    
+    def test_region(self):
+        self.request(self.route(self.handlers.catalog, cache=dict(region='short_term')))
+        self.assertEqual(self.manager.namespaces['boots.response.catalog_ep./catalog'].options, dict(region='short_term'))
+    
+    def test_expire_shorthand(self):
+        self.request(self.route(self.handlers.catalog, cache=30))
+        self.assertEqual(self.manager.namespaces['boots.response.catalog_ep./catalog'].options, dict(expire=30))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+'''
+Tests of streaming client response bodies - :py:func:`boots.endpoints.httpclient_ep.iter_json_array` (however the text is split
+into chunks) and :py:meth:`boots.endpoints.httpclient_ep.Response.iter_content` and :py:meth:`Response.save_to`
+'''
+from boots.endpoints.httpclient_ep import Response, iter_json_array
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import time
+import unittest
+import urllib2
+
+def chunked(text, size):
+    return [ text[i:i + size] for i in xrange(0, len(text), size) ]
+
+class IterJSONArrayTest(unittest.TestCase):
+
+    values = [ 1, -2.5e3, u'a "quoted", [bracketed] string \\ with escapes \u20ac', { 'nested': [ 1, { 'x': '}]' } ], 'y': None },
+               [], {}, True, False, None, 12345678901234567890, '' ]
+
+    def test_every_split(self):
+        text = json.dumps(self.values)
+        for size in range(1, 12) + [ len(text) ]:
+            self.assertEqual(list(iter_json_array(chunked(text, size))), self.values, 'chunks of %d' % size)
+
+    def test_whitespace(self):
+        text = ' \n[ 1 ,\t"a" , [ 2 ]\r\n, 3 ] '
+        for size in (1, 2, 3, len(text)):
+            self.assertEqual(list(iter_json_array(chunked(text, size))), [ 1, 'a', [ 2 ], 3 ])
+
+    def test_number_across_chunks(self):
+        self.assertEqual(list(iter_json_array([ '[12', '34, 5', '6]' ])), [ 1234, 56 ])
+
+    def test_escape_across_chunks(self):
+        self.assertEqual(list(iter_json_array([ '["a\\', '"b"', ']' ])), [ 'a"b' ])
+        self.assertEqual(list(iter_json_array([ '["a\\', '', '"b"]' ])), [ 'a"b' ])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_json_array([ ' [', ' ]' ])), [])
+
+    def test_incremental(self):
+        def chunks():
+            yield '[1, {"a": '
+            yield '2}, '
+            raise AssertionError('read beyond the element')
+        elements = iter_json_array(chunks())
+        self.assertEqual(next(elements), 1)
+        self.assertEqual(next(elements), { 'a': 2 })
+
+    def test_errors(self):
+        for chunks in ([ '{"a": 1}' ], [ '[1, 2' ], [ '[1, {"a": ' ], [ '[1, tru, 2]' ], [ '' ]):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(chunks))
+
+    def test_linear(self):
+        big = 'x' * (2 * 1024 * 1024)
+        start = time.time()
+        self.assertEqual(list(iter_json_array(chunked(json.dumps([ big, [ big ] ]), 1024))), [ big, [ big ] ])
+        self.assertLess(time.time() - start, 5) # rather than rescanning the element as each chunk arrives
+
+class ResponseStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def response(self, body):
+        response = urllib2.addinfourl(StringIO.StringIO(body), {}, 'http://host/')
+        reads = self.reads = []
+        read = response.read
+        def recording(*args):
+            reads.append(args)
+            return read(*args)
+        response.read = recording
+        return Response(response)
+
+    def test_save_to(self):
+        body = os.urandom(300 * 1024)
+        path = os.path.join(self.dir, 'sub', 'body.bin')
+        self.assertEqual(self.response(body).save_to(path), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), body)
+        self.assertTrue(all(args == (Response.chunk_size, ) for args in self.reads)) # streamed in chunks
+
+    def test_save_to_after_data(self):
+        response = self.response('hello')
+        response.data
+        path = os.path.join(self.dir, 'body.txt')
+        response.save_to(path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), 'hello')
+
+    def test_iter_content(self):
+        response = self.response('hello world')
+        self.assertEqual(list(response.iter_content(4)), [ 'hell', 'o wo', 'rld' ])
+        with self.assertRaises(IOError): # consumed
+            response.data
+
+    def test_iter_json(self):
+        self.assertEqual(list(self.response('[1, {"a": [2]}, "b"]').iter_json(3)), [ 1, { 'a': [ 2 ] }, 'b' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+'''
+Tests of :py:meth:`boots.endpoints.http_ep.HTTPServerEndPoint.send_file` and the containment check of
+:py:meth:`boots.common.dirutils.DirUtils.resolve_path`
+'''
+from boots.common.dirutils import DirUtils
+from boots.endpoints.http_ep import HTTPServerEndPoint
+import bottle
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+class ResolvePathTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'data')
+        os.makedirs(os.path.join(self.root, 'sub'))
+        os.makedirs(os.path.join(self.tmp, 'data2'))
+        os.symlink(self.tmp, os.path.join(self.root, 'escape'))
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+    
+    def test_within(self):
+        self.assertEqual(DirUtils().resolve_path(self.root, 'sub/x.txt'), os.path.join(self.root, 'sub', 'x.txt'))
+        self.assertEqual(DirUtils().resolve_path(self.root, '.'), self.root)
+        self.assertEqual(DirUtils().resolve_path(self.tmp, 'x', sub_dir='data'), os.path.join(self.root, 'x'))
+    
+    def test_parent(self):
+        self.assertRaises(ValueError, DirUtils().resolve_path, self.root, '../x.txt')
+    
+    def test_sibling_with_common_prefix(self):
+        self.assertRaises(ValueError, DirUtils().resolve_path, self.root, '../data2/x.txt')
+    
+    def test_symlink_escape(self):
+        self.assertRaises(ValueError, DirUtils().resolve_path, self.root, 'escape/data2')
+
+class SendFileTest(unittest.TestCase):
+    
+    content = ''.join(chr(i % 256) for i in xrange(5000))
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'report.csv'), 'wb') as fp:
+            fp.write(self.content)
+        self.mtime = int(os.stat(os.path.join(self.root, 'report.csv')).st_mtime)
+        self.ep = HTTPServerEndPoint.__new__(HTTPServerEndPoint)
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def send(self, path='report.csv', method='GET', **environ):
+        environ.update(REQUEST_METHOD=method, PATH_INFO='/' + path)
+        bottle.request.bind(environ)
+        bottle.response.bind()
+        body = self.ep.send_file(self.root, path, chunk_size=1000)
+        if hasattr(body, 'read'):
+            with body:
+                return body.read()
+        return ''.join(body)
+    
+    def test_complete(self):
+        self.assertEqual(self.send(), self.content)
+        headers = bottle.response.headers
+        self.assertEqual(bottle.response.status_code, 200)
+        self.assertEqual(headers['Content-Length'], '5000')
+        self.assertEqual(headers['Content-Type'], 'text/csv')
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(bottle.parse_date(headers['Last-Modified']), self.mtime)
+    
+    def test_download(self):
+        self.send()
+        self.assertNotIn('Content-Disposition', bottle.response.headers)
+        bottle.request.bind({ 'REQUEST_METHOD': 'GET' })
+        bottle.response.bind()
+        self.ep.send_file(self.root, 'report.csv', download='export.csv').close()
+        self.assertEqual(bottle.response.headers['Content-Disposition'], 'attachment; filename="export.csv"')
+    
+    def test_range(self):
+        self.assertEqual(self.send(HTTP_RANGE='bytes=1000-3499'), self.content[1000:3500])
+        self.assertEqual(bottle.response.status_code, 206)
+        self.assertEqual(bottle.response.headers['Content-Range'], 'bytes 1000-3499/5000')
+        self.assertEqual(bottle.response.headers['Content-Length'], '2500')
+    
+    def test_suffix_range(self):
+        self.assertEqual(self.send(HTTP_RANGE='bytes=-100'), self.content[-100:])
+        self.assertEqual(bottle.response.headers['Content-Range'], 'bytes 4900-4999/5000')
+    
+    def test_unsatisfiable_range(self):
+        with self.assertRaises(bottle.HTTPError) as error:
+            self.send(HTTP_RANGE='bytes=6000-7000')
+        self.assertEqual(error.exception.status_code, 416)
+    
+    def test_not_modified(self):
+        since = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(self.mtime))
+        self.assertEqual(self.send(HTTP_IF_MODIFIED_SINCE=since), '')
+        self.assertEqual(bottle.response.status_code, 304)
+    
+    def test_modified(self):
+        since = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(self.mtime - 60))
+        self.assertEqual(self.send(HTTP_IF_MODIFIED_SINCE=since), self.content)
+        self.assertEqual(bottle.response.status_code, 200)
+    
+    def test_head(self):
+        self.assertEqual(self.send(method='HEAD'), '')
+        self.assertEqual(bottle.response.headers['Content-Length'], '5000')
+    
+    def test_missing(self):
+        with self.assertRaises(bottle.HTTPError) as error:
+            self.send('missing.csv')
+        self.assertEqual(error.exception.status_code, 404)
+    
+    def test_outside_root(self):
+        with self.assertRaises(bottle.HTTPError) as error:
+            self.send('../report.csv')
+        self.assertEqual(error.exception.status_code, 403)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+'''
+Tests of :py:mod:`boots.servers.helpers.serving` - keep-alive of the pooled server, recycling and the backoff of prefork workers
+'''
+from boots.servers.helpers import serving
+from boots.servers.helpers.serving import PooledWSGIServer, PreforkMaster, count_requests, make_listener
+import signal
+import socket
+import threading
+import time
+import unittest
+try:
+    from boots.servers.httpserver import HTTPBaseServer
+except ImportError: # requires barrel
+    HTTPBaseServer = None
+
+def app(environ, start_response):
+    body = environ['PATH_INFO']
+    start_response('200 OK', [ ('Content-Type', 'text/plain'), ('Content-Length', str(len(body))) ])
+    return [ body ]
+
+class PooledWSGIServerTest(unittest.TestCase):
+    
+    def serve(self, keepalive):
+        self.server = PooledWSGIServer(('127.0.0.1', 0), app, threads=2, keepalive=keepalive)
+        thread = threading.Thread(target=self.server.serve_forever, kwargs=dict(poll_interval=0.05))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.stop, 5)
+        return socket.create_connection(self.server.server_address, 5)
+    
+    def get(self, sock, path):
+        sock.sendall('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path)
+        response = ''
+        while '\r\n\r\n' not in response:
+            response += sock.recv(4096)
+        head, body = response.split('\r\n\r\n', 1)
+        length = int([ line for line in head.split('\r\n') if line.lower().startswith('content-length') ][0].split(':')[1])
+        while len(body) < length:
+            body += sock.recv(4096)
+        return head, body
+    
+    def test_keepalive(self):
+        sock = self.serve(keepalive=0.3)
+        head, first = self.get(sock, '/a')
+        self.assertTrue(head.startswith('HTTP/1.1 200'))
+        self.assertEqual(first, '/a')
+        self.assertEqual(self.get(sock, '/b')[1], '/b') # on the same connection
+        time.sleep(0.6)
+        self.assertEqual(sock.recv(4096), '') # closed after being idle
+    
+    def test_no_keepalive(self):
+        sock = self.serve(keepalive=0)
+        self.get(sock, '/a')
+        self.assertEqual(sock.recv(4096), '')
+    
+    def test_stop(self):
+        self.serve(keepalive=5)
+        self.server.stop(5)
+        self.assertTrue(self.server.stopped.is_set())
+
+class CountRequestsTest(unittest.TestCase):
+    
+    def test_on_limit(self):
+        limits = []
+        counted = count_requests(app, 3, lambda: limits.append(len(limits)))
+        for i in range(5):
+            counted(dict(PATH_INFO='/'), lambda status, headers: None)
+            self.assertEqual(len(limits), 0 if i < 2 else 1)
+
+class PreforkMasterTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.handlers = dict((sig, signal.getsignal(sig)) for sig in [ signal.SIGHUP, signal.SIGTERM, signal.SIGINT ])
+    
+    def tearDown(self):
+        for sig, handler in self.handlers.items():
+            signal.signal(sig, handler)
+    
+    def test_gives_up(self):
+        taken = make_listener('127.0.0.1', 0) # without SO_REUSEPORT, so that the workers cannot bind
+        self.addCleanup(taken.close)
+        master = PreforkMaster(app, '127.0.0.1', taken.getsockname()[1], workers=1, threads=1)
+        master.backoff, master.max_failures = 0.05, 3
+        delays = []
+        spawn = master.spawn
+        def spawned(slot):
+            delays.append(time.time())
+            return spawn(slot)
+        master.spawn = spawned
+        start = time.time()
+        self.assertRaises(RuntimeError, master.run)
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(len(delays), 3)
+        self.assertEqual(master.failures, { 0: 3 })
+        self.assertEqual(master.workers, {})
+        self.assertGreaterEqual(delays[2] - delays[1], 0.1) # the delay doubles
+    
+    def test_backoff(self):
+        master = PreforkMaster.__new__(PreforkMaster)
+        master.started, master.failures, master.respawns = { 0: time.time(), 1: time.time() - 60 }, {}, {}
+        master.stopping = master.failed = False
+        master.backoff, master.max_backoff, master.max_failures = 1, 3, 10
+        spawned = []
+        master.spawn = spawned.append
+        for failures in range(1, 5):
+            master._exited(100, 0, 256)
+            self.assertAlmostEqual(master.respawns[0] - time.time(), min(2 ** (failures - 1), 3), places=1)
+        master._exited(101, 1, 256) # after running for a while, the worker is replaced at once
+        self.assertEqual(spawned, [ 1 ])
+        self.assertEqual(master.failures[1], 0)
+
+@unittest.skipIf(HTTPBaseServer is None, 'requires barrel')
+class ServingOptionsTest(unittest.TestCase):
+    
+    def options(self, config, args=None):
+        server = HTTPBaseServer.__new__(HTTPBaseServer)
+        server.config, server.cmmd_line_args = dict(Serving=config), args or {}
+        return server.serving_options()
+    
+    def test_types(self):
+        options = self.options(dict(keepalive='2.5', threads='20', cpu_affinity='yes'))
+        self.assertEqual((options['keepalive'], options['threads'], options['cpu_affinity']), (2.5, 20, True))
+    
+    def test_command_line(self):
+        options = self.options(dict(keepalive='2.5', mode='threaded'), dict(keepalive=0.5, serving='prefork'))
+        self.assertEqual((options['keepalive'], options['mode']), (0.5, 'prefork'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+'''
+Tests of the statistics of a :py:class:`boots.servers.managedserver.ManagedServer` - the Stats plugin (outermost, so requests
+answered by other plugins are counted), the exact latency buckets of :py:class:`StatsEntry` and the per thread shards of
+:py:class:`StatsCollection`
+'''
+from boots.common.config import Config
+from boots.common.inflight import InFlight
+from boots.common.metrics import LATENCY_BUCKETS
+from boots.endpoints.http_ep import Drain
+import bottle
+import threading
+import unittest
+try:
+    from boots.servers.managedserver import ManagedServer, Stats, StatsEntry, StatsCollection, RouteStatsCollection
+except ImportError: # requires barrel
+    ManagedServer = StatsCollection = None
+
+class Server(object):
+    ''' collects what the Stats plugin reports '''
+    def __init__(self):
+        self.collected = []
+
+    def stats_collector(self, handler_name, url, time_taken, start_time, end_time, _status=None, _endpoint=None, **kargs):
+        self.collected.append((handler_name, _status, _endpoint))
+
+class Handler(object):
+    name = 'users'
+
+    def __init__(self, server):
+        self.server = server
+
+    def get_user(self):
+        return 'user'
+
+@unittest.skipIf(ManagedServer is None, 'requires barrel')
+class StatsPluginTest(unittest.TestCase):
+
+    def setUp(self):
+        InFlight.resume()
+        bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'PATH_INFO': '/get_user' })
+        bottle.response.bind()
+        self.server = Server()
+        self.handler = Handler(self.server)
+
+    def tearDown(self):
+        InFlight.resume()
+
+    def test_outermost(self):
+        server = ManagedServer.__new__(ManagedServer)
+        server.config, server.handle_exception = Config(), True
+        plugins = server.get_standard_plugins([])
+        self.assertIsInstance(plugins[0], Stats)
+        self.assertIsInstance(plugins[1], Drain)
+
+    def test_counts_refused(self):
+        # installed as get_standard_plugins orders them - Stats outside Drain
+        wrapper = Stats().apply(Drain().apply(self.handler.get_user, {}), {})
+        self.assertEqual(wrapper(), 'user')
+        InFlight.drain(timeout=0)
+        with self.assertRaises(bottle.HTTPError):
+            wrapper()
+        self.assertEqual(self.server.collected, [ ('get_user', 200, 'users'), ('get_user', 503, 'users') ])
+
+class StatsEntryTest(unittest.TestCase):
+
+    @unittest.skipIf(ManagedServer is None, 'requires barrel')
+    def test_exact_buckets(self):
+        total, values = StatsEntry(), [ 0.005, 0.0051, 0.05, 0.0501, 2.5, 20 ]
+        for i in range(2):
+            entry = StatsEntry()
+            for value in values[i::2]:
+                entry.add(value, None)
+            total.add(entry, None)
+        self.assertEqual(total.histogram.cumulative(LATENCY_BUCKETS),
+                         [ len([ v for v in values if v <= bound ]) for bound in LATENCY_BUCKETS ])
+        self.assertEqual((total['total_count'], total['min'], total['max']), (6, 0.005, 20))
+
+if StatsCollection is not None:
+    class Collection(StatsCollection):
+        ''' a collection with its own shards '''
+        lock = threading.RLock()
+        shards = []
+        retired = {}
+        _local = threading.local()
+
+@unittest.skipIf(StatsCollection is None, 'requires barrel')
+class StatsCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        Collection.shards[:] = []
+        Collection.retired.clear()
+        Collection._local = threading.local()
+
+    def run_threads(self, count, adds):
+        def run():
+            for i in xrange(adds):
+                Collection.add('route%d' % (i % 2), 0.001 * (i + 1), '/url')
+        threads = [ threading.Thread(target=run) for _ in range(count) ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+    def test_concurrent(self):
+        self.run_threads(8, 1000)
+        table = Collection.get()
+        self.assertEqual(sorted(table), [ 'route0', 'route1' ])
+        self.assertEqual(table['route0']['total_count'] + table['route1']['total_count'], 8000)
+        self.assertEqual((table['route0']['min'], table['route1']['max']), (0.001, 1.0))
+        self.assertAlmostEqual(table['route0']['mean'], 0.5, places=6)
+        self.assertEqual(table['route0'].histogram.total, 4000)
+        self.assertIsNotNone(table['route0']['p99'])
+
+    def test_retired(self):
+        self.run_threads(4, 10)
+        self.run_threads(4, 10)
+        table = Collection.get()
+        self.assertEqual(Collection.shards, []) # the shards of the threads that exited are folded in
+        self.assertEqual(table['route0']['total_count'] + table['route1']['total_count'], 80)
+        Collection.add('route0', 0.5, '/url') # this thread's shard
+        self.assertEqual(len(Collection.shards), 1)
+        self.assertEqual(Collection.get()['route0']['total_count'], 41)
+
+    def test_get_is_a_copy(self):
+        Collection.add('route0', 0.1, '/url')
+        table = Collection.get()
+        table['route0'].add(0.2, '/url')
+        self.assertEqual(Collection.get()['route0']['total_count'], 1)
+
+    def test_separate_collections(self):
+        Collection.add('route0', 0.1, '/url')
+        self.assertNotIn('route0', RouteStatsCollection.get())
+
+if __name__ == '__main__':
+    unittest.main()
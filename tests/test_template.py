@@ -0,0 +1,94 @@
+'''
+Tests of :py:class:`boots.common.template.TemplateRegistry` - precompilation, caching and recompilation of modified templates
+'''
+from boots.common.template import TemplateRegistry, BootsTemplate
+import bottle
+import os
+import shutil
+import tempfile
+import unittest
+
+class TemplateRegistryTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.write('hello.tpl', 'Hello {{name}}')
+        self.write('page.tpl', '<h1>{{title}}</h1>')
+        self.write('notes.txt', 'not a template')
+        self.saved = (list(TemplateRegistry.paths), TemplateRegistry.check_interval)
+        TemplateRegistry.clear()
+        TemplateRegistry.check_interval = 0
+    
+    def tearDown(self):
+        TemplateRegistry.paths[:], TemplateRegistry.check_interval = self.saved
+        TemplateRegistry.clear()
+        shutil.rmtree(self.dir)
+    
+    def write(self, filename, source, mtime=None):
+        path = os.path.join(self.dir, filename)
+        with open(path, 'w') as fp:
+            fp.write(source)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+    
+    def counts(self):
+        stats = TemplateRegistry.stats()
+        return stats['hits'], stats['misses']
+    
+    def test_precompile(self):
+        hits, misses = self.counts()
+        TemplateRegistry.add_path(self.dir)
+        self.assertEqual(self.counts(), (hits, misses + 2)) # the .tpl files
+        self.assertEqual(TemplateRegistry.stats()['templates'], 2)
+        self.assertIn(os.path.abspath(self.dir), TemplateRegistry.lookup())
+        self.assertEqual(TemplateRegistry.render('hello', name='bob'), 'Hello bob')
+        self.assertEqual(self.counts(), (hits + 1, misses + 2))
+    
+    def test_cached(self):
+        TemplateRegistry.add_path(self.dir, precompile=False)
+        template = TemplateRegistry.get('hello')
+        self.assertIsInstance(template, BootsTemplate)
+        self.assertIs(TemplateRegistry.get('hello'), template)
+    
+    def test_recompiled_when_modified(self):
+        TemplateRegistry.add_path(self.dir)
+        template = TemplateRegistry.get('hello')
+        path = self.write('hello.tpl', 'Hi {{name}}', mtime=os.path.getmtime(template.filename) + 10)
+        self.assertEqual(TemplateRegistry.render('hello', dict(name='bob')), 'Hi bob')
+        self.assertIsNot(TemplateRegistry.get('hello'), template)
+        self.assertEqual(TemplateRegistry.get('hello').filename, path)
+    
+    def test_check_interval(self):
+        TemplateRegistry.check_interval = 60
+        TemplateRegistry.add_path(self.dir)
+        template = TemplateRegistry.get('hello')
+        self.write('hello.tpl', 'Hi {{name}}', mtime=os.path.getmtime(template.filename) + 10)
+        self.assertIs(TemplateRegistry.get('hello'), template) # not checked again yet
+    
+    def test_deleted(self):
+        TemplateRegistry.add_path(self.dir)
+        os.remove(os.path.join(self.dir, 'hello.tpl'))
+        self.assertIsNone(TemplateRegistry.get('hello'))
+        self.assertNotIn('hello', TemplateRegistry.templates)
+        with self.assertRaises(bottle.HTTPError) as error:
+            TemplateRegistry.render('hello', name='bob')
+        self.assertEqual(error.exception.status_code, 500)
+    
+    def test_get_file(self):
+        path = os.path.join(self.dir, 'page.tpl')
+        template = TemplateRegistry.get_file(path)
+        self.assertEqual(template.render(title='x'), '<h1>x</h1>')
+        self.assertIs(TemplateRegistry.get_file(path), template)
+        self.assertIsNone(TemplateRegistry.get_file(os.path.join(self.dir, 'missing.tpl')))
+    
+    def test_include(self):
+        self.write('layout.tpl', '%include hello name=name\n!')
+        TemplateRegistry.add_path(self.dir)
+        self.assertEqual(TemplateRegistry.render('layout', name='bob'), 'Hello bob!')
+    
+    def test_source(self):
+        self.assertEqual(TemplateRegistry.render('Bye {{name}}', name='bob'), 'Bye bob')
+
+if __name__ == '__main__':
+    unittest.main()
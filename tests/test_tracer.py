@@ -0,0 +1,113 @@
+'''
+Tests of :py:class:`boots.endpoints.http_ep.Tracer` - sampling, route matching and the background :py:class:`TraceWriter`
+'''
+from boots.endpoints.http_ep import Tracer, TraceWriter
+import bottle
+import logging
+import time
+import unittest
+
+logging.getLogger('tests.tracer').addHandler(logging.NullHandler()) # records written after a test completes
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+    
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+class Handlers(object):
+    def hello(self, name=None):
+        return 'hello %s' % name
+
+class TracerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.logger = logging.getLogger('tests.tracer')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.records = ListHandler()
+        self.logger.addHandler(self.records)
+        bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'QUERY_STRING': '', 'PATH_INFO': '/hello/you' })
+    
+    def tearDown(self):
+        self.logger.removeHandler(self.records)
+    
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, Tracer, match_on='path')
+        self.assertRaises(ValueError, Tracer, sample=0)
+        self.assertRaises(ValueError, Tracer, sample=-0.5)
+        self.assertRaises(ValueError, Tracer, sample=2.5) # neither a fraction nor 1 in N
+        self.assertRaises(ValueError, Tracer, sample='2.5')
+    
+    def test_sample_settings(self):
+        self.assertIsNone(Tracer(sample=1).sample)
+        self.assertEqual(Tracer(sample='10').sample, 10)
+        self.assertEqual(Tracer(sample='0.25').sample, 0.25)
+        self.assertIsNone(Tracer(sample='1.0').sample)
+        self.assertEqual(Tracer(sample=10.0).sample, 10)
+        self.assertIs(type(Tracer(sample='10.0').sample), int)
+    
+    def test_sampled_one_in_n(self):
+        tracer = Tracer(sample=4)
+        self.assertEqual([ n for n in range(12) if tracer.sampled(n) ], [ 0, 4, 8 ])
+        self.assertTrue(all(Tracer().sampled(n) for n in range(5)))
+    
+    def test_sampled_fraction(self):
+        tracer = Tracer(sample=0.5)
+        count = sum(1 for n in range(4000) if tracer.sampled(n))
+        self.assertTrue(1600 < count < 2400, count)
+    
+    def test_route_matching(self):
+        tracer = Tracer(tracer_paths=[ '/hello' ], match_on='route')
+        callback = Handlers().hello
+        self.assertIs(tracer.apply(callback, dict(rule='/other')), callback)
+        self.assertIsNone(tracer.phases(callback, dict(rule='/other')))
+        self.assertIsNot(tracer.apply(callback, dict(rule='/hello/<name>')), callback)
+        # urls are matched per request, so every route is wrapped
+        self.assertIsNot(Tracer(tracer_paths=[ '/hello' ]).apply(callback, dict(rule='/other')), callback)
+    
+    def test_url_matching(self):
+        tracer = Tracer(tracer_paths=[ 'http://[^/]+/hello' ])
+        self.assertTrue(tracer.url_matches('http://host/hello/you'))
+        self.assertFalse(tracer.url_matches('http://host/bye'))
+        self.assertFalse(Tracer(tracer_paths=None).url_matches('http://host/hello'))
+    
+    def test_background_writer(self):
+        tracer = Tracer(background=True)
+        tracer.writer.logger = self.logger
+        route = tracer.apply(Handlers().hello, dict(rule='/hello/<name>'))
+        self.assertEqual(route(name='you'), 'hello you')
+        deadline = time.time() + 2
+        while len(self.records.records) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.records.records), 2)
+        self.assertTrue(self.records.records[0].startswith('Request: '))
+        self.assertTrue(self.records.records[1].startswith('Response: '))
+    
+    def test_writer_drops_when_full(self):
+        writer = TraceWriter(maxsize=1, logger=self.logger)
+        block = [ True ]
+        def slow_debug(msg, *args):
+            while block[0]: time.sleep(0.01)
+        self.logger.debug, debug = slow_debug, self.logger.debug
+        try:
+            for i in range(5):
+                writer.write('record %s', i)
+            self.assertGreaterEqual(writer.dropped, 3)
+        finally:
+            block[0] = False
+            del self.logger.debug
+    
+    def test_not_sampled_requests_are_not_traced(self):
+        tracer = Tracer(sample=1000000, background=True)
+        tracer.writer.logger = self.logger
+        route = tracer.apply(Handlers().hello, dict(rule='/hello/<name>'))
+        route(name='x') # the 1st request (count 0) is in the sample
+        route(name='y')
+        time.sleep(0.1)
+        self.assertEqual(len(self.records.records), 2)
+
+if __name__ == '__main__':
+    unittest.main()
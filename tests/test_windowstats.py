@@ -0,0 +1,108 @@
+'''
+Tests of :py:mod:`boots.common.windowstats` - recording into the cells of threads, merging them into slots on rotation and the
+windows reported (requests, rates and percentiles)
+'''
+from boots.common.windowstats import SlidingWindow, WindowedStats
+import os
+import threading
+import unittest
+
+def in_threads(count, fn):
+    threads = [ threading.Thread(target=fn) for _ in range(count) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+class SlidingWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.window = SlidingWindow(4, now=100.0)
+
+    def record(self, threads, requests, latency=0.01):
+        def run():
+            for i in xrange(requests):
+                self.window.add(latency, error=i % 10 == 0)
+        in_threads(threads, run)
+
+    def test_concurrent(self):
+        self.record(8, 1000)
+        requests, errors, duration, histogram = self.window.window(4, 110.0)
+        self.assertEqual((requests, errors, duration, histogram.total), (8000, 800, 10.0, 8000))
+        self.assertAlmostEqual(histogram.percentile(0.5), 0.01, delta=0.001)
+        self.assertEqual(len(self.window.cells[0]), 8) # a cell for each thread
+
+    def test_lock_free(self):
+        class CountingLock(object):
+            acquired = 0
+            def __enter__(self):
+                CountingLock.acquired += 1
+            def __exit__(self, *args):
+                pass
+        self.window.lock = CountingLock()
+        for _ in range(100):
+            self.window.add(0.01)
+        self.assertEqual(CountingLock.acquired, 1) # only to register this thread's cell
+
+    def test_cell_per_slot(self):
+        self.window.add(0.01)
+        self.window.add(0.01)
+        self.assertEqual(len(self.window.cells[0]), 1)
+        self.window.rotate(115.0)
+        self.window.add(0.02) # a new cell, for the new slot
+        self.assertEqual((len(self.window.cells[0]), len(self.window.cells[1])), (1, 1))
+        self.assertEqual(self.window.window(1, 120.0)[0], 1)
+        self.assertEqual(self.window.window(2, 120.0)[0], 3)
+
+    def test_merged_on_rotation(self):
+        self.record(3, 10)
+        self.window.rotate(115.0)
+        self.assertEqual(self.window.slots[0][1], 0) # not merged yet - its threads may still be recording into the cells
+        self.window.rotate(130.0)
+        self.assertEqual((self.window.slots[0][1], self.window.slots[0][2], self.window.cells[0]), (30, 3, []))
+        self.assertEqual(self.window.slots[0][3].total, 30)
+        self.assertEqual(self.window.window(3, 140.0)[:3], (30, 3, 40.0))
+
+    def test_oldest_discarded(self):
+        self.window.add(0.01)
+        for i in range(4):
+            self.window.rotate(115.0 + 15 * i)
+            self.window.add(0.01)
+        self.assertEqual(self.window.window(4, 175.0)[0], 4) # the 1st slot was reused
+        self.assertEqual(self.window.window(1, 175.0)[0], 1)
+
+class WindowedStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = WindowedStats(resolution=15, windows=(('30s', 30), ('1m', 60)))
+        self.stats._pid = os.getpid() # rotated by the test (rather than the scheduler)
+
+    def test_windows(self):
+        self.assertEqual(self.stats.slots, 4)
+        for i in range(20):
+            self.stats.add('get_user', 0.1 if i < 18 else 1.0, error=i >= 18)
+        self.stats.add('get_order', 0.2)
+        window = self.stats.routes['get_user']
+        window.slots[window.current][0] -= 10 # started 10 seconds ago
+        stats = self.stats.stats()
+        self.assertEqual(sorted(stats), [ 'get_order', 'get_user' ])
+        entry = stats['get_user']['30s']
+        self.assertEqual((entry['requests'], entry['errors'], entry['error_rate']), (20, 2, 0.1))
+        self.assertAlmostEqual(entry['rps'], 2, delta=0.1)
+        self.assertAlmostEqual(entry['p50'], 0.1, delta=0.01)
+        self.assertAlmostEqual(entry['p99'], 1.0, delta=0.1)
+
+    def test_rotation(self):
+        self.stats.add('get_user', 0.1)
+        for _ in range(2):
+            self.stats._rotate(os.getpid())
+        self.stats.add('get_user', 0.1)
+        stats = self.stats.stats()['get_user']
+        self.assertEqual((stats['30s']['requests'], stats['1m']['requests']), (1, 2))
+
+    def test_previous_slot(self):
+        self.stats.add('get_user', 0.1)
+        self.stats._rotate(os.getpid())
+        entry = self.stats.stats()['get_user']['30s']
+        self.assertEqual(entry['requests'], 1) # the current and the previous slot
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+'''
+Tests of :py:class:`boots.endpoints.http_ep.WrapException` - handling, fingerprinting and the summaries of exception storms
+'''
+from boots.endpoints.http_ep import WrapException
+import bottle
+import logging
+import time
+import unittest
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+    
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+class Handlers(object):
+    def fail(self, name=None):
+        raise ValueError('down %s' % (name, ))
+    
+    def missing(self):
+        bottle.abort(404, 'not here')
+
+class WrapExceptionTest(unittest.TestCase):
+    
+    def setUp(self):
+        WrapException.exceptions.clear()
+        self.records = ListHandler()
+        self.root = logging.getLogger()
+        self.root.addHandler(self.records)
+        bottle.request.bind({ 'REQUEST_METHOD': 'GET', 'QUERY_STRING': 'name=x', 'PATH_INFO': '/fail' })
+        bottle.response.bind()
+    
+    def tearDown(self):
+        self.root.removeHandler(self.records)
+        WrapException.exceptions.clear()
+    
+    def context(self, **config):
+        return dict(config=config, method='GET', rule='/fail', skip=[])
+    
+    def summaries(self):
+        return [ r for r in self.records.records if 'more times' in r ]
+    
+    def test_handler_and_cleanup(self):
+        cleaned = []
+        handler = lambda errstr, qstr, exception=None, **kargs: 'handled %s %s' % (type(exception).__name__, kargs)
+        route = WrapException().apply(Handlers().fail, self.context(handler=handler, cleanup_funcs=[ lambda qstr, **kargs: cleaned.append(kargs) ]))
+        self.assertEqual(route(name='x'), "handled ValueError {'name': 'x'}")
+        self.assertEqual(cleaned, [ { 'name': 'x' } ])
+    
+    def test_aborts_with_500_without_handler(self):
+        route = WrapException().apply(Handlers().fail, self.context())
+        with self.assertRaises(bottle.HTTPError) as raised:
+            route(name='x')
+        self.assertEqual(raised.exception.status_code, 500)
+        self.assertIn('down x', raised.exception.body)
+        self.assertEqual(bottle.response.headers['Cache-Control'], 'no-cache')
+    
+    def test_http_errors_pass_through(self):
+        route = WrapException().apply(Handlers().missing, self.context())
+        with self.assertRaises(bottle.HTTPError) as raised:
+            route()
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertEqual(WrapException.exceptions, {})
+    
+    def test_storm_is_logged_once_and_summarized(self):
+        plugin = WrapException(storm_window=0.2)
+        route = plugin.apply(Handlers().fail, self.context(handler=lambda *args, **kargs: 'handled'))
+        for _ in range(5): route(name='x')
+        tracebacks = [ r for r in self.records.records if r.startswith('Exception: ') ]
+        self.assertEqual(len(tracebacks), 1)
+        stats = plugin.exception_stats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual((stats[0]['count'], stats[0]['suppressed'], stats[0]['route']), (5, 4, '/fail'))
+        self.assertEqual(stats[0]['type'], 'exceptions.ValueError')
+        # the storm stops. Its summary is logged by the scheduled flush
+        deadline = time.time() + 2
+        while not self.summaries() and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(len(self.summaries()), 1)
+        self.assertIn('occurred 4 more times in 0.2 seconds', self.summaries()[0])
+        self.assertEqual(plugin.exception_stats()[0]['suppressed'], 0)
+    
+    def test_exception_stats_uses_the_storm_window(self):
+        plugin = WrapException(storm_window=3600)
+        route = plugin.apply(Handlers().fail, self.context(handler=lambda *args, **kargs: 'handled'))
+        route(name='x')
+        route(name='x')
+        self.assertEqual(plugin.exception_stats()[0]['suppressed'], 1)
+        self.assertEqual(self.summaries(), [])
+        # the window has elapsed - the suppressed occurrence is summarized when read
+        entry = WrapException.exceptions.values()[0]
+        entry.window_start -= 3601
+        self.assertEqual(plugin.exception_stats()[0]['suppressed'], 0)
+        self.assertEqual(len(self.summaries()), 1)
+    
+    def test_instances_with_different_windows(self):
+        brief, hourly = WrapException(storm_window=0.2), WrapException(storm_window=3600)
+        handler = lambda *args, **kargs: 'handled'
+        fail = Handlers().fail
+        routes = [ brief.apply(fail, self.context(handler=handler)), 
+                   hourly.apply(fail, dict(self.context(handler=handler), rule='/other')) ]
+        for route in routes * 3:
+            route(name='x')
+        time.sleep(0.3)
+        for plugin in [ hourly, brief ]: # either reports (and flushes) each fingerprint on its own window
+            stats = dict((entry['route'], entry['suppressed']) for entry in plugin.exception_stats())
+            self.assertEqual(stats, { '/fail': 0, '/other': 2 })
+        self.assertEqual(len(self.summaries()), 1)
+        self.assertIn('occurred 2 more times in 0.2 seconds', self.summaries()[0])
+    
+    def test_trace_is_cached_per_fingerprint(self):
+        route = WrapException().apply(Handlers().fail, self.context(handler=lambda errstr, *args, **kargs: errstr))
+        first, second = route(name='a'), route(name='b')
+        entry = WrapException.exceptions.values()[0]
+        self.assertTrue(entry.trace)
+        self.assertTrue(first.startswith('down a<br/>'))
+        self.assertEqual(first.split('<br/>', 1)[1], second.split('<br/>', 1)[1])
+
+if __name__ == '__main__':
+    unittest.main()